@@ -213,3 +213,12 @@ STATIC_URL = "/static/"
 
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+
+
+# Upstream API connection pooling (see dashboards/utils/http_sessions.py)
+UPSTREAM_HTTP = {
+    "POOL_CONNECTIONS": 10,
+    "POOL_MAXSIZE": 20,
+    "MAX_RETRIES": 2,
+    "BACKOFF_FACTOR": 0.3,
+}
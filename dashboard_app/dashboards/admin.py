@@ -1,6 +1,6 @@
 # dashboards/admin.py
 from django.contrib import admin
-from .models import ApiDataSource, Dataset, Chart, Dashboard, DashboardChart
+from .models import ApiDataSource, Dataset, DatasetRefreshRun, Chart, Dashboard, DashboardChart
 
 @admin.register(ApiDataSource)
 class ApiDataSourceAdmin(admin.ModelAdmin):
@@ -11,6 +11,11 @@ class ApiDataSourceAdmin(admin.ModelAdmin):
 class DatasetAdmin(admin.ModelAdmin):
     list_display = ("name", "api_source", "endpoint", "created_by", "created_at")
 
+@admin.register(DatasetRefreshRun)
+class DatasetRefreshRunAdmin(admin.ModelAdmin):
+    list_display = ("dataset", "status", "trigger", "mode", "rows", "duration_ms", "started_at")
+    list_filter = ("status", "trigger")
+
 @admin.register(Chart)
 class ChartAdmin(admin.ModelAdmin):
     list_display = ("name", "dataset", "chart_type", "created_by", "created_at")
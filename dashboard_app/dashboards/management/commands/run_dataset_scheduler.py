@@ -0,0 +1,67 @@
+# dashboards/management/commands/run_dataset_scheduler.py
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from dashboards.utils.refresh_scheduler import claim_due_datasets, execute_refresh
+
+
+class Command(BaseCommand):
+    help = "Refresh materialized datasets whose refresh interval has elapsed (safe to run on several nodes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent refreshes")
+        parser.add_argument("--poll", type=float, default=10, help="Seconds between queue polls")
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Refresh every dataset that is due now, then exit",
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options["workers"])
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dataset-refresh")
+        in_flight = set()
+        # --once: only datasets due at start, so short intervals cannot keep it running
+        due_as_of = timezone.now() if options["once"] else None
+
+        try:
+            while True:
+                # Only claim what the pool can start now, so other nodes get the rest
+                claimed = claim_due_datasets(workers - len(in_flight), due_as_of) if len(in_flight) < workers else []
+                for dataset in claimed:
+                    in_flight.add(pool.submit(self._refresh, dataset))
+
+                if options["once"]:
+                    if not in_flight:
+                        break
+                    # Claim more as soon as a worker frees up, until nothing is due
+                    _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    continue
+                if in_flight:
+                    _, in_flight = wait(in_flight, timeout=options["poll"], return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(options["poll"])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping, waiting for running refreshes...")
+        finally:
+            pool.shutdown(wait=True)
+
+        self.stdout.write(self.style.SUCCESS("Dataset scheduler stopped."))
+
+    def _refresh(self, dataset):
+        try:
+            run, payload, status_code = execute_refresh(dataset)
+            if run.status == "success":
+                self.stdout.write(self.style.SUCCESS(
+                    f"Refreshed dataset {dataset.id} ({dataset.name}): "
+                    f"{run.mode}, {run.fetched_rows} fetched, {run.rows} rows, {run.duration_ms} ms"
+                ))
+            else:
+                self.stderr.write(f"Refresh of dataset {dataset.id} ({dataset.name}) failed: {run.error}")
+        finally:
+            # Worker threads open their own DB connection
+            connection.close()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboards', '0011_alter_apidatasource_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='cache_ttl_seconds',
+            field=models.PositiveIntegerField(default=60),
+        ),
+    ]
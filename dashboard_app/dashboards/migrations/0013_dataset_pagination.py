@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboards', '0012_dataset_cache_ttl_seconds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='pagination_config',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='pagination_type',
+            field=models.CharField(choices=[('none', 'None'), ('link_header', 'Link header (rel=next)'), ('next_field', 'JSON next URL field'), ('cursor', 'Cursor'), ('offset', 'Offset / limit')], default='none', max_length=20),
+        ),
+    ]
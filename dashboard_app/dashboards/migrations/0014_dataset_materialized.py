@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboards', '0013_dataset_pagination'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='materialized',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='snapshot_refreshed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='snapshot_rows',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboards', '0014_dataset_materialized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='primary_key',
+            field=models.CharField(blank=True, help_text='Comma-separated key fields used to merge refreshed rows', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='watermark_field',
+            field=models.CharField(blank=True, help_text='Row field that grows on every change, e.g. updated_at or id', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='watermark_param',
+            field=models.CharField(blank=True, help_text='Query param the last watermark is sent as (defaults to the watermark field)', max_length=255),
+        ),
+    ]
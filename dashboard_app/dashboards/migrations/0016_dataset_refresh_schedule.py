@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboards', '0015_dataset_watermark'),
+        ('tenants', '0007_tenantuser_default_payment_method_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='next_refresh_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='refresh_interval_seconds',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='DatasetRefreshRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('success', 'Success'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('trigger', models.CharField(choices=[('scheduler', 'Scheduler'), ('manual', 'Manual')], default='scheduler', max_length=20)),
+                ('mode', models.CharField(blank=True, max_length=20)),
+                ('rows', models.PositiveIntegerField(blank=True, null=True)),
+                ('fetched_rows', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=255)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refresh_runs', to='dashboards.dataset')),
+                ('tenant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='datasetrefreshrun_set', to='tenants.tenant')),
+            ],
+            options={
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['dataset', '-started_at'], name='dashboards__dataset_7b749b_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboards', '0016_dataset_refresh_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apidatasource',
+            name='hedge_requests',
+            field=models.BooleanField(default=False),
+        ),
+    ]
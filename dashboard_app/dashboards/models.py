@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .utils.pagination import PAGINATION_TYPES
+
 
 class ApiDataSource(models.Model):
     AUTH_TYPES = [
@@ -34,6 +36,9 @@ class ApiDataSource(models.Model):
     jwt_issuer = models.CharField(max_length=255, blank=True, null=True)
     jwt_ttl_seconds = models.IntegerField(default=300)
 
+    # ⚡ Hedged requests: re-send requests slower than the source's p95
+    hedge_requests = models.BooleanField(default=False)
+
     tenant = models.ForeignKey(
         "tenants.Tenant",
         on_delete=models.CASCADE,
@@ -80,6 +85,40 @@ class Dataset(models.Model):
     endpoint = models.CharField(max_length=1024)
     query_params = models.JSONField(default=dict, blank=True)
 
+    # 📄 Upstream pagination (see dashboards/utils/pagination.py)
+    pagination_type = models.CharField(max_length=20, choices=PAGINATION_TYPES, default="none")
+    pagination_config = models.JSONField(default=dict, blank=True)
+
+    # ⚡ Result cache (0 disables caching for this dataset)
+    cache_ttl_seconds = models.PositiveIntegerField(default=60)
+
+    # 🧊 Materialized mode: charts read the latest on-disk snapshot
+    # (see dashboards/utils/snapshots.py) instead of calling the upstream
+    materialized = models.BooleanField(default=False)
+    snapshot_refreshed_at = models.DateTimeField(null=True, blank=True)
+    snapshot_rows = models.PositiveIntegerField(null=True, blank=True)
+
+    # 🔁 Incremental refresh of the snapshot
+    watermark_field = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Row field that grows on every change, e.g. updated_at or id"
+    )
+    watermark_param = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Query param the last watermark is sent as (defaults to the watermark field)"
+    )
+    primary_key = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Comma-separated key fields used to merge refreshed rows"
+    )
+
+    # ⏱ Background refresh (run_dataset_scheduler); 0 disables it
+    refresh_interval_seconds = models.PositiveIntegerField(default=0)
+    next_refresh_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
 
@@ -90,6 +129,40 @@ class Dataset(models.Model):
         return self.name
 
 
+class DatasetRefreshRun(models.Model):
+    STATUS_CHOICES = [
+        ("running", "Running"),
+        ("success", "Success"),
+        ("failed", "Failed"),
+    ]
+    TRIGGER_CHOICES = [
+        ("scheduler", "Scheduler"),
+        ("manual", "Manual"),
+    ]
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="refresh_runs")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="running")
+    trigger = models.CharField(max_length=20, choices=TRIGGER_CHOICES, default="scheduler")
+    mode = models.CharField(max_length=20, blank=True)
+    rows = models.PositiveIntegerField(null=True, blank=True)
+    fetched_rows = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=255, blank=True)
+
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-started_at"]
+        indexes = [
+            models.Index(fields=["dataset", "-started_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.dataset} refresh ({self.status})"
+
+
 
 class Chart(models.Model):
     CHART_TYPES = [
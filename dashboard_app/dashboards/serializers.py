@@ -1,8 +1,9 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import ApiDataSource, Dataset, Chart, Dashboard, DashboardChart, Group, ChartJoin
+from .models import ApiDataSource, Dataset, DatasetRefreshRun, Chart, Dashboard, DashboardChart, Group, ChartJoin
 from django.contrib.auth import get_user_model
 from tenants.models import Tenant  # your tenant model
+from .utils.filters import FilterError, compile_chart_predicate
 
 
 User = get_user_model()
@@ -101,6 +102,9 @@ class ApiDataSourceSerializer(serializers.ModelSerializer):
             "jwt_issuer",
             "jwt_ttl_seconds",
 
+            # Performance
+            "hedge_requests",
+
             # Meta
             "created_by",
             "created_at",
@@ -164,15 +168,52 @@ class DatasetSerializer(serializers.ModelSerializer):
             "api_source_name",
             "endpoint",
             "query_params",
+            "pagination_type",
+            "pagination_config",
+            "cache_ttl_seconds",
+            "materialized",
+            "snapshot_refreshed_at",
+            "snapshot_rows",
+            "watermark_field",
+            "watermark_param",
+            "primary_key",
+            "refresh_interval_seconds",
+            "next_refresh_at",
             "created_by",
             "created_at",
         ]
-        read_only_fields = ["created_by", "created_at"]
+        read_only_fields = [
+            "created_by",
+            "created_at",
+            "snapshot_refreshed_at",
+            "snapshot_rows",
+            "next_refresh_at",
+        ]
 
     def get_api_source_name(self, obj):
         return obj.api_source.name if obj.api_source else None
 
 
+class DatasetRefreshRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DatasetRefreshRun
+        fields = [
+            "id",
+            "dataset",
+            "status",
+            "trigger",
+            "mode",
+            "rows",
+            "fetched_rows",
+            "error",
+            "worker",
+            "started_at",
+            "finished_at",
+            "duration_ms",
+        ]
+        read_only_fields = fields
+
+
 class ChartJoinSerializer(serializers.ModelSerializer):
     left_dataset = serializers.PrimaryKeyRelatedField(
         queryset=Dataset.objects.all()
@@ -245,6 +286,16 @@ class ChartSerializer(serializers.ModelSerializer):
         joins = attrs.get("joins", [])
         excel_data = attrs.get("excel_data", None)
 
+        # Filters / logic rules must compile before they are saved
+        try:
+            compile_chart_predicate(
+                attrs.get("filters"),
+                attrs.get("logic_rules"),
+                attrs.get("logic_expression"),
+            )
+        except FilterError as e:
+            raise serializers.ValidationError({"filters": str(e)})
+
         # Excel chart case — accept if excel_data is a non-empty list
         if excel_data is not None:
             if isinstance(excel_data, list) and len(excel_data) == 0:
@@ -1,3 +1,1007 @@
-from django.test import TestCase
+import gc
+import gzip
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import jwt
+import requests
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from .models import ApiDataSource, Chart, ChartJoin, Dataset
+from .serializers import DatasetSerializer
+from .utils.aggregation import aggregate_rows, project_rows
+from .utils.chart_runner import (
+    CHART_PREFETCH_RELATED,
+    CHART_SELECT_RELATED,
+    build_chart_payload,
+    run_chart,
+    run_charts,
+    shape_chart_payload,
+)
+from .utils.dataset_cache import DatasetResultCache, dataset_cache, make_cache_key
+from .utils.circuit_breaker import OPEN, CircuitOpenError, breaker_registry, get_breaker, guarded_get
+from .utils.deadlines import Deadline, DeadlineExceeded, deadline_scope
+from .utils.dataset_runner import iter_dataset_pages, normalize_payload, refresh_snapshot, run_dataset
+from .utils.fetch_scheduler import FairFetchScheduler
+from .utils.hedging import hedge_budget, hedged_get
+from .utils.http_sessions import get_session
+from .utils.filters import FilterError, compile_chart_predicate, filter_rows
+from .utils.joins import SpilledRows, hash_join, spool_rows
+from .utils.jwt_tokens import JwtTokenCache
+from .utils.negative_cache import failure_cache
+from .utils.pending_results import get_result
+from .utils.refresh_scheduler import execute_refresh
+from .utils.json_stream import stream_payload
+from .utils.single_flight import SingleFlight, _cache_keys, coalesce
+from .utils.snapshots import SnapshotReader, open_snapshot, write_snapshot
+from .utils.sse import _async_events, event_stream_response, sse_event
+from .utils.transfer import iter_decoded, transfer_stats
+from .views import DatasetViewSet
+
+
+ROWS = [{"id": i, "group": "abc"[i % 3], "value": i} for i in range(25)]
+# Served by /changes: the first five rows, or every row updated after ?since=
+CHANGES = [{"id": i, "updated": i + 1, "value": "old"} for i in range(5)] + [
+    {"id": 2, "updated": 6, "value": "new"},
+    {"id": 9, "updated": 7, "value": "new"},
+]
+
+
+# ---------- Fake upstream ----------
+@contextmanager
+def socket_closed_port():
+    """URL of a local port nothing listens on (connections are refused)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    yield f"http://127.0.0.1:{port}/"
+
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    """Serves ROWS in pages of 10, one path per pagination type."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.server.hits.append(self.path)
+        headers = {}
+
+        if url.path == "/next":
+            page = int(query.get("page", 0))
+            more = page * 10 + 10 < len(ROWS)
+            body = {"results": ROWS[page * 10:page * 10 + 10], "next": f"/next?page={page + 1}" if more else None}
+        elif url.path == "/cursor":
+            cursor = int(query.get("cursor", 0))
+            more = cursor + 10 < len(ROWS)
+            body = {"data": ROWS[cursor:cursor + 10], "meta": {"next_cursor": cursor + 10 if more else None}}
+        elif url.path == "/offset":
+            offset, limit = int(query.get("offset", 0)), int(query.get("limit", 10))
+            body = {"rows": ROWS[offset:offset + limit]}
+        elif url.path == "/link":
+            page = int(query.get("page", 0))
+            body = ROWS[page * 10:page * 10 + 10]
+            if page * 10 + 10 < len(ROWS):
+                headers["Link"] = f'</link?page={page + 1}>; rel="next"'
+        elif url.path == "/slow":
+            time.sleep(float(query.get("sleep", 1)))
+            body = {"results": ROWS}
+        elif url.path == "/unavailable":
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        elif url.path == "/etag":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            headers["ETag"] = '"v1"'
+            body = {"results": ROWS}
+        elif url.path == "/changes":
+            if "since" in query:
+                body = {"results": [row for row in CHANGES if row["updated"] > float(query["since"])]}
+            else:
+                body = {"results": CHANGES[:5]}
+        elif url.path == "/gzip":
+            headers["Content-Encoding"] = "gzip"
+            body = {"results": ROWS}
+        else:
+            body = {"results": ROWS}
+
+        data = json.dumps(body).encode()
+        if headers.get("Content-Encoding") == "gzip":
+            data = gzip.compress(data)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients that time out on purpose hang up mid-response
+
+
+class UpstreamServerMixin:
+    handler = UpstreamHandler
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = UpstreamServer(("127.0.0.1", 0), cls.handler)
+        cls.server.hits = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.hits.clear()
+        dataset_cache.clear()
+
+    def make_dataset(self, endpoint, **kwargs):
+        source = ApiDataSource(name="upstream", base_url=self.base_url)
+        kwargs.setdefault("cache_ttl_seconds", 0)
+        return Dataset(name=endpoint, api_source=source, endpoint=endpoint, **kwargs)
+
+
+class UpstreamTestCase(UpstreamServerMixin, SimpleTestCase):
+    pass
+
+
+# ---------- Pagination ----------
+class PaginationTests(UpstreamTestCase):
+    def assertAllRows(self, dataset):
+        payload, status_code = run_dataset(dataset, None)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(payload["data"], ROWS)
+        self.assertNotIn("truncated", payload)
+
+    def test_next_field(self):
+        self.assertAllRows(self.make_dataset("/next", pagination_type="next_field"))
+        self.assertEqual(len(self.server.hits), 3)
+
+    def test_cursor(self):
+        dataset = self.make_dataset(
+            "/cursor",
+            pagination_type="cursor",
+            pagination_config={"cursor_field": "meta.next_cursor"},
+        )
+        self.assertAllRows(dataset)
+        self.assertEqual(len(self.server.hits), 3)
+
+    def test_offset(self):
+        dataset = self.make_dataset("/offset", pagination_type="offset", pagination_config={"page_size": 10})
+        self.assertAllRows(dataset)
+        self.assertEqual(len(self.server.hits), 3)
+
+    def test_link_header(self):
+        self.assertAllRows(self.make_dataset("/link", pagination_type="link_header"))
+        self.assertEqual(len(self.server.hits), 3)
+
+    def test_none_fetches_one_page(self):
+        self.assertAllRows(self.make_dataset("/all"))
+        self.assertEqual(len(self.server.hits), 1)
+
+    def test_max_pages(self):
+        dataset = self.make_dataset("/next", pagination_type="next_field", pagination_config={"max_pages": 2})
+        with self.assertLogs("dashboards.utils.pagination", "WARNING"):
+            payload, _ = run_dataset(dataset, None)
+        self.assertEqual(payload["data"], ROWS[:20])
+        self.assertTrue(payload["truncated"])
+
+    def test_query_auth_is_sent_with_every_page(self):
+        for endpoint, pagination_type in (("/next", "next_field"), ("/link", "link_header")):
+            with self.subTest(pagination_type=pagination_type):
+                self.server.hits.clear()
+                dataset = self.make_dataset(endpoint, pagination_type=pagination_type)
+                source = dataset.api_source
+                source.auth_type, source.api_key_name, source.api_key = "API_KEY_QUERY", "key", "secret"
+                self.assertAllRows(dataset)
+                self.assertEqual(len(self.server.hits), 3)
+                for hit in self.server.hits:
+                    self.assertEqual(parse_qs(urlparse(hit).query)["key"], ["secret"])
+
+    def test_body_pages_report_their_size(self):
+        pages = list(iter_dataset_pages(self.make_dataset("/next", pagination_type="next_field")))
+        self.assertEqual(len(pages), 3)
+        for payload, counter, resp in pages:
+            self.assertGreater(counter.bytes, 0)
+            self.assertNotIn("next", payload)
+
+
+# ---------- Dataset cache ----------
+class DatasetCacheTests(UpstreamTestCase):
+    def expire(self, dataset):
+        key = make_cache_key(None, dataset)
+        entry = dataset_cache._entries[key]
+        dataset_cache._entries[key] = entry._replace(expires_at=time.monotonic() - 1)
+
+    def test_entries_expire_and_least_recently_used_are_evicted(self):
+        cache = DatasetResultCache(max_bytes=100)
+        for i in range(2):
+            cache.set((None, i), {"data": [i]}, ttl=60, size=40)
+        cache.get((None, 0))
+        cache.set((None, 2), {"data": [2]}, ttl=60, size=40)
+        self.assertIsNone(cache.get((None, 1)))
+        self.assertEqual(cache.get((None, 0)), {"data": [0]})
+
+        cache.set((None, 3), {"data": [3]}, ttl=0.01, size=1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get((None, 3)))
+        self.assertEqual(cache.get((None, 3), allow_stale=True), {"data": [3]})
+
+    def test_expired_entry_is_served_stale_while_it_refreshes(self):
+        dataset = self.make_dataset("/all", cache_ttl_seconds=60)
+        run_dataset(dataset, None)
+        self.expire(dataset)
+
+        payload, status_code = run_dataset(dataset, None)
+        self.assertEqual(status_code, 200)
+        self.assertTrue(payload["stale"])
+        self.assertEqual(payload["data"], ROWS)
+        for _ in range(50):
+            if len(self.server.hits) == 2 and dataset_cache.stored_size(make_cache_key(None, dataset)):
+                break
+            time.sleep(0.02)
+        self.assertEqual(run_dataset(dataset, None), ({"data": ROWS}, 200))
+        self.assertEqual(len(self.server.hits), 2)
+
+    @override_settings(DATASET_STALE_GRACE_SECONDS=0)
+    def test_expired_entry_is_revalidated_with_its_etag(self):
+        dataset = self.make_dataset("/etag", cache_ttl_seconds=60)
+        first = run_dataset(dataset, None)
+        self.expire(dataset)
+        revalidations = dataset_cache.stats()["revalidations"]
+
+        self.assertEqual(run_dataset(dataset, None), first)
+        self.assertEqual(len(self.server.hits), 2)
+        self.assertEqual(dataset_cache.stats()["revalidations"], revalidations + 1)
+
+
+class DatasetCacheKeyTests(UpstreamServerMixin, TestCase):
+    def test_pagination_is_part_of_the_key(self):
+        paged = self.make_dataset("/next", pagination_type="next_field")
+        self.assertNotEqual(make_cache_key(None, paged), make_cache_key(None, self.make_dataset("/next")))
+        capped = self.make_dataset("/next", pagination_type="next_field", pagination_config={"max_pages": 2})
+        self.assertNotEqual(make_cache_key(None, paged), make_cache_key(None, capped))
+
+    def test_updating_a_dataset_drops_its_cached_result(self):
+        source = ApiDataSource.objects.create(name="upstream", base_url=self.base_url)
+        dataset = Dataset.objects.create(name="next", api_source=source, endpoint="/next", cache_ttl_seconds=60)
+        self.assertEqual(run_dataset(dataset, None)[0]["data"], ROWS[:10])
+        old_key = make_cache_key(None, dataset)
+
+        serializer = DatasetSerializer(dataset, data={"pagination_type": "next_field"}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        DatasetViewSet().perform_update(serializer)
+        self.assertIsNone(dataset_cache.get(old_key))
+        self.assertEqual(run_dataset(dataset, None)[0]["data"], ROWS)
+
+@override_settings(UPSTREAM_HTTP={"MAX_RETRIES": 0})
+class NegativeCacheTests(UpstreamTestCase):
+    def test_failed_fingerprint_backs_off(self):
+        source = ApiDataSource(id=9003, name="upstream", base_url=self.base_url)
+        dataset = Dataset(name="down", api_source=source, endpoint="/unavailable", cache_ttl_seconds=0)
+        self.addCleanup(breaker_registry.reset, source.id)
+        self.addCleanup(failure_cache.invalidate_source, source.id)
+
+        _, status_code = run_dataset(dataset, None)
+        self.assertEqual(status_code, 502)
+        payload, status_code = run_dataset(dataset, None)
+        self.assertEqual(status_code, 502)
+        self.assertGreaterEqual(payload["retry_after"], 1)
+        self.assertEqual(len(self.server.hits), 1)
+
+
+# ---------- Aggregation ----------
+class AggregationTests(SimpleTestCase):
+    def test_aggregations(self):
+        rows = [{"g": "a", "v": 1}, {"g": "b", "v": "2"}, {"g": "a", "v": 3}, {"g": "a", "v": None}]
+        expected = {
+            "sum": [{"g": "a", "v": 4}, {"g": "b", "v": 2.0}],
+            "avg": [{"g": "a", "v": 2.0}, {"g": "b", "v": 2.0}],
+            "min": [{"g": "a", "v": 1}, {"g": "b", "v": 2.0}],
+            "max": [{"g": "a", "v": 3}, {"g": "b", "v": 2.0}],
+            "count": [{"g": "a", "v": 3}, {"g": "b", "v": 1}],
+        }
+        for aggregation, series in expected.items():
+            with self.subTest(aggregation=aggregation):
+                self.assertEqual(aggregate_rows(iter(rows), "g", "v", aggregation), series)
+
+    def test_count_without_y_field(self):
+        rows = [{"g": "a"}, {"g": "b"}, {"g": "a"}]
+        self.assertEqual(aggregate_rows(rows, "g", None, "count"), [{"g": "a", "count": 2}, {"g": "b", "count": 1}])
+
+    def test_non_object_rows_pass_through(self):
+        self.assertEqual(aggregate_rows([["a", 1], ["b", 2]], "g", "v", "sum"), [["a", 1], ["b", 2]])
+        self.assertEqual(aggregate_rows([1, 2, 3], "g", "v", "count"), [1, 2, 3])
+        self.assertEqual(project_rows([{"g": "a", "v": 1, "x": 0}, [1, 2]], ["g", "v"]), [{"g": "a", "v": 1}, [1, 2]])
+
+    def test_chart_with_list_rows(self):
+        rows = [["a", 1], ["b", 2]]
+        for aggregation in ("sum", "none"):
+            chart = Chart(name="c", chart_type="bar", x_field="g", y_field="v", aggregation=aggregation)
+            payload, status_code = shape_chart_payload(chart, rows)
+            self.assertEqual(status_code, 200)
+            self.assertEqual(payload["data"], rows)
+
+    def test_chart_without_y_field(self):
+        rows = [{"g": "a", "v": 1}, {"g": "a", "v": 2}]
+        chart = Chart(name="c", chart_type="bar", x_field="g", aggregation="count")
+        self.assertEqual(shape_chart_payload(chart, rows)[0]["data"], [{"g": "a", "count": 2}])
+        chart.aggregation = "sum"
+        self.assertEqual(shape_chart_payload(chart, rows)[0]["data"], [{"g": "a"}, {"g": "a"}])
+
+    def test_chart_without_x_field_is_a_single_total(self):
+        rows = [{"g": "a", "v": 1}, {"g": "b", "v": "2"}, {"g": "a", "v": 3}]
+        cases = [("sum", "v", {"v": 6}), ("avg", "v", {"v": 2.0}), ("none", "v", {"v": 6}), ("sum", None, {"count": 3})]
+        for aggregation, y_field, total in cases:
+            with self.subTest(aggregation=aggregation, y_field=y_field):
+                chart = Chart(name="c", chart_type="kpi", y_field=y_field, aggregation=aggregation)
+                payload, status_code = shape_chart_payload(chart, iter(rows))
+                self.assertEqual(status_code, 200)
+                self.assertEqual((payload["data"], payload["source_rows"]), ([total], 3))
+        self.assertEqual(aggregate_rows([], None, "v", "sum"), [{"v": 0}])
+        table = Chart(name="c", chart_type="table", aggregation="sum")
+        self.assertEqual(shape_chart_payload(table, rows)[0]["data"], rows)
+
+    def test_excel_data_that_is_not_a_row_list(self):
+        for excel_data in ({"a": 1}, "text"):
+            chart = Chart(name="c", chart_type="bar", x_field="g", y_field="v", aggregation="sum", excel_data=excel_data)
+            self.assertEqual(build_chart_payload(chart, {}), ({"data": excel_data}, 200))
+
+        chart = Chart(name="c", chart_type="bar", x_field="g", y_field="v", aggregation="sum", excel_data=[1, 2, 3])
+        payload, status_code = build_chart_payload(chart, {})
+        self.assertEqual((payload["data"], status_code), ([1, 2, 3], 200))
+
+
+# ---------- Upstream sessions ----------
+@override_settings(UPSTREAM_CIRCUIT_BREAKER={"TIMEOUT_MAX": 0.3})
+class UpstreamSessionTests(UpstreamTestCase):
+    def get(self, path):
+        source = ApiDataSource(name="upstream", base_url=self.base_url)
+        return guarded_get(get_session(source), source, self.base_url + path)
+
+    def test_read_timeout_is_not_retried(self):
+        started = time.monotonic()
+        with self.assertRaises(requests.Timeout):
+            self.get("/slow?sleep=1")
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(len(self.server.hits), 1)
+
+    @override_settings(UPSTREAM_HTTP={"MAX_RETRIES": 2, "BACKOFF_FACTOR": 0})
+    def test_retryable_status_is_retried(self):
+        self.assertEqual(self.get("/unavailable").status_code, 503)
+        self.assertEqual(len(self.server.hits), 3)
+
+
+# ---------- JWT auth ----------
+class JwtTokenCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = JwtTokenCache()
+        self.source = ApiDataSource(
+            id=9005,
+            name="upstream",
+            base_url="http://upstream.invalid",
+            jwt_secret="a" * 32,
+            jwt_subject="dashboards",
+            jwt_audience="upstream",
+            jwt_ttl_seconds=60,
+        )
+
+    def test_token_is_reused_until_its_refresh_margin(self):
+        token = self.cache.get(self.source)
+        self.assertEqual(self.cache.get(self.source), token)
+        later = time.time() + 35
+        with mock.patch("dashboards.utils.jwt_tokens.time", SimpleNamespace(time=lambda: later)):
+            self.assertNotEqual(self.cache.get(self.source), token)
+
+    def test_new_secret_signs_a_new_token(self):
+        self.cache.get(self.source)
+        self.source.jwt_secret = "b" * 32
+        claims = jwt.decode(self.cache.get(self.source), "b" * 32, algorithms=["HS256"], audience="upstream")
+        self.assertEqual(claims["sub"], "dashboards")
+
+
+# ---------- Filters ----------
+class FilterTests(SimpleTestCase):
+    def test_logic_expression_combines_rules(self):
+        predicate = compile_chart_predicate(
+            filters=[{"field": "value", "operator": ">=", "value": "5"}],
+            logic_rules=[
+                {"id": "a", "field": "group", "operator": "eq", "value": "a"},
+                {"id": "picked", "field": "id", "operator": "in", "value": "6, 7"},
+            ],
+            logic_expression="a OR picked",
+        )
+        self.assertEqual([row["id"] for row in ROWS if predicate(row)], [6, 7, 9, 12, 15, 18, 21, 24])
+
+    def test_non_dict_rows_are_dropped(self):
+        chart = SimpleNamespace(filters={"group": "b"}, logic_rules=None, logic_expression=None)
+        rows = list(filter_rows(chart, [*ROWS[:3], "x", None]))
+        self.assertEqual(rows, [ROWS[1]])
+
+    def test_invalid_rules_raise_filter_error(self):
+        with self.assertRaises(FilterError):
+            compile_chart_predicate(filters=[{"field": "id", "operator": "near", "value": 1}])
+        with self.assertRaises(FilterError):
+            compile_chart_predicate(logic_rules=[{"field": "id", "value": 1}], logic_expression="1 AND 2")
+
+
+# ---------- Joins ----------
+class JoinTests(SimpleTestCase):
+    customers = [{"customer_id": i, "name": f"c{i}"} for i in range(200)]
+    orders = [{"order_id": i, "customer_id": i % 250, "total": i} for i in range(500)]
+
+    def expected(self, how):
+        return sorted(
+            (json.dumps(r, sort_keys=True) for r in hash_join(self.orders, self.customers, ["customer_id"], ["customer_id"], how))
+        )
+
+    def test_spilled_join_matches_in_memory_join(self):
+        for how in ("inner", "left", "right"):
+            with self.subTest(how=how):
+                joined = hash_join(
+                    iter(self.orders),
+                    spool_rows(self.customers, memory_budget=1000),
+                    ["customer_id"],
+                    ["customer_id"],
+                    how,
+                    memory_budget=1000,
+                )
+                self.assertNotIsInstance(joined, list)  # spilled: streamed back from disk
+                self.assertEqual(sorted(json.dumps(r, sort_keys=True) for r in joined), self.expected(how))
+
+    def test_large_probe_side_output_is_spooled(self):
+        orders = spool_rows((dict(order, order_id=i) for i in range(40) for order in self.orders), memory_budget=10_000)
+        joined = hash_join(
+            self.customers[:10], orders, ["customer_id"], ["customer_id"], "inner", memory_budget=10_000
+        )
+        self.assertIsInstance(joined, SpilledRows)
+        self.assertEqual(len(joined), 40 * 20)
+        self.assertEqual({row["name"] for row in joined}, {f"c{i}" for i in range(10)})
+
+    def test_spool_rows(self):
+        self.assertEqual(spool_rows(iter(self.customers)), self.customers)
+
+        spilled = spool_rows(iter(self.customers), memory_budget=1000)
+        self.assertIsInstance(spilled, SpilledRows)
+        self.assertEqual(len(spilled), 200)
+        self.assertEqual(list(spilled), self.customers)
+        self.assertEqual(list(spilled), self.customers)  # iterable more than once
+
+        path = spilled.path
+        del spilled
+        gc.collect()
+        self.assertFalse(os.path.exists(path))
+
+
+@override_settings(JOIN_MEMORY_BUDGET_BYTES=500)
+class JoinChartTests(UpstreamServerMixin, TestCase):
+    def test_join_inputs_are_spooled(self):
+        source = ApiDataSource.objects.create(name="upstream", base_url=self.base_url)
+        orders = Dataset.objects.create(name="orders", api_source=source, endpoint="/all", cache_ttl_seconds=0)
+        groups = Dataset.objects.create(
+            name="groups", api_source=source, endpoint="/next", pagination_type="next_field", cache_ttl_seconds=0
+        )
+        chart = Chart.objects.create(name="c", chart_type="table")
+        ChartJoin.objects.create(
+            chart=chart, left_dataset=orders, left_field="id", right_dataset=groups, right_field="id"
+        )
+        # Loaded like the views do, so fetch threads never query the database
+        chart = (
+            Chart.objects
+            .select_related(*CHART_SELECT_RELATED)
+            .prefetch_related(*CHART_PREFETCH_RELATED)
+            .get(pk=chart.pk)
+        )
+
+        with self.assertLogs("dashboards.utils.joins", "INFO") as logs:
+            payload, status_code = run_chart(chart, None)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(sorted(payload["data"], key=lambda r: r["id"]), ROWS)
+        self.assertEqual(sum("Spooled" in line for line in logs.output), 2)
+        self.assertTrue(any("Spilling join" in line for line in logs.output))
+
+
+# ---------- Dashboard deadlines ----------
+class DashboardDeadlineTests(UpstreamServerMixin, TestCase):
+    def make_chart(self):
+        source = ApiDataSource.objects.create(name="upstream", base_url=self.base_url)
+        dataset = Dataset.objects.create(
+            name="slow", api_source=source, endpoint="/slow?sleep=0.4", cache_ttl_seconds=0
+        )
+        chart = Chart.objects.create(name="c", chart_type="table", dataset=dataset)
+        return (
+            Chart.objects
+            .select_related(*CHART_SELECT_RELATED)
+            .prefetch_related(*CHART_PREFETCH_RELATED)
+            .get(pk=chart.pk)
+        )
+
+    def test_local_pending_cache_times_out_at_the_deadline(self):
+        chart = self.make_chart()
+        started = time.monotonic()
+        with self.assertLogs("dashboards.utils.pending_results", "WARNING"):
+            with mock.patch("dashboards.utils.pending_results._warned_local_cache", False):
+                payloads, _ = run_charts([chart], None, deadline=0.1)
+        self.assertLess(time.monotonic() - started, 0.35)
+        payload, status_code = payloads[chart.id]
+        self.assertEqual(status_code, 504)
+        self.assertIn("0.1s", payload["error"])
+
+    def test_shared_pending_cache_returns_a_token(self):
+        chart = self.make_chart()
+        with tempfile.TemporaryDirectory() as tmp:
+            shared = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": tmp}
+            with override_settings(
+                CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}, "shared": shared},
+                PENDING_RESULTS_CACHE="shared",
+            ):
+                payloads, _ = run_charts([chart], None, deadline=0.1)
+                payload, status_code = payloads[chart.id]
+                self.assertEqual(status_code, 202)
+                self.assertIsNone(get_result(payload["token"], 1))
+
+                for _ in range(50):
+                    result = get_result(payload["token"], None)
+                    if result[1] != 202:
+                        break
+                    time.sleep(0.05)
+        self.assertEqual(result[1], 200)
+        self.assertEqual(result[0]["data"], ROWS)
+
+
+# ---------- Server-sent events ----------
+class EventStreamTests(SimpleTestCase):
+    def test_events_are_streamed_one_by_one(self):
+        def events():
+            yield sse_event({"chart": 1}, event="chart", event_id=1)
+            yield sse_event({"done": True}, event="done")
+
+        response = event_stream_response(RequestFactory().get("/"), events())
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(
+            [chunk.decode() for chunk in response.streaming_content],
+            ['id: 1\nevent: chart\ndata: {"chart": 1}\n\n', 'event: done\ndata: {"done": true}\n\n'],
+        )
+
+    def test_async_steps_close_stale_connections(self):
+        calls = []
+
+        def events():
+            calls.append("event")
+            yield "a"
+
+        async def collect():
+            return [event async for event in _async_events(events())]
+
+        target = "dashboards.utils.sse.close_old_connections"
+        with mock.patch(target, side_effect=lambda: calls.append(threading.current_thread())):
+            self.assertEqual(async_to_sync(collect)(), ["a"])
+        # Two steps (the event, then the end of the stream) and the close
+        self.assertEqual(len(calls), 7)
+        self.assertEqual(calls[1], "event")
+        self.assertNotIn(threading.current_thread(), calls)
+
+
+# ---------- Streaming JSON ----------
+class JsonStreamTests(SimpleTestCase):
+    documents = [
+        [{"a": 1}, {"a": 2}],
+        {"results": [{"a": 1}], "next": None},
+        {"meta": {"n": 2}, "data": [{"a": 1}, {"a": "é"}], "total": 2},
+        {"data": [{"a": 1}], "results": [{"b": 2}]},
+        {"rows": [{"a": 1}], "data": [{"b": 2}], "x": [1]},
+        {"data": [{"a": 1}], "rows": [{"b": 2}]},
+        {"data": "not rows", "rows": [{"a": 1}]},
+        {"first": {"a": 1}, "second": {"a": 2}},
+        {"status": "ok", "count": 3},
+        {},
+        [],
+        42,
+    ]
+
+    def stream(self, document, parser, chunk_size=7):
+        body = json.dumps(document).encode()
+        chunks = (body[i:i + chunk_size] for i in range(0, len(body), chunk_size))
+        payload = stream_payload(chunks, parser)
+        if isinstance(payload.get("data"), Iterator):
+            payload["data"] = list(payload["data"])
+        return payload
+
+    def test_same_rows_as_buffered_parsing(self):
+        for parser in ("stdlib", "ijson"):
+            for document in self.documents:
+                with self.subTest(parser=parser, document=document):
+                    self.assertEqual(self.stream(document, parser), normalize_payload(document))
+
+    def test_large_body_with_later_results_key(self):
+        document = {"data": [{"i": i} for i in range(20000)], "results": [{"i": -1}]}
+        for parser in ("stdlib", "ijson"):
+            with self.subTest(parser=parser):
+                self.assertEqual(self.stream(document, parser, 4096), {"data": [{"i": -1}]})
+
+    def test_large_body_replayed_from_disk(self):
+        document = {"data": [{"i": i, "pad": "x" * 100} for i in range(20000)], "meta": {}}
+        for parser in ("stdlib", "ijson"):
+            with self.subTest(parser=parser):
+                self.assertEqual(self.stream(document, parser, 4096), normalize_payload(document))
+
+
+    def test_large_value_is_decoded_a_few_times_only(self):
+        document = {"meta": {f"k{i}": {"v": i} for i in range(20000)}}
+        decode = json.JSONDecoder.raw_decode
+        with mock.patch.object(json.JSONDecoder, "raw_decode", autospec=True, side_effect=decode) as raw_decode:
+            payload = self.stream(document, "stdlib", 1024)
+        self.assertEqual(payload, normalize_payload(document))
+        self.assertLess(raw_decode.call_count, 30)
+
+# ---------- Compressed transfers ----------
+class TransferTests(UpstreamTestCase):
+    def test_gzip_body_is_decoded_chunk_by_chunk(self):
+        body = json.dumps({"results": ROWS}).encode()
+        wire = gzip.compress(body)
+        chunks = [wire[i:i + 50] for i in range(0, len(wire), 50)]
+        resp = SimpleNamespace(
+            headers={"Content-Encoding": "gzip"},
+            raw=SimpleNamespace(stream=lambda size, decode_content: iter(chunks)),
+        )
+        self.addCleanup(transfer_stats._stats.pop, 9004, None)
+
+        self.assertEqual(b"".join(iter_decoded(resp, source_id=9004)), body)
+        stats = transfer_stats.stats(9004)
+        self.assertEqual((stats["wire_bytes"], stats["body_bytes"]), (len(wire), len(body)))
+
+    def test_compressed_dataset(self):
+        self.assertEqual(run_dataset(self.make_dataset("/gzip"), None), ({"data": ROWS}, 200))
+
+
+# ---------- Snapshots ----------
+class SnapshotTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "dataset.snap")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        rows = [{"id": i, "name": f"n{i}", "score": i / 2, "flag": i % 2 == 0} for i in range(5000)]
+        rows[3] = {"id": 3, "extra": [1, 2]}
+        footer = write_snapshot(self.path, iter(rows), meta={"watermark": 4999})
+        self.assertEqual(footer["row_count"], 5000)
+        with SnapshotReader(self.path) as snapshot:
+            self.assertEqual(list(snapshot.rows()), rows)
+            self.assertEqual(snapshot.meta, {"watermark": 4999})
+            self.assertEqual(next(snapshot.rows(["id"])), {"id": 0})
+
+    def test_reader_is_not_affected_by_a_refresh(self):
+        old_rows = [{"id": i, "value": f"old-{i}"} for i in range(3000)]
+        new_rows = [{"other": i * 7, "text": "new" * (i % 5)} for i in range(9000)]
+        write_snapshot(self.path, iter(old_rows))
+
+        with SnapshotReader(self.path) as snapshot:
+            rows = snapshot.rows()
+            first = next(rows)
+            write_snapshot(self.path, iter(new_rows))  # a refresh replaces the file
+            self.assertEqual([first, *rows], old_rows)
+            self.assertEqual(list(snapshot.rows()), old_rows)
+
+        with SnapshotReader(self.path) as snapshot:
+            self.assertEqual(list(snapshot.rows()), new_rows)
+
+
+class IncrementalRefreshTests(UpstreamServerMixin, TestCase):
+    def test_rows_after_the_watermark_are_merged_by_key(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        source = ApiDataSource.objects.create(name="upstream", base_url=self.base_url)
+        dataset = Dataset.objects.create(
+            name="changes",
+            api_source=source,
+            endpoint="/changes",
+            materialized=True,
+            watermark_field="updated",
+            watermark_param="since",
+            primary_key="id",
+        )
+
+        with override_settings(DATASET_SNAPSHOT_DIR=tmp.name):
+            full, _ = refresh_snapshot(dataset)
+            delta, status_code = refresh_snapshot(dataset)
+            with open_snapshot(dataset) as snapshot:
+                rows = list(snapshot.rows())
+
+        self.assertEqual((full["mode"], full["watermark"]), ("full", 5))
+        self.assertEqual(status_code, 200)
+        self.assertEqual((delta["mode"], delta["fetched_rows"], delta["watermark"]), ("incremental", 2, 7))
+        self.assertIn("since=5", self.server.hits[-1])
+        self.assertEqual(
+            [(row["id"], row["value"]) for row in rows],
+            [(0, "old"), (1, "old"), (2, "new"), (3, "old"), (4, "old"), (9, "new")],
+        )
+
+    def test_failed_run_records_its_mode(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        source = ApiDataSource.objects.create(name="upstream", base_url=self.base_url)
+        dataset = Dataset.objects.create(name="down", api_source=source, endpoint="/unavailable", materialized=True)
+
+        with override_settings(DATASET_SNAPSHOT_DIR=tmp.name):
+            run, _, status_code = execute_refresh(dataset, trigger="manual")
+
+        run.refresh_from_db()
+        self.assertGreaterEqual(status_code, 400)
+        self.assertEqual((run.status, run.mode), ("failed", "full"))
+
+
+# ---------- Refresh scheduler ----------
+class RefreshSchedulerCommandTests(TestCase):
+    def test_once_refreshes_every_due_dataset(self):
+        source = ApiDataSource.objects.create(name="upstream", base_url="http://upstream.invalid")
+        due = [
+            Dataset.objects.create(
+                name=f"d{i}", api_source=source, endpoint="/", materialized=True, refresh_interval_seconds=1
+            )
+            for i in range(7)
+        ]
+        Dataset.objects.create(name="manual", api_source=source, endpoint="/", materialized=True)
+
+        refreshed = []
+
+        def execute_refresh(dataset):
+            refreshed.append(dataset.id)
+            time.sleep(0.01)
+            run = SimpleNamespace(status="success", mode="full", fetched_rows=0, rows=0, duration_ms=10)
+            return run, {}, 200
+
+        target = "dashboards.management.commands.run_dataset_scheduler.execute_refresh"
+        with mock.patch(target, execute_refresh):
+            call_command("run_dataset_scheduler", "--once", "--workers", "2", stdout=StringIO())
+
+        self.assertEqual(sorted(refreshed), sorted(ds.id for ds in due))
+
+
+# ---------- Fetch scheduler ----------
+class FetchSchedulerTests(SimpleTestCase):
+    def test_pool_tasks_close_stale_connections(self):
+        scheduler = FairFetchScheduler(workers=2)
+        calls = []
+        target = "dashboards.utils.fetch_scheduler.close_old_connections"
+        with mock.patch(target, side_effect=lambda: calls.append(threading.current_thread().name)):
+            result = scheduler.submit(None, 1, lambda: calls.append("task") or 42).result(timeout=5)
+            scheduler._pool.shutdown(wait=True)
+        self.assertEqual(result, 42)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(calls[1], "task")
+        self.assertTrue(calls[0].startswith("dataset-fetch"))
+
+    def test_waiting_tenants_are_served_in_turn(self):
+        scheduler = FairFetchScheduler(workers=1)
+        for tenant_id in ("a", "b"):
+            scheduler._policies[tenant_id] = (1, 4, time.monotonic())
+        release = threading.Event()
+        order = []
+
+        futures = [scheduler.submit("a", 1, release.wait)]
+        futures += [scheduler.submit("a", 1, order.append, f"a{i}") for i in range(3)]
+        futures += [scheduler.submit("b", 2, order.append, f"b{i}") for i in range(2)]
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+        self.assertLessEqual({"b0", "b1"}, set(order[:4]))
+
+    def test_tenant_concurrency_is_limited(self):
+        scheduler = FairFetchScheduler(workers=4)
+        scheduler._policies["a"] = (1, 2, time.monotonic())
+        running, peak = [], []
+        lock = threading.Lock()
+
+        def fetch():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        for future in [scheduler.submit("a", source_id, fetch) for source_id in range(6)]:
+            future.result(timeout=5)
+        self.assertEqual(max(peak), 2)
+
+
+# ---------- Single flight ----------
+class SingleFlightTests(UpstreamTestCase):
+    def run_concurrently(self, fn, threads=10):
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(fn())) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def test_concurrent_identical_runs_share_one_fetch(self):
+        dataset = self.make_dataset("/slow?sleep=0.3")
+        results = self.run_concurrently(lambda: run_dataset(dataset, None))
+        self.assertEqual(len(self.server.hits), 1)
+        self.assertEqual(results, [({"data": ROWS}, 200)] * 10)
+
+    def test_follower_waits_only_until_the_deadline(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        leader = threading.Thread(target=flight.do, args=("key", lambda: release.wait(5)))
+        leader.start()
+        self.addCleanup(leader.join)
+        self.addCleanup(release.set)
+        while not flight.running("key"):
+            time.sleep(0.01)
+
+        started = time.monotonic()
+        with deadline_scope(Deadline(0.1)), self.assertRaises(DeadlineExceeded):
+            flight.do("key", lambda: self.fail("follower fetched past its deadline"))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_local_cache_gets_no_published_result(self):
+        key = ("test", "local")
+        self.assertEqual(coalesce(key, lambda: ({"data": [1]}, 200)), ({"data": [1]}, 200))
+        lock_key, result_key = _cache_keys(key)
+        self.assertIsNone(caches["default"].get(result_key))
+        self.assertIsNone(caches["default"].get(lock_key))
+
+
+class SharedSingleFlightTests(UpstreamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        shared = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": self.tmp.name}
+        settings_override = override_settings(
+            CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}, "shared": shared},
+            SINGLE_FLIGHT_CACHE="shared",
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.tmp.cleanup)
+
+    def published(self, dataset):
+        _, result_key = _cache_keys(make_cache_key(None, dataset))
+        return caches["shared"].get(result_key)
+
+    def test_fresh_result_is_published(self):
+        dataset = self.make_dataset("/all", cache_ttl_seconds=60)
+        payload, _ = run_dataset(dataset, None)
+        self.assertEqual(self.published(dataset), (payload, 200))
+
+    def test_uncacheable_or_oversized_result_is_not_published(self):
+        dataset = self.make_dataset("/all")  # cache_ttl_seconds=0
+        run_dataset(dataset, None)
+        self.assertIsNone(self.published(dataset))
+
+        dataset = self.make_dataset("/all", cache_ttl_seconds=60)
+        with mock.patch.object(dataset_cache, "max_bytes", 100):
+            run_dataset(dataset, None)
+        self.assertIsNone(self.published(dataset))
+
+
+# ---------- Circuit breaker ----------
+@override_settings(
+    UPSTREAM_CIRCUIT_BREAKER={"TIMEOUT_MAX": 0.5, "CONSECUTIVE_FAILURES": 3},
+    UPSTREAM_HTTP={"MAX_RETRIES": 2, "BACKOFF_FACTOR": 0.05},
+)
+class CircuitBreakerTests(UpstreamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = ApiDataSource(id=9001, name="upstream", base_url=self.base_url)
+        breaker_registry.reset(self.source.id)
+        self.addCleanup(breaker_registry.reset, self.source.id)
+
+    def get(self, url):
+        return guarded_get(get_session(self.source), self.source, url)
+
+    def test_every_attempt_counts_against_the_breaker(self):
+        self.assertEqual(self.get(self.base_url + "/unavailable").status_code, 503)
+        self.assertEqual(len(self.server.hits), 3)
+        self.assertEqual(get_breaker(self.source).state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.get(self.base_url + "/all")
+        self.assertEqual(len(self.server.hits), 3)
+
+    def test_retries_stay_within_the_fetch_budget(self):
+        with socket_closed_port() as url:
+            started = time.monotonic()
+            with self.assertRaises(requests.ConnectionError):
+                self.get(url)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_success_is_recorded(self):
+        self.assertEqual(self.get(self.base_url + "/all").status_code, 200)
+        self.assertEqual(len(get_breaker(self.source).recent_latencies()), 1)
+
+    def test_deadline_timeout_does_not_count_as_failure(self):
+        with deadline_scope(Deadline(0.2)):
+            with self.assertRaises(DeadlineExceeded):
+                self.get(self.base_url + "/slow?sleep=1")
+        self.assertEqual(get_breaker(self.source).stats()["consecutive_failures"], 0)
+
+
+# ---------- Hedging ----------
+class HedgingTests(SimpleTestCase):
+    def setUp(self):
+        self.source = ApiDataSource(id=9002, name="upstream", base_url="http://upstream.invalid", hedge_requests=True)
+        breaker_registry.reset(self.source.id)
+        self.addCleanup(breaker_registry.reset, self.source.id)
+        for _ in range(20):
+            get_breaker(self.source).record_success(0.01)
+        hedge_budget._tokens[self.source.id] = 5
+        self.addCleanup(hedge_budget._tokens.pop, self.source.id, None)
+        self.addCleanup(hedge_budget._counts.pop, self.source.id, None)
+        self.calls = []
+
+    def hedged_get(self, *answers):
+        """hedged_get() where the n-th upstream call sleeps, then returns or raises answers[n]."""
+        answers = list(answers)
+
+        def fake_guarded_get(session, source, url, **kwargs):
+            sleep, answer = answers.pop(0)
+            self.calls.append(threading.current_thread().name)
+            time.sleep(sleep)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+        with mock.patch("dashboards.utils.hedging.guarded_get", fake_guarded_get):
+            return hedged_get(None, self.source, "/")
+
+    def test_fast_primary_is_not_hedged(self):
+        primary = mock.Mock()
+        self.assertIs(self.hedged_get((0, primary)), primary)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(hedge_budget.stats(self.source.id)["hedges"], 0)
+
+    def test_faster_hedge_wins_and_the_slow_primary_is_closed(self):
+        primary, hedge = mock.Mock(), mock.Mock()
+        started = time.monotonic()
+        self.assertIs(self.hedged_get((0.4, primary), (0, hedge)), hedge)
+        self.assertLess(time.monotonic() - started, 0.3)
+        self.assertEqual(hedge_budget.stats(self.source.id)["hedge_wins"], 1)
+        time.sleep(0.4)
+        primary.close.assert_called_once()
+        hedge.close.assert_not_called()
+
+    def test_failed_hedge_falls_back_to_the_primary(self):
+        primary = mock.Mock()
+        self.assertIs(self.hedged_get((0.2, primary), (0, requests.ConnectionError())), primary)
+        self.assertEqual(hedge_budget.stats(self.source.id)["hedge_wins"], 0)
+
+    def test_hedge_replaces_a_failed_primary(self):
+        hedge = mock.Mock()
+        self.assertIs(self.hedged_get((0.1, requests.ReadTimeout()), (0.2, hedge)), hedge)
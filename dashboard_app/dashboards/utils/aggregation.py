@@ -0,0 +1,107 @@
+# dashboards/utils/aggregation.py
+AGGREGATIONS = ("sum", "avg", "min", "max", "count")
+
+
+def to_number(value):
+    """Coerce an upstream value to a number, or None when it is not numeric."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value.replace(",", "")) if value.strip() else None
+        except ValueError:
+            return None
+    return None
+
+
+class RowCounter:
+    """Wrap an iterable of rows and count them as they stream past."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+
+
+def _group_key(value):
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return str(value)
+
+
+def aggregate_rows(rows, x_field, y_field, aggregation):
+    """
+    Group rows by x_field and reduce y_field in a single hash-aggregation pass.
+
+    rows may be any iterable (it is consumed once). Groups keep the order
+    in which their x value was first seen. Returns a list of
+    {x_field: group, y_field: value} dicts ("count" is the value key of a
+    count without a y_field). Without an x_field all rows form a single
+    group and the result is one {y_field: value} total (a KPI), even when
+    there are no rows. Rows that are not objects (e.g. [x, y]
+    lists) cannot be grouped by field and are passed through unchanged,
+    after the groups.
+    """
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation: {aggregation}")
+
+    # group -> [accumulator, count]
+    groups = {} if x_field else {None: [None, 0]}
+    passthrough = []
+
+    for row in rows:
+        if not isinstance(row, dict):
+            passthrough.append(row)
+            continue
+
+        key = _group_key(row.get(x_field)) if x_field else None
+
+        if aggregation == "count":
+            state = groups.setdefault(key, [None, 0])
+            state[1] += 1
+            continue
+
+        value = to_number(row.get(y_field))
+        state = groups.setdefault(key, [None, 0])
+        if value is None:
+            continue
+
+        acc = state[0]
+        if acc is None:
+            state[0] = value
+        elif aggregation in ("sum", "avg"):
+            state[0] = acc + value
+        elif aggregation == "min":
+            state[0] = value if value < acc else acc
+        else:
+            state[0] = value if value > acc else acc
+        state[1] += 1
+
+    value_field = y_field or aggregation
+    series = []
+    for key, (acc, count) in groups.items():
+        if aggregation == "count":
+            value = count
+        elif aggregation == "avg":
+            value = acc / count if count else None
+        elif aggregation == "sum":
+            value = acc if acc is not None else 0
+        else:
+            value = acc
+        series.append({x_field: key, value_field: value} if x_field else {value_field: value})
+
+    return series + passthrough
+
+
+def project_rows(rows, fields):
+    """Keep only the given fields of each row (rows that are not objects pass through)."""
+    fields = [f for f in fields if f]
+    return [{f: row.get(f) for f in fields} if isinstance(row, dict) else row for row in rows]
@@ -0,0 +1,332 @@
+# dashboards/utils/chart_runner.py
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import requests
+
+from subscriptions.utils.api_row_meter import ApiRowQuotaExceeded
+
+from .aggregation import AGGREGATIONS, RowCounter, aggregate_rows, project_rows
+from .circuit_breaker import CircuitOpenError
+from .dataset_cache import make_cache_key
+from .dataset_runner import (
+    cached_result,
+    fetch_many,
+    fetch_results,
+    get_fetch_timeout,
+    payload_rows,
+    stream_dataset_rows,
+    submit_fetches,
+    unavailable_payload,
+)
+from .deadlines import Deadline, DeadlineExceeded, checked_rows, deadline_scope
+from .filters import FilterError, filter_fields, filter_rows
+from .joins import JoinError, join_datasets
+from .negative_cache import UpstreamBackoff
+from .pending_results import can_defer, defer, pending_payload
+
+
+DEFAULT_DASHBOARD_DEADLINE_SECONDS = 8
+
+# Related rows needed to run charts without extra queries per chart
+CHART_SELECT_RELATED = ("dataset__api_source",)
+CHART_PREFETCH_RELATED = (
+    "joins__left_dataset__api_source",
+    "joins__right_dataset__api_source",
+)
+
+
+def chart_datasets(chart, tenant):
+    """Datasets a chart needs fetched (datasets outside the tenant are skipped)."""
+    if chart.excel_data:
+        return []
+
+    joins = list(chart.joins.all())
+    if joins:
+        tenant_id = getattr(tenant, "id", None)
+        return [
+            ds
+            for join in joins
+            for ds in (join.left_dataset, join.right_dataset)
+            if ds.tenant_id == tenant_id
+        ]
+
+    return [chart.dataset] if chart.dataset else []
+
+
+def build_chart_payload(chart, results):
+    """
+    Turn fetched datasets into the chart's run payload.
+
+    results: {dataset.id: (payload, status_code)} as returned by fetch_many.
+    Returns (payload, status_code).
+    """
+    if chart.excel_data:
+        if not isinstance(chart.excel_data, list):
+            return {"data": chart.excel_data}, 200  # not a row list: returned as stored
+        return shape_chart_payload(chart, chart.excel_data)
+
+    joins = list(chart.joins.all())
+    needed = (
+        [ds for join in joins for ds in (join.left_dataset, join.right_dataset)]
+        if joins
+        else [chart.dataset] if chart.dataset else []
+    )
+    for ds in needed:
+        if ds.id in results and results[ds.id][1] >= 400:
+            payload, status_code = results[ds.id]
+            return {**payload, "dataset": ds.id}, status_code
+
+    if joins:
+        rows = {ds_id: payload_rows(payload) for ds_id, (payload, _) in results.items()}
+        try:
+            joined = join_datasets(sorted(joins, key=lambda j: j.id), rows)
+        except JoinError as e:
+            return {"error": str(e)}, 400
+        payloads = [results[ds.id][0] for ds in needed if ds.id in results]
+        return mark_stale(shape_chart_payload(chart, joined), payloads)
+
+    if chart.dataset:
+        if chart.dataset.id not in results:
+            return {"error": "Dataset was not fetched", "dataset": chart.dataset.id}, 504
+        payload, status_code = results[chart.dataset.id]
+        if "data" not in payload:
+            return payload, status_code  # non-tabular result, pass through
+        return mark_stale(shape_chart_payload(chart, payload_rows(payload)), [payload])
+
+    return {"error": "Chart has no dataset, joins, or Excel data."}, 400
+
+
+def mark_stale(result, payloads):
+    """
+    Flag a chart result built from stale dataset payloads (upstream not
+    called, or served within the stale grace window), with the oldest one's age.
+    """
+    payload, status_code = result
+    stale = [p for p in payloads if p.get("stale")]
+    if status_code < 400 and stale:
+        payload = {**payload, "stale": True}
+        ages = [p["age"] for p in stale if p.get("age") is not None]
+        if ages:
+            payload["age"] = max(ages)
+    return payload, status_code
+
+
+def shape_chart_payload(chart, rows):
+    """
+    Final stages of the chart pipeline: filter, then aggregate.
+
+    Rows are first narrowed by the chart's filters / logic rules. Table
+    charts then get the remaining rows. Other charts get the aggregated
+    x/y series, or just the x/y columns when no aggregation is set.
+    Without an x field they get a single total of y (sum unless another
+    aggregation is set; a count without a y field).
+    rows may be a list or a one-shot iterator (e.g. a spilled join).
+    Returns (payload, status_code). Raises DeadlineExceeded once the
+    current deadline has passed.
+    """
+    rows = checked_rows(rows, "chart build")
+    try:
+        rows = filter_rows(chart, rows)
+    except FilterError as e:
+        return {"error": f"Invalid chart filters: {e}"}, 400
+
+    if chart.chart_type == "table":
+        return {"data": rows if isinstance(rows, list) else list(rows)}, 200
+
+    aggregation = (chart.aggregation or "none").lower()
+    if not chart.x_field and (aggregation not in AGGREGATIONS or not chart.y_field):
+        aggregation = "sum" if chart.y_field else "count"
+    # Only a count can be computed without a y field
+    if aggregation not in AGGREGATIONS or (not chart.y_field and aggregation != "count"):
+        return {"data": project_rows(rows, [chart.x_field, chart.y_field])}, 200
+
+    counted = RowCounter(rows)
+    return {
+        "data": aggregate_rows(counted, chart.x_field, chart.y_field, aggregation),
+        "aggregated": True,
+        "source_rows": counted.count,
+    }, 200
+
+
+def run_chart(chart, tenant):
+    """Fetch a single chart's datasets and build its payload."""
+    if is_streamable(chart):
+        return stream_chart(chart, tenant)
+
+    datasets = chart_datasets(chart, tenant)
+    results = fetch_many(datasets, tenant, fail_fast=True, spooled=join_inputs([chart], tenant))
+    return build_chart_payload(chart, results)
+
+
+def join_inputs(charts, tenant):
+    """Ids of the datasets joined by the charts (fetched spooled, see spool_dataset)."""
+    return {
+        ds.id
+        for chart in charts
+        if not chart.excel_data and chart.joins.all()
+        for ds in chart_datasets(chart, tenant)
+    }
+
+
+def is_streamable(chart):
+    """
+    Single-dataset charts over a paginated upstream can be streamed page
+    by page; over a materialized dataset, row group by row group.
+    """
+    return bool(
+        not chart.excel_data
+        and chart.dataset
+        and not chart.joins.all()
+        and (chart.dataset.pagination_type != "none" or chart.dataset.materialized)
+    )
+
+
+def chart_columns(chart):
+    """
+    Columns a chart reads from its dataset, or None when it needs whole rows
+    (table charts).
+    """
+    if chart.chart_type == "table":
+        return None
+    try:
+        fields = filter_fields(chart.filters, chart.logic_rules)
+    except FilterError:
+        return None  # reported by shape_chart_payload
+    return {f for f in (chart.x_field, chart.y_field) if f} | fields
+
+
+def stream_chart(chart, tenant):
+    """
+    Run a chart straight off the upstream's pages (or its dataset's
+    snapshot): filter and aggregation consume rows as each page arrives,
+    so only one page is held at a time (table charts still return every
+    row). Snapshots only decode the columns the chart reads.
+
+    A cached (or stale, within the grace window) result is used as is.
+    """
+    if not chart.dataset.materialized:
+        cached = cached_result(chart.dataset, tenant)
+        if cached is not None:
+            return mark_stale(shape_chart_payload(chart, payload_rows(cached)), [cached])
+
+    rows = stream_dataset_rows(chart.dataset, tenant, chart_columns(chart))
+    try:
+        return shape_chart_payload(chart, rows)
+    except (CircuitOpenError, UpstreamBackoff) as e:
+        payload, status_code = unavailable_payload(e, make_cache_key(tenant, chart.dataset))
+        if status_code == 200:
+            return mark_stale(shape_chart_payload(chart, payload_rows(payload)), [payload])
+        return {**payload, "dataset": chart.dataset.id}, status_code
+    except ApiRowQuotaExceeded as e:
+        return {"error": str(e), "dataset": chart.dataset.id}, 429
+    except DeadlineExceeded as e:
+        return {"error": str(e), "dataset": chart.dataset.id}, 504
+    except (requests.RequestException, ValueError) as e:
+        return {"error": str(e), "dataset": chart.dataset.id}, 502
+
+
+def run_charts(charts, tenant, deadline=None):
+    """
+    Run several charts (e.g. a whole dashboard) in one go.
+
+    All charts' datasets are fetched together, so identical
+    (source, endpoint, params) requests hit the upstream only once.
+    Returns ({chart.id: (payload, status_code)}, distinct_fetches).
+
+    With a deadline (seconds), charts that are not built by then come
+    back as pending ({"pending": True, "token": ...}, 202) and are
+    finished in the background, see pending_results. Their fetches keep
+    running until DATASET_FETCH_TIMEOUT. Without a shared pending results
+    cache (see pending_results.can_defer), charts not built by the
+    deadline come back as 504s instead.
+    """
+    datasets = [ds for chart in charts for ds in chart_datasets(chart, tenant)]
+    distinct = len({make_cache_key(tenant, ds) for ds in datasets})
+    spooled = join_inputs(charts, tenant)
+    if deadline is None:
+        results = fetch_many(datasets, tenant, spooled=spooled)
+        return {chart.id: build_chart_payload(chart, results) for chart in charts}, distinct
+
+    response_deadline = Deadline(deadline)
+    fetch_deadline = Deadline(max(deadline, get_fetch_timeout()))
+    deferrable = can_defer()
+    with deadline_scope(fetch_deadline):
+        fetches = submit_fetches(datasets, tenant, spooled)
+
+    payloads = {
+        chart.id: result
+        for chart, result in iter_built_charts(charts, tenant, fetches, response_deadline)
+    }
+    for chart in charts:
+        if chart.id in payloads:
+            continue
+        if not deferrable:
+            payloads[chart.id] = {"error": f"Chart timed out after {response_deadline.seconds}s"}, 504
+            continue
+        keys = {make_cache_key(tenant, ds) for ds in chart_datasets(chart, tenant)}
+        chart_fetches = {key: fetches[key] for key in keys}
+        token = defer(
+            getattr(tenant, "id", None),
+            lambda chart=chart, chart_fetches=chart_fetches: _finish_chart(chart, chart_fetches, fetch_deadline),
+        )
+        payloads[chart.id] = pending_payload(token)
+    return payloads, distinct
+
+
+def stream_charts(charts, tenant):
+    """
+    Run several charts like run_charts, yielding (chart, (payload,
+    status_code)) as each one is built: cached charts right away, the
+    others as their datasets arrive. Charts not built within
+    DATASET_FETCH_TIMEOUT are yielded last, as 504s.
+    """
+    datasets = [ds for chart in charts for ds in chart_datasets(chart, tenant)]
+    deadline = Deadline(get_fetch_timeout())
+    with deadline_scope(deadline):
+        fetches = submit_fetches(datasets, tenant, join_inputs(charts, tenant))
+
+    built = set()
+    for chart, result in iter_built_charts(charts, tenant, fetches, deadline):
+        built.add(chart.id)
+        yield chart, result
+    for chart in charts:
+        if chart.id not in built:
+            yield chart, ({"error": f"Chart timed out after {deadline.seconds}s"}, 504)
+
+
+def iter_built_charts(charts, tenant, fetches, deadline):
+    """
+    Yield (chart, (payload, status_code)) for each chart as soon as its
+    submitted fetches are in and it is built, until deadline passes.
+    Charts not built by then are not yielded.
+    """
+    waiting = {chart.id: chart for chart in charts}
+    while waiting:
+        # Taken before collecting, so a fetch finishing in between is not missed
+        running = [future for future, _ in fetches.values() if not future.done()]
+        results = fetch_results(fetches, timeout=0)
+        for chart in list(waiting.values()):
+            if not all(ds.id in results for ds in chart_datasets(chart, tenant)):
+                continue
+            try:
+                with deadline_scope(deadline):
+                    result = build_chart_payload(chart, results)
+            except DeadlineExceeded:
+                return
+            del waiting[chart.id]
+            yield chart, result
+
+        if not running or deadline.expired():
+            return
+        wait(running, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+
+
+def _finish_chart(chart, fetches, deadline):
+    """Build a chart that missed the response deadline, once its fetches are in."""
+    with deadline_scope(deadline):
+        results = fetch_results(fetches, timeout=deadline.remaining())
+        for _, group in fetches.values():
+            for ds in group:
+                if ds.id not in results:
+                    results[ds.id] = ({"error": f"Dataset '{ds.name}' timed out after {deadline.seconds}s"}, 504)
+        return build_chart_payload(chart, results)
@@ -0,0 +1,238 @@
+# dashboards/utils/circuit_breaker.py
+import threading
+import time
+from collections import deque
+
+import requests
+from django.conf import settings
+
+from .deadlines import Deadline, DeadlineExceeded, check_deadline, current_deadline
+from .http_sessions import get_http_config
+
+
+DEFAULT_BREAKER_CONFIG = {
+    "WINDOW": 50,               # recent requests used for the failure rate
+    "MIN_REQUESTS": 10,         # no rate-based opening before this many requests
+    "FAILURE_RATE": 0.5,        # open when this share of the window failed
+    "CONSECUTIVE_FAILURES": 5,  # ... or after this many failures in a row
+    "OPEN_SECONDS": 30,         # how long to fail fast before probing again
+    "TIMEOUT_MIN": 2,           # adaptive read timeout bounds (seconds)
+    "TIMEOUT_MAX": 15,
+    "TIMEOUT_P99_FACTOR": 2,    # read timeout = p99 latency * factor
+    "LATENCY_SAMPLES": 200,     # successful latencies kept for percentiles
+    "MIN_LATENCY_SAMPLES": 20,  # use TIMEOUT_MAX until this many samples
+}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, source_id, retry_after):
+        self.source_id = source_id
+        self.retry_after = retry_after
+        super().__init__(f"Upstream {source_id} is unavailable (circuit open), retry in {retry_after}s")
+
+
+def get_breaker_config():
+    return {**DEFAULT_BREAKER_CONFIG, **getattr(settings, "UPSTREAM_CIRCUIT_BREAKER", {})}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """
+    Health of one upstream: closed -> open after repeated failures,
+    open -> half open after OPEN_SECONDS (one probe request), then back
+    to closed on success or open on failure.
+
+    Only transport errors and 5xx responses count as failures; a 4xx
+    means the upstream is up.
+    """
+
+    def __init__(self, source_id, config=None):
+        self.source_id = source_id
+        self.config = config or get_breaker_config()
+        self.state = CLOSED
+        self.opened_at = None
+        self.consecutive_failures = 0
+        self.outcomes = deque(maxlen=self.config["WINDOW"])  # True = success
+        self.latencies = deque(maxlen=self.config["LATENCY_SAMPLES"])
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Raise CircuitOpenError unless a request may go out now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.config["OPEN_SECONDS"] - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpenError(self.source_id, max(1, int(remaining)))
+
+    def record_success(self, latency):
+        with self._lock:
+            self.outcomes.append(True)
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                self.state, self.opened_at = CLOSED, None
+
+    def record_failure(self):
+        config = self.config
+        with self._lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            self._probing = False
+            failures = self.outcomes.count(False)
+            if (
+                self.state == HALF_OPEN
+                or self.consecutive_failures >= config["CONSECUTIVE_FAILURES"]
+                or (
+                    len(self.outcomes) >= config["MIN_REQUESTS"]
+                    and failures / len(self.outcomes) >= config["FAILURE_RATE"]
+                )
+            ):
+                self.state, self.opened_at = OPEN, time.monotonic()
+                self.outcomes.clear()
+
+    def abandon(self):
+        """The caller gave up on a request (deadline): neither success nor failure."""
+        with self._lock:
+            self._probing = False
+
+    def read_timeout(self):
+        """p99 of recent successful latencies times a safety factor, within bounds."""
+        config = self.config
+        with self._lock:
+            if len(self.latencies) < config["MIN_LATENCY_SAMPLES"]:
+                return config["TIMEOUT_MAX"]
+            p99 = percentile(self.latencies, 0.99)
+        return min(config["TIMEOUT_MAX"], max(config["TIMEOUT_MIN"], p99 * config["TIMEOUT_P99_FACTOR"]))
+
+    def recent_latencies(self):
+        with self._lock:
+            return list(self.latencies)
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self.latencies)
+            outcomes = list(self.outcomes)
+            state = self.state
+        return {
+            "state": state,
+            "failure_rate": round(outcomes.count(False) / len(outcomes), 3) if outcomes else 0.0,
+            "consecutive_failures": self.consecutive_failures,
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p99": percentile(latencies, 0.99),
+            "read_timeout": self.read_timeout(),
+        }
+
+
+class BreakerRegistry:
+    """Process-wide circuit breakers, one per ApiDataSource."""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, source):
+        # Unsaved (ad-hoc) sources get a throwaway breaker
+        if source.id is None:
+            return CircuitBreaker(None)
+        with self._lock:
+            breaker = self._breakers.get(source.id)
+            if breaker is None:
+                breaker = self._breakers[source.id] = CircuitBreaker(source.id)
+            return breaker
+
+    def reset(self, source_id):
+        with self._lock:
+            self._breakers.pop(source_id, None)
+
+
+breaker_registry = BreakerRegistry()
+
+
+def get_breaker(source):
+    return breaker_registry.get(source)
+
+
+def guarded_get(session, source, url, **kwargs):
+    """
+    session.get() through the source's circuit breaker, with the adaptive
+    read timeout (connect timeout stays at TIMEOUT_MAX).
+    Raises CircuitOpenError without calling the upstream while open.
+
+    Connect errors and RETRY_STATUSES responses are retried up to
+    MAX_RETRIES times (UPSTREAM_HTTP; the sessions themselves do not
+    retry). Every attempt is a breaker outcome of its own, and all of
+    them share one budget of TIMEOUT_MAX seconds: each attempt's timeouts
+    and backoff are capped at what is left of it, so a fetch never holds
+    a worker much longer than TIMEOUT_MAX.
+
+    Timeouts are also capped at the time left before the current deadline;
+    a timeout caused by that cap raises DeadlineExceeded and does not
+    count against the upstream.
+    """
+    check_deadline("upstream fetch")
+    breaker = get_breaker(source)
+    http_config = get_http_config()
+    budget = Deadline(breaker.config["TIMEOUT_MAX"])
+    attempts = 1 + max(0, http_config["MAX_RETRIES"])
+
+    for attempt in range(attempts):
+        breaker.before_request()
+        limit = _attempt_limit(budget)
+        left = max(limit.remaining(), 0.001)
+        timeout = (min(breaker.config["TIMEOUT_MAX"], left), min(breaker.read_timeout(), left))
+        retry_left = attempt + 1 < attempts
+        try:
+            resp = session.get(url, timeout=timeout, **kwargs)
+        except Exception as e:
+            if limit is not budget and limit.expired():
+                breaker.abandon()
+                raise DeadlineExceeded("upstream fetch") from e
+            breaker.record_failure()
+            # A ReadTimeout is not a ConnectionError: a slow upstream is not asked again
+            if isinstance(e, requests.ConnectionError) and retry_left and _backoff(http_config, attempt, budget):
+                continue
+            raise
+
+        if resp.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success(resp.elapsed.total_seconds())
+        if resp.status_code in http_config["RETRY_STATUSES"] and retry_left and _backoff(http_config, attempt, budget):
+            resp.close()
+            continue
+        return resp
+
+
+def _attempt_limit(budget):
+    """The fetch budget, or the current deadline when that comes first."""
+    deadline = current_deadline()
+    if deadline is not None and deadline.remaining() < budget.remaining():
+        return deadline
+    return budget
+
+
+def _backoff(http_config, attempt, budget):
+    """Sleep before the next attempt; False when the budget cannot cover it."""
+    delay = http_config["BACKOFF_FACTOR"] * (2 ** attempt)
+    remaining = _attempt_limit(budget).remaining()
+    if delay >= remaining:
+        return False
+    time.sleep(delay)
+    return True
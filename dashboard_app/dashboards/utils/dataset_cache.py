@@ -0,0 +1,192 @@
+# dashboards/utils/dataset_cache.py
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # 64 MB per worker process
+
+
+def make_cache_key(tenant, dataset):
+    """
+    Build the cache key for a dataset run.
+
+    Two runs share an entry when they hit the same API source + endpoint
+    with the same query params and pagination settings (key order does
+    not matter).
+    """
+    params = _canonical_json(dataset.query_params)
+    pagination = (
+        getattr(dataset, "pagination_type", None) or "none",
+        _canonical_json(getattr(dataset, "pagination_config", None)),
+    )
+    endpoint = (dataset.endpoint or "").strip("/")
+    tenant_id = tenant.id if tenant else None
+    return (tenant_id, dataset.api_source_id, endpoint, params, pagination)
+
+
+def _canonical_json(value):
+    return json.dumps(value or {}, sort_keys=True, separators=(",", ":"), default=str)
+
+
+_Entry = namedtuple("_Entry", "expires_at stored_at size payload validators")
+
+
+class DatasetResultCache:
+    """
+    Process-local TTL + LRU cache for dataset run payloads.
+
+    - every entry carries its own expiry (per-dataset TTL)
+    - least recently used entries are evicted once the byte budget is exceeded
+    - hit / miss counters are kept per tenant
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> _Entry
+        self._bytes = 0
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    # ---------- Lookup ----------
+    def get(self, key, allow_stale=False):
+        """
+        Cached payload for key, or None. Expired entries count as misses
+        but are kept until evicted, so allow_stale=True can still serve
+        them (e.g. while the upstream is down).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._count(key, "misses")
+                return None
+
+            if entry.expires_at <= now and not allow_stale:
+                self._count(key, "misses")
+                return None
+
+            self._entries.move_to_end(key)
+            self._count(key, "hits")
+            return entry.payload
+
+    def lookup(self, key, grace=0):
+        """
+        (payload, age_seconds, is_stale) for a fresh entry, or for one that
+        expired less than grace seconds ago (stale-while-revalidate);
+        None otherwise.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at + grace <= now:
+                self._count(key, "misses")
+                return None
+
+            stale = entry.expires_at <= now
+            self._entries.move_to_end(key)
+            self._count(key, "stale_hits" if stale else "hits")
+            return entry.payload, now - entry.stored_at, stale
+
+    def stored_size(self, key):
+        """Size of the fresh entry for key, or None (not counted as a lookup)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                return None
+            return entry.size
+
+    # ---------- Store ----------
+    def set(self, key, payload, ttl, size, validators=None):
+        """
+        Store a payload for ttl seconds. validators are the upstream's
+        ETag / Last-Modified headers, used to revalidate the entry once
+        it has expired (see revalidate).
+        """
+        if not ttl or ttl <= 0 or size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+            now = time.monotonic()
+            self._entries[key] = _Entry(now + ttl, now, size, payload, validators or {})
+            self._bytes += size
+
+            # Evict least recently used entries until we are back under budget
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._count(oldest, "evictions")
+
+    # ---------- Conditional requests ----------
+    def validators(self, key):
+        """ETag / Last-Modified stored with an entry (expired or not), or {}."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry.validators) if entry else {}
+
+    def revalidate(self, key, ttl):
+        """
+        The upstream answered 304 Not Modified: give the entry a fresh ttl
+        and return its payload (None when it was evicted meanwhile).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            now = time.monotonic()
+            self._entries[key] = entry._replace(expires_at=now + ttl, stored_at=now)
+            self._entries.move_to_end(key)
+            self._count(key, "revalidations")
+            return entry.payload
+
+    # ---------- Invalidation ----------
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def invalidate_source(self, source_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == source_id]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # ---------- Stats ----------
+    def stats(self, tenant=None):
+        tenant_id = tenant.id if tenant else None
+        with self._lock:
+            counters = dict(self._stats.get(tenant_id, {}))
+            entries = [e for k, e in self._entries.items() if k[0] == tenant_id]
+            return {
+                "hits": counters.get("hits", 0),
+                "stale_hits": counters.get("stale_hits", 0),
+                "misses": counters.get("misses", 0),
+                "evictions": counters.get("evictions", 0),
+                "revalidations": counters.get("revalidations", 0),
+                "entries": len(entries),
+                "bytes": sum(entry.size for entry in entries),
+            }
+
+    # ---------- Internal helpers (lock must be held) ----------
+    def _drop(self, key):
+        size = self._entries.pop(key).size
+        self._bytes -= size
+
+    def _count(self, key, counter):
+        tenant_stats = self._stats.setdefault(key[0], {})
+        tenant_stats[counter] = tenant_stats.get(counter, 0) + 1
+
+
+dataset_cache = DatasetResultCache(
+    max_bytes=getattr(settings, "DATASET_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+)
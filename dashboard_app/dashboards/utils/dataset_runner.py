@@ -0,0 +1,739 @@
+# dashboards/utils/dataset_runner.py
+import json
+import logging
+import threading
+from collections.abc import Iterator
+from concurrent.futures import as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from urllib.parse import urljoin
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from subscriptions.utils.api_row_meter import ApiRowQuotaExceeded, api_row_meter
+
+from ..models import Dataset
+from .aggregation import to_number
+from .circuit_breaker import CircuitOpenError
+from .dataset_cache import dataset_cache, make_cache_key
+from .deadlines import Deadline, DeadlineExceeded, deadline_scope
+from .fetch_scheduler import fetch_scheduler
+from .hedging import hedged_get
+from .http_sessions import get_session
+from .joins import SpilledRows, row_key, split_fields, spool_rows
+from .json_stream import CHUNK_SIZE, CountingChunks, stream_payload
+from .jwt_tokens import get_jwt_token
+from .negative_cache import UpstreamBackoff, failure_cache, is_upstream_failure
+from .pagination import iter_pages
+from .single_flight import coalesce, single_flight
+from .snapshots import SnapshotError, open_snapshot, snapshot_path, write_snapshot
+from .transfer import iter_decoded, read_body
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_FETCH_TIMEOUT = 20  # seconds, wall clock per dataset fetch
+DEFAULT_STREAM_PARSE_MIN_BYTES = 1024 * 1024
+DEFAULT_STALE_GRACE_SECONDS = 60  # serve expired results this long while refreshing
+
+STREAMABLE_PAGINATION = ("none", "link_header")
+
+_refreshing = set()  # cache keys with a background refresh queued or running
+_refreshing_lock = threading.Lock()
+
+
+# ---------- Response normalization ----------
+def normalize_payload(data):
+    """
+    Normalize an upstream JSON body to {"data": [rows]} when possible,
+    otherwise return it untouched as {"result": data}.
+    """
+    if isinstance(data, dict):
+        for k in ("results", "data", "rows"):
+            if k in data and isinstance(data[k], list):
+                return {"data": data[k]}
+
+        if all(isinstance(v, dict) for v in data.values()):
+            return {"data": list(data.values())}
+        return {"result": data}
+
+    return {"data": data}
+
+
+def payload_rows(payload):
+    """
+    Rows of a run payload (a non-tabular result yields an empty list).
+    A streamed payload's row iterator (or spooled rows) is returned as is.
+    """
+    if isinstance(payload, dict):
+        data = payload.get("data", [])
+        return data if isinstance(data, (list, Iterator, SpilledRows)) else []
+    return payload if isinstance(payload, list) else []
+
+
+# ---------- Upstream requests ----------
+def build_request(dataset):
+    """Resolve (source, url, headers, params) for a dataset, including auth."""
+    source = dataset.api_source
+    endpoint = dataset.endpoint or ""
+    url = urljoin(source.base_url.rstrip("/") + "/", endpoint.lstrip("/"))
+
+    # Copy so auth params never leak back into dataset.query_params
+    params = {**(dataset.query_params or {}), **auth_params(source)}
+    headers = {}
+
+    # Handle API auth types
+    if source.auth_type == "API_KEY_HEADER" and source.api_key:
+        headers[source.api_key_name] = source.api_key
+    elif source.auth_type == "BEARER" and (source.bearer_token or source.api_key):
+        headers["Authorization"] = f"Bearer {source.bearer_token or source.api_key}"
+    elif source.auth_type == "JWT_HS256" and source.jwt_secret:
+        headers["Authorization"] = f"Bearer {get_jwt_token(source)}"
+
+    return source, url, headers, params
+
+
+def auth_params(source):
+    """Query params a source authenticates with (API_KEY_QUERY), sent with every page."""
+    if source.auth_type == "API_KEY_QUERY" and source.api_key:
+        return {source.api_key_name: source.api_key}
+    return {}
+
+
+def read_payload(resp, allow_stream=True, source_id=None):
+    """
+    Read a response into a normalized payload.
+
+    Large bodies (over DATASET_STREAM_PARSE_MIN_BYTES, or of unknown
+    length) are parsed incrementally from resp.iter_content: payload
+    "data" is then a lazy row iterator and the response stays open
+    until it is exhausted. resp must be opened with stream=True:
+    compressed bodies are decoded chunk by chunk on the way into the
+    parser, and wire vs body bytes are recorded for source_id (see
+    transfer.py). Returns (payload, counter); counter.bytes is the
+    decoded body size once the rows have been consumed.
+    """
+    length = resp.headers.get("Content-Length")
+    min_bytes = getattr(settings, "DATASET_STREAM_PARSE_MIN_BYTES", DEFAULT_STREAM_PARSE_MIN_BYTES)
+    if allow_stream and (length is None or int(length) > min_bytes):
+        chunks = iter_decoded(resp, CHUNK_SIZE, source_id)
+        counter = CountingChunks(chunks)
+        payload = stream_payload(counter)
+        if isinstance(payload.get("data"), list) or "data" not in payload:
+            _finish(chunks, resp)
+        else:
+            payload["data"] = _closing_rows(payload["data"], chunks, resp)
+        return payload, counter
+
+    body = read_body(resp, source_id)
+    counter = CountingChunks(())
+    counter.bytes = len(body)
+    return normalize_payload(json.loads(body)), counter
+
+
+def _finish(chunks, resp):
+    chunks.close()  # records the transfer stats
+    resp.close()
+
+
+def _closing_rows(rows, chunks, resp):
+    try:
+        yield from rows
+    finally:
+        _finish(chunks, resp)
+
+
+class NotModified(Exception):
+    """The upstream answered a conditional request with 304 Not Modified."""
+
+
+def conditional_headers(validators):
+    """If-None-Match / If-Modified-Since for stored ETag / Last-Modified validators."""
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def response_validators(resp):
+    validators = {
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+    }
+    return {k: v for k, v in validators.items() if v}
+
+
+def iter_dataset_pages(dataset, extra_params=None, extra_headers=None):
+    """
+    Lazily fetch a dataset page by page, following its pagination strategy.
+    extra_params / extra_headers are added to the requests (query params
+    only to the first one).
+
+    Yields (payload, counter, response) per page, see read_payload. The
+    last page's payload is flagged "truncated" when max_pages stopped the
+    walk with pages left. Raises NotModified when a conditional request gets a 304. Requests go
+    through the source's circuit breaker with its adaptive timeout. Raises
+    requests.RequestException (CircuitOpenError while the circuit is
+    open, PaginationError for a bad config, or ValueError for a malformed
+    body) on failure. Sources with hedge_requests get hedged requests.
+    """
+    source, url, headers, params = build_request(dataset)
+    params.update(extra_params or {})
+    headers.update(extra_headers or {})
+    session = get_session(source)
+    pagination_type = getattr(dataset, "pagination_type", "none")
+    # Body-driven pagination needs the whole page body to find the next one
+    allow_stream = pagination_type in STREAMABLE_PAGINATION
+    body_sizes = {}  # response -> decoded body bytes, for body-driven pages
+
+    def fetch_page(page_url, page_params):
+        # Always stream=True: bodies are decompressed by iter_decoded
+        resp = hedged_get(
+            session,
+            source,
+            page_url,
+            headers=headers,
+            params=page_params,
+            stream=True,
+        )
+        if resp.status_code == 304:
+            resp.close()
+            raise NotModified()
+        resp.raise_for_status()
+        if allow_stream:
+            return read_payload(resp, True, source.id), resp
+        # iter_pages reads the next link / cursor / row count from the raw body
+        body = read_body(resp, source.id)
+        body_sizes[resp] = len(body)
+        return json.loads(body), resp
+
+    truncated = []
+    pages = iter_pages(
+        fetch_page,
+        url,
+        params,
+        pagination_type,
+        getattr(dataset, "pagination_config", None),
+        keep_params=auth_params(source),
+        on_truncated=lambda: truncated.append(True),
+    )
+    for body, resp in pages:
+        if allow_stream:
+            payload, counter = body
+        else:
+            payload = normalize_payload(body)
+            counter = CountingChunks(())
+            counter.bytes = body_sizes.pop(resp)
+        if truncated:
+            payload = {**payload, "truncated": True}
+        yield payload, counter, resp
+
+
+# ---------- Single dataset ----------
+def run_dataset(dataset, tenant):
+    """
+    Fetch a dataset from its upstream API (through the result cache).
+
+    Materialized datasets are read from their latest snapshot instead
+    (the upstream is only called when no snapshot exists yet).
+    All pages are collected into one payload; rows pulled from the
+    upstream count against the tenant's API row quota (429 once it is
+    used up). Concurrent identical runs
+    (same cache key) share one upstream fetch, see single_flight. Does
+    not touch the request or thread-local tenant, so it is safe to call
+    from worker threads. Returns (payload, status_code).
+
+    A result that expired less than DATASET_STALE_GRACE_SECONDS ago is
+    returned right away, flagged "stale" with its "age", while it is
+    refreshed in the background (see cached_result).
+    """
+    snapshot = _materialized_snapshot(dataset)
+    if snapshot is not None:
+        with snapshot:
+            return {"data": list(snapshot.rows())}, 200
+
+    cache_key = make_cache_key(tenant, dataset)
+    cached = cached_result(dataset, tenant, cache_key)
+    if cached is not None:
+        return cached, 200
+
+    return _run_shared(dataset, tenant, cache_key)
+
+
+def _run_shared(dataset, tenant, cache_key):
+    def is_shareable(result):
+        # Only fresh results that fit the result cache (so at most
+        # DATASET_CACHE_MAX_BYTES) are handed to other processes
+        payload, status_code = result
+        return status_code < 400 and not payload.get("stale") and dataset_cache.stored_size(cache_key) is not None
+
+    def run():
+        return coalesce(cache_key, lambda: _fetch_dataset(dataset, tenant, cache_key), is_shareable)
+
+    # Joining a fetch already in flight needs no fetch slot. Otherwise the
+    # slot is taken before coalescing, so a flight's leader always holds one.
+    try:
+        if single_flight.running(cache_key):
+            return run()
+        with fetch_scheduler.slot(getattr(tenant, "id", None), dataset.api_source_id):
+            return run()
+    except DeadlineExceeded as e:
+        return {"error": str(e)}, 504
+
+
+def _fetch_dataset(dataset, tenant, cache_key):
+    # A run that was waiting on the previous flight may find it cached by now
+    cached = dataset_cache.get(cache_key)
+    if cached is not None:
+        return cached, 200
+
+    # Single-page datasets revalidate an expired entry with a conditional GET
+    single_page = getattr(dataset, "pagination_type", "none") == "none"
+    conditional = conditional_headers(dataset_cache.validators(cache_key)) if single_page else {}
+
+    rows, size, validators, truncated = [], 0, {}, False
+    try:
+        failure_cache.check(cache_key)
+        for payload, counter, resp in iter_dataset_pages(dataset, extra_headers=conditional):
+            truncated = truncated or payload.get("truncated", False)
+            if single_page:
+                validators = response_validators(resp)
+            if "data" not in payload:
+                # Non-tabular body: only meaningful as a single page
+                failure_cache.record_success(cache_key)
+                dataset_cache.set(cache_key, payload, dataset.cache_ttl_seconds, size + counter.bytes, validators)
+                return payload, 200
+            rows.extend(api_row_meter.meter_rows(getattr(tenant, "id", None), payload_rows(payload)))
+            size += counter.bytes
+    except NotModified:
+        failure_cache.record_success(cache_key)
+        cached = dataset_cache.revalidate(cache_key, dataset.cache_ttl_seconds)
+        if cached is not None:
+            return cached, 200
+        return _fetch_dataset(dataset, tenant, cache_key)  # evicted meanwhile, fetch in full
+    except (CircuitOpenError, UpstreamBackoff) as e:
+        return unavailable_payload(e, cache_key)
+    except ApiRowQuotaExceeded as e:
+        return {"error": str(e)}, 429
+    except (requests.RequestException, ValueError) as e:
+        if is_upstream_failure(e):
+            failure_cache.record_failure(cache_key, e)
+        return {"error": str(e)}, 502
+
+    failure_cache.record_success(cache_key)
+    payload = {"data": rows, "truncated": True} if truncated else {"data": rows}
+    dataset_cache.set(cache_key, payload, dataset.cache_ttl_seconds, size, validators)
+    return payload, 200
+
+
+# ---------- Stale-while-revalidate ----------
+def get_stale_grace_seconds():
+    return getattr(settings, "DATASET_STALE_GRACE_SECONDS", DEFAULT_STALE_GRACE_SECONDS)
+
+
+def cached_result(dataset, tenant, cache_key=None):
+    """
+    Cached payload for a dataset run, or None.
+
+    Within the grace window after its TTL an entry is still served,
+    flagged "stale" with its "age" in seconds, and one background refresh
+    is started for it, so the first viewer after expiry does not wait on
+    the upstream.
+    """
+    cache_key = cache_key or make_cache_key(tenant, dataset)
+    found = dataset_cache.lookup(cache_key, get_stale_grace_seconds())
+    if found is None:
+        return None
+
+    payload, age, stale = found
+    if not stale:
+        return payload
+    refresh_in_background(dataset, tenant, cache_key)
+    return {**payload, "stale": True, "age": int(age)}
+
+
+def refresh_in_background(dataset, tenant, cache_key):
+    """Queue one refresh per cache key on the fetch scheduler (no-op if one is pending)."""
+    with _refreshing_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+
+    def refresh():
+        try:
+            # Not bound by the deadline of the request that noticed the stale entry
+            with deadline_scope(None):
+                payload, status_code = _run_shared(dataset, tenant, cache_key)
+            if status_code >= 400:
+                logger.warning(f"[Dataset] Background refresh of {dataset.id} failed: {payload.get('error')}")
+        except Exception:
+            logger.exception(f"[Dataset] Background refresh of {dataset.id} crashed")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(cache_key)
+
+    try:
+        fetch_scheduler.submit(getattr(tenant, "id", None), dataset.api_source_id, refresh)
+    except RuntimeError:  # pool shut down (interpreter exit)
+        with _refreshing_lock:
+            _refreshing.discard(cache_key)
+
+
+def unavailable_payload(error, cache_key):
+    """
+    The last good (stale) cached data while an upstream is not being
+    called, because its circuit is open (CircuitOpenError) or it is backing
+    off after failures (UpstreamBackoff). Without cached data: a fast 503,
+    or the failure being backed off from, with retry_after.
+    """
+    stale = dataset_cache.get(cache_key, allow_stale=True)
+    if stale is not None:
+        return {**stale, "stale": True}, 200
+    return {"error": str(error), "retry_after": error.retry_after}, getattr(error, "status_code", 503)
+
+
+def stream_dataset_rows(dataset, tenant, columns=None):
+    """
+    Generator of a dataset's rows, fetching pages only as they are consumed.
+
+    Memory stays proportional to one page. The rows are also collected
+    for the result cache until they outgrow the cache budget. Upstream
+    errors are raised from the iteration as requests.RequestException,
+    and ApiRowQuotaExceeded once the tenant's row quota is used up.
+
+    Materialized datasets stream from their snapshot, one row group at a
+    time; columns (when given) limits which snapshot columns are decoded.
+    DeadlineExceeded is raised once the current deadline has passed.
+    """
+    snapshot = _materialized_snapshot(dataset)
+    if snapshot is not None:
+        with snapshot:
+            yield from snapshot.rows(columns)
+        return
+
+    cache_key = make_cache_key(tenant, dataset)
+    cached = cached_result(dataset, tenant, cache_key)
+    if cached is not None:
+        yield from payload_rows(cached)
+        return
+
+    failure_cache.check(cache_key)
+    collected, size, truncated = [], 0, False
+    try:
+        with fetch_scheduler.slot(getattr(tenant, "id", None), dataset.api_source_id):
+            for payload, counter, _ in iter_dataset_pages(dataset):
+                truncated = truncated or payload.get("truncated", False)
+                for row in api_row_meter.meter_rows(getattr(tenant, "id", None), payload_rows(payload)):
+                    if collected is not None:
+                        collected.append(row)
+                    yield row
+
+                size += counter.bytes
+                if collected is not None and not (dataset.cache_ttl_seconds and size <= dataset_cache.max_bytes):
+                    collected = None
+    except requests.RequestException as e:
+        if is_upstream_failure(e):
+            failure_cache.record_failure(cache_key, e)
+        raise
+
+    failure_cache.record_success(cache_key)
+    if collected is not None:
+        cached = {"data": collected, "truncated": True} if truncated else {"data": collected}
+        dataset_cache.set(cache_key, cached, dataset.cache_ttl_seconds, size)
+
+
+def spool_dataset(dataset, tenant):
+    """
+    run_dataset() for join inputs: the rows are streamed page by page and
+    held in memory only up to JOIN_MEMORY_BUDGET_BYTES, past that they are
+    spooled to disk (payload "data" is then SpilledRows, see joins), so a
+    large join input is never loaded in full. Cached results are used as
+    is. Returns (payload, status_code).
+    """
+    cache_key = make_cache_key(tenant, dataset)
+    if not getattr(dataset, "materialized", False):
+        cached = cached_result(dataset, tenant, cache_key)
+        if cached is not None:
+            return cached, 200
+
+    try:
+        return {"data": spool_rows(stream_dataset_rows(dataset, tenant))}, 200
+    except (CircuitOpenError, UpstreamBackoff) as e:
+        return unavailable_payload(e, cache_key)
+    except ApiRowQuotaExceeded as e:
+        return {"error": str(e)}, 429
+    except DeadlineExceeded as e:
+        return {"error": str(e)}, 504
+    except (requests.RequestException, ValueError) as e:
+        return {"error": str(e)}, 502
+
+
+# ---------- Materialized datasets ----------
+def _materialized_snapshot(dataset):
+    if not getattr(dataset, "materialized", False):
+        return None
+    snapshot = open_snapshot(dataset)
+    if snapshot is None:
+        logger.warning(f"[Snapshot] Dataset {dataset.id} has no snapshot yet, fetching live")
+    return snapshot
+
+
+REFRESH_MODES = ("auto", "full", "incremental")
+
+
+def refresh_snapshot(dataset, mode="auto", on_mode=None):
+    """
+    Refresh a dataset's on-disk snapshot.
+
+    - full: re-download every row and replace the snapshot
+    - incremental: send the snapshot's last watermark as a query param,
+      fetch only newer / changed rows and merge them into the snapshot
+      by primary key (appended when the dataset has no primary key)
+    - auto: incremental when the dataset has a watermark field and a
+      snapshot with a watermark exists, full otherwise
+
+    Rows are streamed page by page into the snapshot writer, so a full
+    refresh holds one page plus one row group in memory (an incremental
+    one also holds the fetched delta). The previous snapshot stays in
+    place if anything fails. on_mode(resolved_mode) is called before the
+    fetch starts ("full" or "incremental"). Returns (payload, status_code).
+    """
+    if mode not in REFRESH_MODES:
+        return {"error": f"Unknown refresh mode: {mode}"}, 400
+
+    previous = open_snapshot(dataset)
+    try:
+        return _refresh_snapshot(dataset, mode, previous, on_mode)
+    finally:
+        if previous is not None:
+            previous.close()
+
+
+def _refresh_snapshot(dataset, mode, previous, on_mode):
+    last_watermark = previous.meta.get("watermark") if previous is not None else None
+    incremental = bool(dataset.watermark_field) and last_watermark is not None
+    if mode == "incremental" and not incremental:
+        return {"error": "Incremental refresh needs a watermark field and an existing snapshot."}, 400
+    if mode == "full":
+        incremental = False
+    if on_mode is not None:
+        on_mode("incremental" if incremental else "full")
+
+    watermark = WatermarkTracker(dataset.watermark_field, last_watermark if incremental else None)
+    extra_params = (
+        {dataset.watermark_param or dataset.watermark_field: last_watermark}
+        if incremental
+        else None
+    )
+
+    meta = {"watermark": watermark.value}
+
+    def fetched_rows():
+        for payload, _, _ in iter_dataset_pages(dataset, extra_params):
+            if "data" not in payload:
+                raise SnapshotError("Upstream did not return rows; only tabular data can be materialized.")
+            if payload.get("truncated"):
+                meta["truncated"] = True
+            for row in api_row_meter.meter_rows(dataset.tenant_id, payload_rows(payload)):
+                watermark.update(row)
+                yield row
+        meta["watermark"] = watermark.value
+
+    try:
+        with fetch_scheduler.slot(dataset.tenant_id, dataset.api_source_id):
+            if incremental:
+                delta = list(fetched_rows())
+                rows = merge_rows(previous.rows(), delta, split_fields(dataset.primary_key))
+            else:
+                delta, rows = None, fetched_rows()
+            footer = write_snapshot(snapshot_path(dataset), rows, meta=meta)
+    except ApiRowQuotaExceeded as e:
+        logger.warning(f"[Snapshot] Refresh of dataset {dataset.id} stopped: {e}")
+        return {"error": str(e)}, 429
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"[Snapshot] Refresh of dataset {dataset.id} failed: {e}")
+        return {"error": str(e)}, 502
+
+    dataset.snapshot_refreshed_at = timezone.now()
+    dataset.snapshot_rows = footer["row_count"]
+    Dataset.objects.filter(pk=dataset.pk).update(
+        snapshot_refreshed_at=dataset.snapshot_refreshed_at,
+        snapshot_rows=dataset.snapshot_rows,
+    )
+    return {
+        "dataset": dataset.id,
+        "mode": "incremental" if incremental else "full",
+        "rows": footer["row_count"],
+        "fetched_rows": len(delta) if delta is not None else footer["row_count"],
+        "watermark": watermark.value,
+        "truncated": meta.get("truncated", False),
+        "size_bytes": footer["size_bytes"],
+        "columns": footer["columns"],
+        "refreshed_at": dataset.snapshot_refreshed_at,
+    }, 200
+
+
+class WatermarkTracker:
+    """
+    Running maximum of a watermark field. Numbers compare numerically,
+    anything else as text (ISO-8601 timestamps sort correctly as text).
+    """
+
+    def __init__(self, field, value=None):
+        self.field = field
+        self.value = value
+
+    def update(self, row):
+        if not self.field:
+            return
+        candidate = row.get(self.field)
+        if candidate is None:
+            return
+        if self.value is None or _watermark_key(candidate) > _watermark_key(self.value):
+            self.value = candidate
+
+
+def _watermark_key(value):
+    number = to_number(value)
+    return (0, number, "") if number is not None else (1, 0, str(value))
+
+
+def merge_rows(existing, delta, key_fields):
+    """
+    Upsert delta rows into an existing row stream by key.
+
+    A delta row replaces the existing row with the same key in place;
+    delta rows with new keys are appended. Without key fields (or for
+    delta rows with a null key) rows are simply appended.
+    """
+    if not key_fields:
+        yield from existing
+        yield from delta
+        return
+
+    updates, unkeyed = {}, []
+    for row in delta:
+        key = row_key(row, key_fields)
+        if key is None:
+            unkeyed.append(row)
+        else:
+            updates[key] = row  # the last version of a key wins
+
+    for row in existing:
+        key = row_key(row, key_fields)
+        yield updates.pop(key, row) if key is not None else row
+    yield from updates.values()
+    yield from unkeyed
+
+
+# ---------- Several datasets at once ----------
+def fetch_many(datasets, tenant, timeout=None, fail_fast=False, spooled=()):
+    """
+    Fetch datasets concurrently on the fetch scheduler's pool (fair
+    across tenants, see fetch_scheduler).
+
+    Datasets that resolve to the same (source, endpoint, params) are
+    fetched once. Datasets whose id is in spooled (join inputs) are
+    fetched with spool_dataset. Returns {dataset.id: (payload, status_code)}; a fetch
+    that misses the wall-clock timeout is reported as a 504. The timeout
+    is a deadline for the fetches themselves too (see deadlines), so a
+    late fetch stops instead of running on after its 504.
+
+    With fail_fast, the first failure cancels the fetches that have not
+    started yet and those datasets are left out of the result.
+    """
+    timeout = timeout or get_fetch_timeout()
+
+    groups = {}  # cache key -> [datasets]
+    for ds in datasets:
+        groups.setdefault(make_cache_key(tenant, ds), []).append(ds)
+
+    by_key = {}
+    if len(groups) == 1:
+        key, group = next(iter(groups.items()))
+        with deadline_scope(Deadline(timeout)):
+            by_key[key] = _fetch_function(group, spooled)(group[0], tenant)
+    elif groups:
+        with deadline_scope(Deadline(timeout)):
+            fetches = submit_fetches(datasets, tenant, spooled)
+        futures = {future: key for key, (future, _) in fetches.items()}
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                key = futures[future]
+                by_key[key] = _future_result(future)
+                if fail_fast and by_key[key][1] >= 400:
+                    break
+        except FuturesTimeoutError:
+            for future, key in futures.items():
+                if key not in by_key:
+                    name = groups[key][0].name
+                    by_key[key] = ({"error": f"Dataset '{name}' timed out after {timeout}s"}, 504)
+
+        for future in futures:
+            future.cancel()
+
+    return {
+        ds.id: by_key[key]
+        for key, group in groups.items()
+        if key in by_key
+        for ds in group
+    }
+
+
+def get_fetch_timeout():
+    return getattr(settings, "DATASET_FETCH_TIMEOUT", DEFAULT_FETCH_TIMEOUT)
+
+
+def submit_fetches(datasets, tenant, spooled=()):
+    """
+    Start fetching datasets on the fetch scheduler, once per distinct
+    cache key, under the current deadline. Datasets whose id is in
+    spooled are fetched with spool_dataset. Returns
+    {cache key: (future, [datasets])}; see fetch_results.
+    """
+    groups = {}
+    for ds in datasets:
+        groups.setdefault(make_cache_key(tenant, ds), []).append(ds)
+    return {
+        key: (
+            fetch_scheduler.submit(
+                getattr(tenant, "id", None),
+                group[0].api_source_id,
+                _fetch_function(group, spooled),
+                group[0],
+                tenant,
+            ),
+            group,
+        )
+        for key, group in groups.items()
+    }
+
+
+def _fetch_function(group, spooled):
+    return spool_dataset if any(ds.id in spooled for ds in group) else run_dataset
+
+
+def fetch_results(fetches, timeout=None):
+    """
+    Wait up to timeout for submitted fetches. Returns
+    {dataset.id: (payload, status_code)} for the fetches that are done;
+    the others keep running.
+    """
+    wait([future for future, _ in fetches.values()], timeout=timeout)
+    return {
+        ds.id: _future_result(future)
+        for future, group in fetches.values()
+        if future.done() and not future.cancelled()
+        for ds in group
+    }
+
+
+def _future_result(future):
+    try:
+        return future.result()
+    except Exception as e:
+        logger.exception("Dataset fetch crashed")
+        return {"error": str(e)}, 500
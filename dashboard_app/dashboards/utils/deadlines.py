@@ -0,0 +1,92 @@
+# dashboards/utils/deadlines.py
+"""
+Request deadlines.
+
+A Deadline is set for a block of work with deadline_scope() and read
+back anywhere below it with current_deadline(). It lives in a context
+variable, so it follows the work into fetch scheduler and hedging pool
+threads (they run tasks in a copy of the submitter's context). Upstream
+requests cap their timeouts at the time left, and the page, join and
+aggregation stages stop with DeadlineExceeded once it has passed.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+CHECK_EVERY_ROWS = 1024
+
+_current = ContextVar("dashboards_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage=None):
+        self.stage = stage
+        super().__init__(f"Deadline exceeded during {stage}" if stage else "Deadline exceeded")
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage=None):
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+
+def current_deadline():
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """
+    Run the block under deadline (an earlier enclosing deadline still
+    applies). deadline_scope(None) clears the deadline, e.g. for work that
+    outlives the request that started it.
+    """
+    outer = _current.get()
+    if deadline is not None and outer is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def check_deadline(stage=None):
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def remaining_time(default):
+    """default, capped at the time left before the current deadline."""
+    deadline = _current.get()
+    return default if deadline is None else min(default, deadline.remaining())
+
+
+def checked_rows(rows, stage):
+    """
+    rows, checking the current deadline every CHECK_EVERY_ROWS rows.
+    Returned unchanged when no deadline is set.
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return rows
+    return _checked(rows, deadline, stage)
+
+
+def _checked(rows, deadline, stage):
+    for i, row in enumerate(rows):
+        if not i % CHECK_EVERY_ROWS:
+            deadline.check(stage)
+        yield row
@@ -0,0 +1,219 @@
+# dashboards/utils/fetch_scheduler.py
+"""
+Fair scheduling of upstream fetches across tenants.
+
+Every upstream fetch takes a slot first. A slot is only granted while
+the tenant and the ApiDataSource are under their concurrency limits, so
+one tenant refreshing a big dashboard cannot occupy every fetch worker.
+Waiting fetches are served by weighted fair queueing: each tenant has a
+virtual clock that advances by 1 / weight per fetch it starts, and the
+next slot goes to the waiting tenant that is furthest behind. Weights
+and per-tenant limits can come from the tenant's plan
+(SubscriptionPlan.features "fetch_weight" / "max_concurrent_fetches").
+
+Fetches are either submitted to the scheduler's worker pool (submit) or
+run on the caller's thread once a slot is granted (slot). Submitted
+tasks run in a copy of the submitter's context, so its deadline (see
+deadlines) applies to them too. Pool workers live as long as the process,
+so stale DB connections are closed around each task, as Django does
+around each request.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from subscriptions.models import TenantSubscription
+
+from .deadlines import DeadlineExceeded, current_deadline
+
+
+DEFAULT_FETCH_WORKERS = 8
+DEFAULT_TENANT_CONCURRENCY = 4   # concurrent upstream fetches per tenant
+DEFAULT_SOURCE_CONCURRENCY = 8   # ... and per ApiDataSource
+DEFAULT_POLICY_CACHE_SECONDS = 60
+
+
+class _Task:
+    __slots__ = ("tenant_id", "source_id", "limit", "fn", "args", "future", "granted", "context")
+
+    def __init__(self, tenant_id, source_id, limit, fn=None, args=()):
+        self.tenant_id = tenant_id
+        self.source_id = source_id
+        self.limit = limit
+        self.fn = fn                # None: runs on the waiting caller's thread
+        self.args = args
+        self.future = Future() if fn is not None else None
+        self.granted = threading.Event()
+        self.context = contextvars.copy_context() if fn is not None else None
+
+
+class FairFetchScheduler:
+    def __init__(self, workers):
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dataset-fetch")
+        self._queues = {}           # tenant_id -> deque of waiting tasks
+        self._vtime = {}            # tenant_id -> virtual clock
+        self._clock = 0.0           # virtual time of the last granted fetch
+        self._weights = {}          # tenant_id -> weight of its queued tasks
+        self._tenant_running = {}
+        self._source_running = {}
+        self._pooled_running = 0
+        self._policies = {}         # tenant_id -> (weight, limit, loaded_at)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    # ---------- Public API ----------
+    def submit(self, tenant_id, source_id, fn, *args):
+        """Queue fn(*args) for the worker pool. Returns a Future."""
+        task = self._enqueue(tenant_id, source_id, fn, args)
+        return task.future
+
+    @contextmanager
+    def slot(self, tenant_id, source_id):
+        """
+        Block until a fetch slot is granted, hold it for the with-block.
+        A thread that already holds a slot (e.g. a pool worker) just runs.
+        Raises DeadlineExceeded if the current deadline passes first.
+        """
+        if getattr(self._local, "held", False):
+            yield
+            return
+
+        deadline = current_deadline()
+        task = self._enqueue(tenant_id, source_id)
+        if not task.granted.wait(deadline.remaining() if deadline else None):
+            with self._lock:
+                queue = self._queues.get(tenant_id)
+                waiting = queue is not None and task in queue
+                if waiting:
+                    queue.remove(task)
+            if waiting:
+                raise DeadlineExceeded("fetch slot wait")
+            # Granted just as the deadline passed: the slot is ours
+        self._local.held = True
+        try:
+            yield
+        finally:
+            self._local.held = False
+            self._release(task)
+
+    # ---------- Queueing ----------
+    def _enqueue(self, tenant_id, source_id, fn=None, args=()):
+        weight, limit = self._policy(tenant_id)
+        task = _Task(tenant_id, source_id, limit, fn, args)
+        with self._lock:
+            queue = self._queues.setdefault(tenant_id, deque())
+            if not queue and not self._tenant_running.get(tenant_id):
+                # An idle tenant does not bank credit while it was away
+                self._vtime[tenant_id] = max(self._vtime.get(tenant_id, 0.0), self._clock)
+            self._weights[tenant_id] = weight
+            queue.append(task)
+            self._dispatch()
+        return task
+
+    def _dispatch(self):
+        # Lock must be held. Grant slots until nothing waiting is eligible.
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+
+            tenant_id = task.tenant_id
+            self._clock = self._vtime.get(tenant_id, 0.0)
+            self._vtime[tenant_id] = self._clock + 1 / self._weights.get(tenant_id, 1)
+            self._tenant_running[tenant_id] = self._tenant_running.get(tenant_id, 0) + 1
+            self._source_running[task.source_id] = self._source_running.get(task.source_id, 0) + 1
+            if task.fn is None:
+                task.granted.set()
+            else:
+                self._pooled_running += 1
+                self._pool.submit(self._run, task)
+
+    def _next_task(self):
+        # Lock must be held: earliest eligible task of the tenant furthest behind
+        source_limit = getattr(settings, "UPSTREAM_SOURCE_MAX_CONCURRENCY", DEFAULT_SOURCE_CONCURRENCY)
+        pool_free = self._pooled_running < self.workers
+        tenants = sorted(
+            (t for t, q in self._queues.items() if q),
+            key=lambda t: self._vtime.get(t, 0.0),
+        )
+        for tenant_id in tenants:
+            queue = self._queues[tenant_id]
+            for task in list(queue):
+                if task.future is not None and task.future.cancelled():
+                    queue.remove(task)
+                    continue
+                if self._tenant_running.get(tenant_id, 0) >= task.limit:
+                    break
+                if self._source_running.get(task.source_id, 0) >= source_limit:
+                    continue
+                if task.fn is not None and not pool_free:
+                    continue
+                queue.remove(task)
+                return task
+        return None
+
+    # ---------- Running ----------
+    def _run(self, task):
+        self._local.held = True
+        try:
+            if task.future.set_running_or_notify_cancel():
+                close_old_connections()
+                try:
+                    task.future.set_result(task.context.run(task.fn, *task.args))
+                except BaseException as e:
+                    task.future.set_exception(e)
+                finally:
+                    close_old_connections()
+        finally:
+            self._local.held = False
+            self._release(task)
+
+    def _release(self, task):
+        with self._lock:
+            for running, key in ((self._tenant_running, task.tenant_id), (self._source_running, task.source_id)):
+                running[key] -= 1
+                if not running[key]:
+                    del running[key]
+            if task.fn is not None:
+                self._pooled_running -= 1
+            self._dispatch()
+
+    # ---------- Tenant policy ----------
+    def _policy(self, tenant_id):
+        """(weight, concurrency limit) for a tenant, from its plan's features."""
+        default_limit = getattr(settings, "TENANT_MAX_CONCURRENT_FETCHES", DEFAULT_TENANT_CONCURRENCY)
+        if tenant_id is None:
+            return 1, default_limit
+
+        ttl = getattr(settings, "FETCH_POLICY_CACHE_SECONDS", DEFAULT_POLICY_CACHE_SECONDS)
+        cached = self._policies.get(tenant_id)
+        if cached and time.monotonic() - cached[2] < ttl:
+            return cached[0], cached[1]
+
+        features = (
+            TenantSubscription.objects
+            .filter(tenant_id=tenant_id, active=True)
+            .values_list("plan__features", flat=True)
+            .first()
+        )
+        if not isinstance(features, dict):
+            features = {}
+        try:
+            weight = max(0.1, float(features.get("fetch_weight", 1)))
+            limit = max(1, int(features.get("max_concurrent_fetches", default_limit)))
+        except (TypeError, ValueError):
+            weight, limit = 1, default_limit
+        self._policies[tenant_id] = (weight, limit, time.monotonic())
+        return weight, limit
+
+
+fetch_scheduler = FairFetchScheduler(
+    workers=getattr(settings, "DATASET_FETCH_WORKERS", DEFAULT_FETCH_WORKERS)
+)
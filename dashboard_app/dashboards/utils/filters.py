@@ -0,0 +1,279 @@
+# dashboards/utils/filters.py
+import json
+import re
+from functools import lru_cache
+
+from .aggregation import to_number
+
+
+class FilterError(ValueError):
+    pass
+
+
+# ---------- Conditions ----------
+OPERATOR_ALIASES = {
+    "=": "eq", "==": "eq", "equals": "eq", "is": "eq",
+    "!=": "neq", "<>": "neq", "not_equals": "neq", "is_not": "neq",
+    ">": "gt", "greater_than": "gt",
+    ">=": "gte", "greater_or_equal": "gte",
+    "<": "lt", "less_than": "lt",
+    "<=": "lte", "less_or_equal": "lte",
+    "contains": "contains", "not_contains": "not_contains",
+    "starts_with": "starts_with", "startswith": "starts_with",
+    "ends_with": "ends_with", "endswith": "ends_with",
+    "in": "in", "not_in": "not_in",
+    "between": "between",
+    "is_empty": "empty", "is_null": "empty", "empty": "empty",
+    "is_not_empty": "not_empty", "not_null": "not_empty", "not_empty": "not_empty",
+}
+OPERATORS = set(OPERATOR_ALIASES.values()) | {"eq", "neq", "gt", "gte", "lt", "lte"}
+
+
+def _comparable(a, b):
+    """Compare numerically when both sides are numbers, as text otherwise."""
+    na, nb = to_number(a), to_number(b)
+    if na is not None and nb is not None:
+        return na, nb
+    return str(a), str(b)
+
+
+def _is_empty(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def compile_condition(rule):
+    """{"field", "operator", "value"} -> predicate(row)."""
+    if not isinstance(rule, dict):
+        raise FilterError(f"Filter rule must be an object, got {rule!r}")
+
+    field = rule.get("field") or rule.get("column")
+    raw_op = str(rule.get("operator") or rule.get("op") or "eq").strip().lower()
+    op = OPERATOR_ALIASES.get(raw_op, raw_op)
+    value = rule.get("value")
+
+    if not field:
+        raise FilterError(f"Filter rule is missing a field: {rule!r}")
+    if op not in OPERATORS:
+        raise FilterError(f"Unknown filter operator: {raw_op}")
+
+    if op == "eq":
+        return lambda row: _eq(row.get(field), value)
+    if op == "neq":
+        return lambda row: not _eq(row.get(field), value)
+    if op in ("gt", "gte", "lt", "lte"):
+        compare = {
+            "gt": lambda a, b: a > b,
+            "gte": lambda a, b: a >= b,
+            "lt": lambda a, b: a < b,
+            "lte": lambda a, b: a <= b,
+        }[op]
+
+        def ordered(row):
+            cell = row.get(field)
+            if cell is None:
+                return False
+            a, b = _comparable(cell, value)
+            return compare(a, b)
+        return ordered
+    if op in ("contains", "not_contains", "starts_with", "ends_with"):
+        needle = str(value if value is not None else "").lower()
+        test = {
+            "contains": lambda s: needle in s,
+            "not_contains": lambda s: needle not in s,
+            "starts_with": lambda s: s.startswith(needle),
+            "ends_with": lambda s: s.endswith(needle),
+        }[op]
+        return lambda row: test(str(row.get(field) if row.get(field) is not None else "").lower())
+    if op in ("in", "not_in"):
+        if not isinstance(value, (list, tuple)):
+            value = [v.strip() for v in str(value or "").split(",")]
+        options = list(value)
+        if op == "in":
+            return lambda row: any(_eq(row.get(field), v) for v in options)
+        return lambda row: not any(_eq(row.get(field), v) for v in options)
+    if op == "between":
+        if not isinstance(value, (list, tuple)) or len(value) != 2:
+            raise FilterError(f"'between' needs a [low, high] value for field {field}")
+        low, high = value
+
+        def between(row):
+            cell = row.get(field)
+            if cell is None:
+                return False
+            a, lo = _comparable(cell, low)
+            b, hi = _comparable(cell, high)
+            return lo <= a and b <= hi
+        return between
+    if op == "empty":
+        return lambda row: _is_empty(row.get(field))
+    return lambda row: not _is_empty(row.get(field))
+
+
+def _eq(cell, value):
+    if cell == value:
+        return True
+    a, b = _comparable(cell, value)
+    return a == b
+
+
+# ---------- Logic expression ----------
+TOKEN_RE = re.compile(r"\s*(\(|\)|&&|\|\||!|[A-Za-z0-9_]+)")
+
+
+def tokenize(expression):
+    tokens, pos = [], 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = TOKEN_RE.match(expression, pos)
+        if not match:
+            raise FilterError(f"Invalid logic expression near: {expression[pos:]!r}")
+        tokens.append(match.group(1))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive-descent parser for rule expressions like "(1 AND 2) OR NOT 3".
+
+    Grammar:  expr := term (OR term)* ; term := factor (AND factor)* ;
+              factor := NOT factor | '(' expr ')' | rule-reference
+    """
+
+    def __init__(self, tokens, rules):
+        self.tokens = tokens
+        self.rules = rules
+        self.pos = 0
+
+    def parse(self):
+        node = self.expr()
+        if self.pos != len(self.tokens):
+            raise FilterError(f"Unexpected token in logic expression: {self.tokens[self.pos]}")
+        return node
+
+    def peek(self):
+        return self.tokens[self.pos].upper() if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expr(self):
+        parts = [self.term()]
+        while self.peek() in ("OR", "||"):
+            self.take()
+            parts.append(self.term())
+        return parts[0] if len(parts) == 1 else (lambda row: any(p(row) for p in parts))
+
+    def term(self):
+        parts = [self.factor()]
+        while self.peek() in ("AND", "&&"):
+            self.take()
+            parts.append(self.factor())
+        return parts[0] if len(parts) == 1 else (lambda row: all(p(row) for p in parts))
+
+    def factor(self):
+        token = self.peek()
+        if token is None:
+            raise FilterError("Logic expression ended unexpectedly")
+        if token in ("NOT", "!"):
+            self.take()
+            inner = self.factor()
+            return lambda row: not inner(row)
+        if token == "(":
+            self.take()
+            node = self.expr()
+            if self.peek() != ")":
+                raise FilterError("Missing ')' in logic expression")
+            self.take()
+            return node
+        if token in (")", "AND", "OR", "&&", "||"):
+            raise FilterError(f"Unexpected token in logic expression: {token}")
+
+        ref = self.take()
+        if ref not in self.rules:
+            raise FilterError(f"Logic expression references unknown rule: {ref}")
+        return self.rules[ref]
+
+
+# ---------- Public API ----------
+def _rule_refs(logic_rules):
+    """Index rules by their id / name and by 1-based position."""
+    refs = {}
+    for i, rule in enumerate(logic_rules, start=1):
+        predicate = compile_condition(rule)
+        refs[str(i)] = predicate
+        for key in ("id", "name", "label"):
+            if isinstance(rule, dict) and rule.get(key) not in (None, ""):
+                refs[str(rule[key])] = predicate
+    return refs
+
+
+def _normalize_filters(filters):
+    if not filters:
+        return []
+    if isinstance(filters, dict):
+        # {"region": "EU"} shorthand for equality filters
+        if "field" in filters:
+            return [filters]
+        return [{"field": k, "operator": "eq", "value": v} for k, v in filters.items()]
+    if isinstance(filters, list):
+        return filters
+    raise FilterError("filters must be a list of rules or a {field: value} object")
+
+
+@lru_cache(maxsize=512)
+def _compile_cached(spec):
+    filters, logic_rules, logic_expression = json.loads(spec)
+
+    predicates = [compile_condition(rule) for rule in _normalize_filters(filters)]
+
+    if logic_rules:
+        if not isinstance(logic_rules, list):
+            raise FilterError("logic_rules must be a list of rules")
+        refs = _rule_refs(logic_rules)
+        if logic_expression and logic_expression.strip():
+            predicates.append(_Parser(tokenize(logic_expression), refs).parse())
+        else:
+            predicates.extend(compile_condition(rule) for rule in logic_rules)
+
+    if not predicates:
+        return None
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda row: all(p(row) for p in predicates)
+
+
+def compile_chart_predicate(filters=None, logic_rules=None, logic_expression=None):
+    """
+    Compile a chart's filters + logic rules into one row predicate.
+
+    - filters: list of {"field", "operator", "value"} rules, all must match
+    - logic_rules: list of rules referenced from logic_expression by id,
+      name or 1-based position (all must match when there is no expression)
+    - logic_expression: e.g. "(1 AND 2) OR NOT 3" (also && / || / !)
+
+    Compiled predicates are cached per distinct spec. Returns None when
+    there is nothing to filter; raises FilterError on invalid input.
+    """
+    spec = json.dumps([filters, logic_rules, logic_expression], sort_keys=True, default=str)
+    return _compile_cached(spec)
+
+
+def filter_fields(filters=None, logic_rules=None):
+    """Names of the fields a chart's filters and logic rules read."""
+    rules = _normalize_filters(filters) + (logic_rules if isinstance(logic_rules, list) else [])
+    return {
+        rule.get("field") or rule.get("column")
+        for rule in rules
+        if isinstance(rule, dict) and (rule.get("field") or rule.get("column"))
+    }
+
+
+def filter_rows(chart, rows):
+    """Lazily apply the chart's compiled predicate to an iterable of rows."""
+    predicate = compile_chart_predicate(chart.filters, chart.logic_rules, chart.logic_expression)
+    if predicate is None:
+        return rows
+    return (row for row in rows if isinstance(row, dict) and predicate(row))
@@ -0,0 +1,149 @@
+# dashboards/utils/hedging.py
+"""
+Hedged upstream requests.
+
+For sources with hedge_requests enabled, a request that has not answered
+by the source's observed p95 latency gets an identical second request;
+both run on the hedging pool and the first successful response wins.
+The other one is cancelled if it has not started yet, or its response
+is closed as soon as it returns (requests cannot abort a call in
+flight). A failed attempt only loses when the other one succeeds.
+Hedges are paid for from a per-source budget that earns BUDGET_RATIO of
+a hedge per request, so they add at most that share of extra upstream
+load.
+"""
+import contextvars
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from .circuit_breaker import get_breaker, guarded_get, percentile
+
+
+DEFAULT_HEDGING_CONFIG = {
+    "PERCENTILE": 0.95,     # hedge after this latency percentile of the source
+    "MIN_SAMPLES": 20,      # no hedging before this many latency samples
+    "MIN_DELAY": 0.05,      # never hedge sooner than this (seconds)
+    "BUDGET_RATIO": 0.05,   # hedges earned per request (5% extra load)
+    "BUDGET_BURST": 10,     # hedges that can be saved up
+    "WORKERS": 16,
+}
+
+
+def get_hedging_config():
+    return {**DEFAULT_HEDGING_CONFIG, **getattr(settings, "UPSTREAM_HEDGING", {})}
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=get_hedging_config()["WORKERS"],
+    thread_name_prefix="upstream-hedge",
+)
+
+
+class HedgeBudget:
+    """Token bucket per source: every request adds BUDGET_RATIO, a hedge costs 1."""
+
+    def __init__(self):
+        self._tokens = {}   # source_id -> tokens
+        self._counts = {}   # source_id -> {"requests", "hedges", "hedge_wins"}
+        self._lock = threading.Lock()
+
+    def record_request(self, source_id, config):
+        with self._lock:
+            tokens = self._tokens.get(source_id, 0) + config["BUDGET_RATIO"]
+            self._tokens[source_id] = min(config["BUDGET_BURST"], tokens)
+            self._count(source_id, "requests")
+
+    def try_spend(self, source_id):
+        with self._lock:
+            if self._tokens.get(source_id, 0) < 1:
+                return False
+            self._tokens[source_id] -= 1
+            self._count(source_id, "hedges")
+            return True
+
+    def record_win(self, source_id):
+        with self._lock:
+            self._count(source_id, "hedge_wins")
+
+    def stats(self, source_id):
+        with self._lock:
+            counts = dict(self._counts.get(source_id, {}))
+        requests_ = counts.get("requests", 0)
+        hedges = counts.get("hedges", 0)
+        return {
+            "requests": requests_,
+            "hedges": hedges,
+            "hedge_wins": counts.get("hedge_wins", 0),
+            "hedge_rate": round(hedges / requests_, 3) if requests_ else 0.0,
+        }
+
+    def _count(self, source_id, counter):
+        counts = self._counts.setdefault(source_id, {})
+        counts[counter] = counts.get(counter, 0) + 1
+
+
+hedge_budget = HedgeBudget()
+
+
+def hedge_delay(source, config=None):
+    """Seconds to wait before hedging, or None while there are too few samples."""
+    config = config or get_hedging_config()
+    latencies = get_breaker(source).recent_latencies()
+    if len(latencies) < config["MIN_SAMPLES"]:
+        return None
+    return max(config["MIN_DELAY"], percentile(latencies, config["PERCENTILE"]))
+
+
+def hedged_get(session, source, url, **kwargs):
+    """
+    guarded_get() that sends a second identical request when the first one
+    is slower than the source's p95 (and the hedge budget allows it).
+    Falls back to a plain guarded_get() for sources without hedging.
+    """
+    if not getattr(source, "hedge_requests", False) or source.id is None:
+        return guarded_get(session, source, url, **kwargs)
+
+    config = get_hedging_config()
+    hedge_budget.record_request(source.id, config)
+    delay = hedge_delay(source, config)
+    if delay is None:
+        return guarded_get(session, source, url, **kwargs)
+
+    def submit():
+        # Pool threads run in the caller's context (deadline, see deadlines)
+        return _executor.submit(contextvars.copy_context().run, guarded_get, session, source, url, **kwargs)
+
+    primary = submit()
+    done, _ = wait([primary], timeout=delay)
+    if done or not hedge_budget.try_spend(source.id):
+        return primary.result()
+
+    hedge = submit()
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        winner = next((f for f in done if f.exception() is None), None)
+        if winner is None:
+            error = error or next(iter(done)).exception()
+            continue
+        if winner is hedge:
+            hedge_budget.record_win(source.id)
+        for loser in (done | pending) - {winner}:
+            _discard(loser)
+        return winner.result()
+    raise error
+
+
+def _discard(future):
+    """Cancel a losing request, or close its response once (if ever) it arrives."""
+    if future.cancel():
+        return
+
+    def close(f):
+        if f.exception() is None:
+            f.result().close()
+
+    future.add_done_callback(close)
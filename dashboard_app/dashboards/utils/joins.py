@@ -0,0 +1,327 @@
+# dashboards/utils/joins.py
+import json
+import logging
+import math
+import os
+import tempfile
+import weakref
+
+from django.conf import settings
+
+from .deadlines import check_deadline
+
+logger = logging.getLogger(__name__)
+
+
+JOIN_TYPES = ("inner", "left", "right")
+
+DEFAULT_MEMORY_BUDGET = 32 * 1024 * 1024  # bytes of build side held in memory
+MAX_PARTITIONS = 256
+SPOOL_CHECK_ROWS = 256  # re-estimate a spooled input's size this often
+
+
+class JoinError(ValueError):
+    pass
+
+
+def split_fields(value):
+    """'customer_id, region' -> ['customer_id', 'region'] (composite keys)."""
+    return [f.strip() for f in (value or "").split(",") if f.strip()]
+
+
+def row_key(row, fields):
+    values = tuple(row.get(f) for f in fields)
+    # SQL semantics: NULL never matches anything
+    if any(v is None for v in values):
+        return None
+    try:
+        hash(values)
+        return values
+    except TypeError:
+        return tuple(str(v) for v in values)
+
+
+def estimate_bytes(rows, sample_size=50):
+    """
+    Rough JSON size of a list of rows, from a sample at the head of the
+    list (exact for spilled rows). None for anything else.
+    """
+    if isinstance(rows, SpilledRows):
+        return rows.size
+    if not isinstance(rows, list):
+        return None
+    if not rows:
+        return 0
+    sample = rows[:sample_size]
+    sample_bytes = sum(len(json.dumps(r, default=str)) for r in sample)
+    return sample_bytes * len(rows) // len(sample)
+
+
+def get_memory_budget():
+    return getattr(settings, "JOIN_MEMORY_BUDGET_BYTES", DEFAULT_MEMORY_BUDGET)
+
+
+def hash_join(left_rows, right_rows, left_fields, right_fields, how="inner", memory_budget=None):
+    """
+    Hash join two collections of dict rows.
+
+    - how: inner / left / right
+    - left_fields / right_fields: lists of key columns (composite keys)
+    - the smaller side is hashed into a multi-map (key -> [rows]) so
+      one-to-many and many-to-many keys produce every matching pair
+    - merged rows are {**left, **right}, like the previous implementation
+
+    Inputs may be lists, SpilledRows or iterators (anything but a list is
+    streamed as the probe side). When the build side is larger than
+    memory_budget, the join spills to disk (grace hash join) and returns
+    an iterator over the joined rows instead of a list. Otherwise only
+    the build side is held in memory: joined rows are collected with
+    spool_rows, so a result larger than memory_budget comes back as
+    SpilledRows.
+    """
+    if how not in JOIN_TYPES:
+        raise JoinError(f"Unsupported join type: {how}")
+    if not left_fields or len(left_fields) != len(right_fields):
+        raise JoinError("Join needs the same number of left and right key fields.")
+
+    memory_budget = memory_budget or get_memory_budget()
+    build_bytes = min(
+        (b for b in (estimate_bytes(left_rows), estimate_bytes(right_rows)) if b is not None),
+        default=0,
+    )
+    if build_bytes > memory_budget:
+        return grace_hash_join(left_rows, right_rows, left_fields, right_fields, how, build_bytes, memory_budget)
+
+    return spool_rows(_in_memory_join(left_rows, right_rows, left_fields, right_fields, how), memory_budget)
+
+
+def _in_memory_join(left_rows, right_rows, left_fields, right_fields, how):
+    """Generator of joined rows; holds the build side (the smaller list) in memory."""
+    # Only lists can be measured; anything else is streamed as the probe side
+    build_left = (
+        isinstance(left_rows, list)
+        and (not isinstance(right_rows, list) or len(left_rows) < len(right_rows))
+    )
+    if build_left:
+        build_rows, build_fields, probe_rows, probe_fields = left_rows, left_fields, right_rows, right_fields
+        keep_probe, keep_build = how == "right", how == "left"
+    else:
+        build_rows, build_fields, probe_rows, probe_fields = right_rows, right_fields, left_rows, left_fields
+        keep_probe, keep_build = how == "left", how == "right"
+
+    if not isinstance(build_rows, list):
+        build_rows = list(build_rows)
+
+    def merge(probe_row, build_row):
+        return {**build_row, **probe_row} if build_left else {**probe_row, **build_row}
+
+    # Build phase
+    index = {}
+    for i, row in enumerate(build_rows):
+        key = row_key(row, build_fields)
+        if key is not None:
+            index.setdefault(key, []).append(i)
+
+    # Probe phase
+    matched = set() if keep_build else None
+
+    for row in probe_rows:
+        key = row_key(row, probe_fields)
+        hits = index.get(key) if key is not None else None
+
+        if hits:
+            for i in hits:
+                yield merge(row, build_rows[i])
+            if keep_build:
+                matched.update(hits)
+        elif keep_probe:
+            yield dict(row)
+
+    # Outer side rows without a partner
+    if keep_build:
+        yield from (dict(r) for i, r in enumerate(build_rows) if i not in matched)
+
+
+# ---------- Spooled inputs ----------
+class SpilledRows:
+    """
+    Rows spooled to a temporary JSON-lines file. Iterable any number of
+    times (each iteration streams the file from the start); the file is
+    removed once the object is garbage collected.
+    """
+
+    def __init__(self, path, count, size):
+        self.path = path
+        self.count = count
+        self.size = size
+        weakref.finalize(self, _remove, path)
+
+    def __iter__(self):
+        with open(self.path, encoding="utf-8") as f:
+            yield from _read_rows(f)
+
+    def __len__(self):
+        return self.count
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def spool_rows(rows, memory_budget=None):
+    """
+    Collect an iterable of rows into a list while it fits memory_budget;
+    past that, write them (including those collected so far) to disk and
+    return SpilledRows instead. Peak memory stays around memory_budget
+    however many rows come in.
+    """
+    memory_budget = memory_budget or get_memory_budget()
+    rows = iter(rows)
+    buffered = []
+    for row in rows:
+        buffered.append(row)
+        if not len(buffered) % SPOOL_CHECK_ROWS and estimate_bytes(buffered) > memory_budget:
+            return _spill(buffered, rows)
+    if estimate_bytes(buffered) > memory_budget:
+        return _spill(buffered, rows)
+    return buffered
+
+
+def _spill(buffered, rows):
+    spill_dir = getattr(settings, "JOIN_SPILL_DIR", None)
+    fd, path = tempfile.mkstemp(prefix="join-", suffix=".jsonl", dir=spill_dir)
+    count = size = 0
+
+    def write(f, chunk):
+        nonlocal count, size
+        for row in chunk:
+            line = json.dumps(row, default=str) + "\n"
+            f.write(line)
+            count += 1
+            size += len(line)
+
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            write(f, buffered)
+            buffered.clear()  # release the in-memory head before streaming the rest
+            write(f, rows)
+    except BaseException:
+        _remove(path)
+        raise
+    logger.info(f"[Join] Spooled {count} input rows (~{size} bytes) to disk")
+    return SpilledRows(path, count, size)
+
+
+# ---------- Out-of-core (grace) hash join ----------
+def grace_hash_join(left_rows, right_rows, left_fields, right_fields, how, build_bytes, memory_budget):
+    """
+    Partition both inputs by key hash into temporary files, then join one
+    partition pair at a time. Rows with equal keys always land in the same
+    partition, so each pair can be joined independently (including outer
+    rows). Joined rows are spooled to disk and streamed back.
+    """
+    partitions = min(MAX_PARTITIONS, max(2, 2 * math.ceil(build_bytes / memory_budget)))
+    spill_dir = getattr(settings, "JOIN_SPILL_DIR", None)
+    logger.info(f"[Join] Spilling join to {partitions} partitions (~{build_bytes} bytes build side)")
+
+    left_parts = _partition(left_rows, left_fields, partitions, spill_dir)
+    right_parts = _partition(right_rows, right_fields, partitions, spill_dir)
+
+    output = tempfile.TemporaryFile(mode="w+", encoding="utf-8", dir=spill_dir)
+    try:
+        for left_file, right_file in zip(left_parts, right_parts):
+            joined = _in_memory_join(
+                list(_read_rows(left_file)),
+                list(_read_rows(right_file)),
+                left_fields,
+                right_fields,
+                how,
+            )
+            for row in joined:
+                output.write(json.dumps(row, default=str) + "\n")
+            left_file.close()
+            right_file.close()
+    except Exception:
+        output.close()
+        for f in left_parts + right_parts:
+            f.close()
+        raise
+
+    return _iter_spooled(output)
+
+
+def _partition(rows, fields, partitions, spill_dir):
+    files = [
+        tempfile.TemporaryFile(mode="w+", encoding="utf-8", dir=spill_dir)
+        for _ in range(partitions)
+    ]
+    for row in rows:
+        key = row_key(row, fields)
+        # NULL keys never match; park them in partition 0 for outer joins
+        index = hash(key) % partitions if key is not None else 0
+        files[index].write(json.dumps(row, default=str) + "\n")
+    for f in files:
+        f.seek(0)
+    return files
+
+
+def _read_rows(f):
+    for line in f:
+        yield json.loads(line)
+
+
+def _iter_spooled(f):
+    f.seek(0)
+    try:
+        yield from _read_rows(f)
+    finally:
+        f.close()
+
+
+def join_datasets(joins, rows):
+    """
+    Run a chain of ChartJoin rows.
+
+    The first join's left dataset is the base relation; each join then
+    attaches one more dataset to the accumulated result. A join whose
+    left dataset is not in the result yet, but whose right dataset is,
+    is applied mirrored (left <-> right, join type flipped).
+
+    rows: {dataset.id: [rows] or SpilledRows}
+
+    Returns a list, or SpilledRows / an iterator when a join had to spill
+    to disk.
+    Raises DeadlineExceeded between joins once the current deadline has
+    passed.
+    """
+    if not joins:
+        return []
+
+    first = joins[0]
+    result = rows.get(first.left_dataset_id, [])
+    joined_ids = {first.left_dataset_id}
+
+    for join in joins:
+        check_deadline("join")
+        how = (join.type or "inner").lower()
+        left_fields = split_fields(join.left_field)
+        right_fields = split_fields(join.right_field)
+
+        if join.left_dataset_id in joined_ids:
+            other_id = join.right_dataset_id
+        elif join.right_dataset_id in joined_ids:
+            other_id = join.left_dataset_id
+            left_fields, right_fields = right_fields, left_fields
+            how = {"left": "right", "right": "left"}.get(how, how)
+        else:
+            raise JoinError(
+                f"Join {join.id} does not connect to the datasets joined so far."
+            )
+
+        result = hash_join(result, rows.get(other_id, []), left_fields, right_fields, how)
+        joined_ids.add(other_id)
+
+    return result
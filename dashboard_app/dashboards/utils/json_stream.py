@@ -0,0 +1,350 @@
+# dashboards/utils/json_stream.py
+"""
+Incremental JSON parsing for large upstream responses.
+
+Instead of resp.json() (full body in memory + full document tree) the
+body is read chunk by chunk and the rows of the detected array
+(top-level list, or the "results" / "data" / "rows" key) are yielded
+one at a time. Two interchangeable parsers:
+
+- "ijson":  C-backed ijson parser, used when the package is installed
+- "stdlib": json.JSONDecoder.raw_decode over a sliding buffer
+"""
+import json
+import tempfile
+
+from django.conf import settings
+
+try:
+    import ijson
+except ImportError:  # optional dependency
+    ijson = None
+
+
+ROW_KEYS = ("results", "data", "rows")  # in order of precedence, like normalize_payload
+CHUNK_SIZE = 64 * 1024
+REPLAY_MEMORY_BYTES = 1024 * 1024  # recorded body kept in memory up to this, then on disk
+
+
+class CountingChunks:
+    """Iterate over byte chunks while counting how many bytes went by."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.bytes = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = next(self._chunks)
+        self.bytes += len(chunk)
+        return chunk
+
+    # file-like API for ijson (chunk sizes are whatever the source yields)
+    def read(self, size=-1):
+        if size == 0:
+            return b""
+        try:
+            return next(self)
+        except StopIteration:
+            return b""
+
+
+def get_parser_name():
+    name = getattr(settings, "DATASET_JSON_PARSER", "auto")
+    if name == "auto":
+        return "ijson" if ijson is not None else "stdlib"
+    if name == "ijson" and ijson is None:
+        raise ImportError("DATASET_JSON_PARSER='ijson' but ijson is not installed")
+    return name
+
+
+class _Recorder(CountingChunks):
+    """
+    Chunks passed through while a copy is kept (in memory, then in a
+    temporary file), so the body can be parsed a second time.
+    """
+
+    def __init__(self, chunks):
+        super().__init__(chunks)
+        self._copy = tempfile.SpooledTemporaryFile(max_size=REPLAY_MEMORY_BYTES)
+
+    def __next__(self):
+        chunk = super().__next__()
+        if self._copy is not None:
+            self._copy.write(chunk)
+        return chunk
+
+    def stop(self):
+        if self._copy is not None:
+            self._copy.close()
+            self._copy = None
+
+    def replay(self):
+        """The recorded body again, chunk by chunk (recording stops)."""
+        copy, self._copy = self._copy, None
+        copy.seek(0)
+        try:
+            while chunk := copy.read(CHUNK_SIZE):
+                yield chunk
+        finally:
+            copy.close()
+
+
+def stream_payload(chunks, parser=None):
+    """
+    Parse a JSON body incrementally into a normalized payload.
+
+    Returns {"data": <row iterator>} when a row array is found; the
+    iterator parses rows as it is consumed. Otherwise the (small) body is
+    parsed whole and normalized like normalize_payload: {"data": [..]}
+    for an object of objects, {"result": body} for anything else.
+
+    Row keys have normalize_payload's precedence ("results" over "data"
+    over "rows"). A "results" array is streamed as soon as it is reached;
+    any other row array can only be picked once the whole object has been
+    seen, so the body is recorded, and parsed a second time to stream the
+    winning array.
+    """
+    parser = parser or get_parser_name()
+    stream_class = _IjsonStream if parser == "ijson" else _StdlibStream
+    recorder = _Recorder(chunks)
+    payload = stream_class(recorder, recorder.stop).payload()
+    if "replay" not in payload:
+        recorder.stop()
+        return payload
+    return stream_class(recorder.replay()).payload(stream_key=payload["replay"])
+
+
+def _fallback(document):
+    """Same rules as dataset_runner.normalize_payload for a fully parsed body."""
+    if not isinstance(document, dict):
+        return {"data": document}
+    if all(isinstance(v, dict) for v in document.values()):
+        return {"data": list(document.values())}
+    return {"result": document}
+
+
+# ---------- stdlib parser ----------
+class _StdlibStream:
+    WHITESPACE = " \t\n\r"
+
+    def __init__(self, chunks, on_stream=None):
+        self.chunks = iter(chunks)
+        self.on_stream = on_stream  # called once a row array is being streamed
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self._pending = b""
+
+    def _fill(self, min_chars=0):
+        """
+        Append the next chunk(s) to the buffer, at least min_chars of text
+        when the input has that much; False at end of input.
+        """
+        if self.eof:
+            return False
+        pieces, size = [], 0
+        while not pieces or size < min_chars:
+            try:
+                chunk = self._pending + next(self.chunks)
+            except StopIteration:
+                self.eof = True
+                if self._pending:
+                    pieces.append(self._pending.decode("utf-8"))
+                    self._pending = b""
+                break
+
+            # Do not split a multi-byte UTF-8 character across chunks
+            try:
+                text = chunk.decode("utf-8")
+                self._pending = b""
+            except UnicodeDecodeError as e:
+                text = chunk[:e.start].decode("utf-8")
+                self._pending = chunk[e.start:]
+            pieces.append(text)
+            size += len(text)
+
+        if not pieces:
+            return False
+        # Drop what has been parsed already to keep the buffer small
+        self.buf = self.buf[self.pos:] + "".join(pieces)
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Invalid JSON: expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+    def _value(self):
+        """Decode one complete JSON value, reading more input as needed."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Incomplete value: at least double what is buffered before
+                # decoding it again, so a large value is parsed in linear time
+                if not self._fill(min_chars=len(self.buf) - self.pos):
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and self.buf[self.pos] not in '{["tfn\"':
+                if self._fill():
+                    continue
+            self.pos = end
+            return value
+
+    def _rows(self):
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self._value()
+            sep = self._peek()
+            self.pos += 1
+            if sep == "]":
+                return
+            if sep != ",":
+                raise ValueError("Invalid JSON: expected ',' or ']' in row array")
+
+    def _stream_rows(self):
+        self.pos += 1
+        if self.on_stream:
+            self.on_stream()
+        return {"data": self._rows()}
+
+    def payload(self, stream_key=None):
+        """
+        Normalized payload, see stream_payload. Without stream_key, a
+        {"replay": key} marker is returned when the winning row array
+        came before the end of the object and was skipped; stream_key
+        then names the array to stream on the second pass.
+        """
+        first = self._peek()
+        if first == "[":
+            return self._stream_rows()
+        if first != "{":
+            return _fallback(self._value())
+
+        # Walk the top-level object looking for row arrays
+        self.pos += 1
+        document, skipped = {}, []
+        if self._peek() == "}":
+            return _fallback(document)
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key in ROW_KEYS and self._peek() == "[":
+                if key == (stream_key or ROW_KEYS[0]):
+                    return self._stream_rows()
+                # A key with more precedence may still follow: skip row by row
+                self.pos += 1
+                for _ in self._rows():
+                    pass
+                skipped.append(key)
+            else:
+                document[key] = self._value()
+            sep = self._peek()
+            self.pos += 1
+            if sep == "}":
+                if skipped:
+                    return {"replay": min(skipped, key=ROW_KEYS.index)}
+                return _fallback(document)
+            if sep != ",":
+                raise ValueError("Invalid JSON: expected ',' or '}' in object")
+
+
+# ---------- ijson parser ----------
+class _IjsonStream:
+    CONTAINER_START = ("start_map", "start_array")
+    CONTAINER_END = ("end_map", "end_array")
+
+    def __init__(self, chunks, on_stream=None):
+        self.events = ijson.parse(CountingChunks(chunks) if not hasattr(chunks, "read") else chunks, use_float=True)
+        self.on_stream = on_stream  # called once a row array is being streamed
+
+    def _build(self, event, value):
+        """Build one complete value that starts with (event, value)."""
+        if event not in self.CONTAINER_START:
+            return value
+        builder = ijson.ObjectBuilder()
+        builder.event(event, value)
+        depth = 1
+        for _, ev, val in self.events:
+            builder.event(ev, val)
+            if ev in self.CONTAINER_START:
+                depth += 1
+            elif ev in self.CONTAINER_END:
+                depth -= 1
+                if depth == 0:
+                    return builder.value
+
+    def _skip(self):
+        """Skip the rest of a container whose start event was just read."""
+        depth = 1
+        for _, event, _ in self.events:
+            if event in self.CONTAINER_START:
+                depth += 1
+            elif event in self.CONTAINER_END:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _stream_rows(self):
+        if self.on_stream:
+            self.on_stream()
+        return {"data": self._rows()}
+
+    def _rows(self):
+        try:
+            for _, event, value in self.events:
+                if event == "end_array":
+                    return
+                yield self._build(event, value)
+        except ijson.JSONError as e:
+            raise ValueError(f"Invalid JSON: {e}") from e
+
+    def payload(self, stream_key=None):
+        """Normalized payload or {"replay": key} marker, see _StdlibStream.payload."""
+        try:
+            return self._payload(stream_key)
+        except (ijson.JSONError, StopIteration) as e:
+            raise ValueError(f"Invalid JSON: {e}") from e
+
+    def _payload(self, stream_key):
+        _, event, value = next(self.events)
+        if event == "start_array":
+            return self._stream_rows()
+        if event != "start_map":
+            return _fallback(value)
+
+        document, skipped = {}, []
+        for _, event, value in self.events:
+            if event == "end_map":
+                break
+            key = value  # map_key
+            _, event, value = next(self.events)
+            if key in ROW_KEYS and event == "start_array":
+                if key == (stream_key or ROW_KEYS[0]):
+                    return self._stream_rows()
+                # A key with more precedence may still follow
+                self._skip()
+                skipped.append(key)
+            else:
+                document[key] = self._build(event, value)
+        if skipped:
+            return {"replay": min(skipped, key=ROW_KEYS.index)}
+        return _fallback(document)
@@ -0,0 +1,80 @@
+# dashboards/utils/jwt_tokens.py
+import hashlib
+import threading
+import time
+
+import jwt
+from django.conf import settings
+
+
+DEFAULT_JWT_TTL = 300
+DEFAULT_REFRESH_MARGIN = 30  # seconds before exp a token is re-signed
+
+# Fields that go into the token -> a new token is required when they change
+JWT_FIELDS = (
+    "jwt_secret",
+    "jwt_subject",
+    "jwt_audience",
+    "jwt_issuer",
+    "jwt_ttl_seconds",
+)
+
+
+def jwt_fingerprint(source):
+    raw = "\x1f".join(str(getattr(source, f, "") or "") for f in JWT_FIELDS)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def sign_source_jwt(source, now=None):
+    """Sign a fresh HS256 token for a JWT_HS256 source. Returns (token, exp)."""
+    now = int(now or time.time())
+    exp = now + (source.jwt_ttl_seconds or DEFAULT_JWT_TTL)
+    claims = {
+        "exp": exp,
+        "sub": source.jwt_subject,
+        "aud": source.jwt_audience,
+    }
+    if source.jwt_issuer:
+        claims["iss"] = source.jwt_issuer
+    return jwt.encode(claims, source.jwt_secret, algorithm="HS256"), exp
+
+
+class JwtTokenCache:
+    """
+    Process-wide cache of signed tokens, one per ApiDataSource.
+
+    A token is reused until JWT_REFRESH_MARGIN_SECONDS before its exp
+    (at most half its lifetime), then re-signed on the next use. It is
+    re-signed right away when the source's secret or claims change.
+    """
+
+    def __init__(self):
+        self._tokens = {}  # source_id -> (fingerprint, exp, token)
+        self._lock = threading.Lock()
+
+    def get(self, source):
+        fingerprint = jwt_fingerprint(source)
+        ttl = source.jwt_ttl_seconds or DEFAULT_JWT_TTL
+        margin = min(getattr(settings, "JWT_REFRESH_MARGIN_SECONDS", DEFAULT_REFRESH_MARGIN), ttl / 2)
+
+        with self._lock:
+            entry = self._tokens.get(source.id)
+            if entry and entry[0] == fingerprint and entry[1] - margin > time.time():
+                return entry[2]
+
+            token, exp = sign_source_jwt(source)
+            # Unsaved (ad-hoc) sources are not cached
+            if source.id is not None:
+                self._tokens[source.id] = (fingerprint, exp, token)
+            return token
+
+    def invalidate(self, source_id):
+        with self._lock:
+            self._tokens.pop(source_id, None)
+
+
+jwt_token_cache = JwtTokenCache()
+
+
+def get_jwt_token(source):
+    return jwt_token_cache.get(source)
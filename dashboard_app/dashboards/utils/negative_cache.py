@@ -0,0 +1,104 @@
+# dashboards/utils/negative_cache.py
+import threading
+import time
+
+import requests
+from django.conf import settings
+
+
+DEFAULT_BACKOFF_SECONDS = 2       # backoff after the first failure
+DEFAULT_BACKOFF_MAX_SECONDS = 120  # ... doubling per failure, up to this
+MAX_ENTRIES = 10000
+
+
+class UpstreamBackoff(requests.RequestException):
+    """
+    Raised instead of calling an upstream that failed for this dataset
+    fingerprint moments ago; carries the failure it is backing off from.
+    """
+
+    def __init__(self, error, status_code, retry_after, failures):
+        self.error = error
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.failures = failures
+        super().__init__(error)
+
+
+def is_upstream_failure(error):
+    """Transport errors (timeouts, refused connections) and 5xx responses."""
+    if not isinstance(error, requests.RequestException):
+        return False
+    response = getattr(error, "response", None)
+    if response is not None:
+        return response.status_code >= 500
+    # Raised by us (circuit open, pagination config, ...), not by the upstream
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class FailureCache:
+    """
+    Process-local negative cache, keyed like the result cache (one entry
+    per dataset fingerprint).
+
+    After an upstream failure, runs of the same fingerprint get the cached
+    error for a backoff window instead of calling the upstream again. The
+    window starts at DATASET_FAILURE_BACKOFF_SECONDS and doubles with every
+    failure in a row, up to DATASET_FAILURE_BACKOFF_MAX_SECONDS; the next
+    success clears the entry.
+    """
+
+    def __init__(self):
+        self._entries = {}  # key -> {"failures", "until", "error", "status_code"}
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """Raise UpstreamBackoff while key is in its backoff window."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            remaining = entry["until"] - time.monotonic()
+            if remaining <= 0:
+                return
+            raise UpstreamBackoff(
+                entry["error"], entry["status_code"], max(1, int(remaining)), entry["failures"]
+            )
+
+    def record_failure(self, key, error, status_code=502):
+        """Start (or lengthen) the backoff for key. Returns its length in seconds."""
+        base = getattr(settings, "DATASET_FAILURE_BACKOFF_SECONDS", DEFAULT_BACKOFF_SECONDS)
+        cap = getattr(settings, "DATASET_FAILURE_BACKOFF_MAX_SECONDS", DEFAULT_BACKOFF_MAX_SECONDS)
+        with self._lock:
+            entry = self._entries.get(key)
+            failures = entry["failures"] + 1 if entry else 1
+            backoff = min(cap, base * 2 ** (failures - 1))
+            self._entries[key] = {
+                "failures": failures,
+                "until": time.monotonic() + backoff,
+                "error": str(error),
+                "status_code": status_code,
+            }
+            if len(self._entries) > MAX_ENTRIES:
+                self._prune()
+            return backoff
+
+    def record_success(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_source(self, source_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == source_id]:
+                del self._entries[key]
+
+    def _prune(self):
+        # Lock must be held. Entries are only needed while backing off,
+        # plus one window to remember the failure streak.
+        cap = getattr(settings, "DATASET_FAILURE_BACKOFF_MAX_SECONDS", DEFAULT_BACKOFF_MAX_SECONDS)
+        cutoff = time.monotonic() - cap
+        for key in [k for k, e in self._entries.items() if e["until"] < cutoff]:
+            del self._entries[key]
+
+
+failure_cache = FailureCache()
@@ -0,0 +1,118 @@
+# dashboards/utils/pagination.py
+import logging
+from urllib.parse import parse_qs, urljoin, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+PAGINATION_TYPES = [
+    ("none", "None"),
+    ("link_header", "Link header (rel=next)"),
+    ("next_field", "JSON next URL field"),
+    ("cursor", "Cursor"),
+    ("offset", "Offset / limit"),
+]
+
+DEFAULT_MAX_PAGES = 100
+DEFAULT_PAGE_SIZE = 100
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def get_path(body, path):
+    """Read a dotted path ("meta.next_cursor") from a JSON body."""
+    value = body
+    for part in (path or "").split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def iter_pages(fetch_page, url, params, pagination_type="none", config=None, keep_params=None, on_truncated=None):
+    """
+    Lazily walk an upstream's pages.
+
+    fetch_page(url, params) must return (body, response) for one GET.
+    Yields (body, response) per page; the next page is only requested
+    once the consumer asks for it.
+
+    keep_params (e.g. API key auth) are sent with every page, including
+    next links / URLs unless they already carry them. When max_pages is
+    reached with pages left, on_truncated() is called before the last
+    page is yielded.
+
+    config keys (all optional):
+      max_pages                       safety cap, default 100
+      next_field                      next_field: body path of the next URL ("next")
+      cursor_field / cursor_param     cursor: body path of the cursor / query param
+      offset_param / limit_param /
+      page_size / start               offset: query params and page size
+    """
+    config = config or {}
+    pagination_type = pagination_type or "none"
+    max_pages = int(config.get("max_pages") or DEFAULT_MAX_PAGES)
+    params = dict(params or {})
+    keep_params = keep_params or {}
+
+    if pagination_type not in dict(PAGINATION_TYPES):
+        raise PaginationError(f"Unknown pagination type: {pagination_type}")
+
+    if pagination_type == "offset":
+        params[config.get("offset_param", "offset")] = int(config.get("start") or 0)
+        params[config.get("limit_param", "limit")] = int(config.get("page_size") or DEFAULT_PAGE_SIZE)
+
+    for page in range(max_pages):
+        body, resp = fetch_page(url, params)
+        next_page = _next_page(body, resp, url, params, pagination_type, config, keep_params)
+        if next_page is not None and page == max_pages - 1:
+            logger.warning(f"[Pagination] Stopped after max_pages={max_pages} for {url}")
+            if on_truncated is not None:
+                on_truncated()
+        yield body, resp
+        if next_page is None:
+            return
+        url, params = next_page
+
+
+def _next_page(body, resp, url, params, pagination_type, config, keep_params):
+    """(url, params) of the page after this one, or None on the last page."""
+    if pagination_type in ("link_header", "next_field"):
+        if pagination_type == "link_header":
+            next_url = resp.links.get("next", {}).get("url")
+        else:
+            next_url = get_path(body, config.get("next_field", "next"))
+        if not next_url:
+            return None
+        # The next URL already carries the query string, except maybe our own params
+        next_url = urljoin(url, str(next_url))
+        carried = parse_qs(urlparse(next_url).query)
+        return next_url, {k: v for k, v in keep_params.items() if k not in carried} or None
+
+    if pagination_type == "cursor":
+        cursor = get_path(body, config.get("cursor_field", "next_cursor"))
+        if cursor in (None, "", False):
+            return None
+        return url, {**params, config.get("cursor_param", "cursor"): cursor}
+
+    if pagination_type == "offset":
+        offset_param = config.get("offset_param", "offset")
+        page_size = int(config.get("page_size") or DEFAULT_PAGE_SIZE)
+        if len(page_rows(body)) < page_size:
+            return None
+        return url, {**params, offset_param: params[offset_param] + page_size}
+
+    return None
+
+
+def page_rows(body):
+    """Row list of one page body (same detection as normalize_payload)."""
+    if isinstance(body, list):
+        return body
+    if isinstance(body, dict):
+        for k in ("results", "data", "rows"):
+            if isinstance(body.get(k), list):
+                return body[k]
+    return []
@@ -0,0 +1,98 @@
+# dashboards/utils/pending_results.py
+"""
+Results that were not ready by a request's deadline.
+
+defer() finishes the work in the background and returns a token; the
+client polls with it until the result is in. Results are kept in the
+Django cache (PENDING_RESULTS_CACHE), so polling only works across
+processes when that cache is shared (Redis / Memcached); with a local
+one, can_defer() is False and results not ready by the deadline are
+returned as timeouts instead.
+"""
+import logging
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+
+from .deadlines import DeadlineExceeded
+from .single_flight import cache_is_shared
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_RESULT_SECONDS = 300  # how long a token can be polled
+DEFAULT_WORKERS = 4
+
+_warned_local_cache = False
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "PENDING_RESULTS_WORKERS", DEFAULT_WORKERS),
+    thread_name_prefix="pending-result",
+)
+
+
+def _cache():
+    return caches[getattr(settings, "PENDING_RESULTS_CACHE", "default")]
+
+
+def can_defer():
+    """Whether tokens can be polled from any process (PENDING_RESULTS_CACHE is shared)."""
+    global _warned_local_cache
+    if cache_is_shared(_cache()):
+        return True
+    if not _warned_local_cache:
+        _warned_local_cache = True
+        logger.warning(
+            "[Pending] PENDING_RESULTS_CACHE is local to this process; "
+            "results not ready by the deadline are returned as timeouts instead of pending tokens"
+        )
+    return False
+
+
+def _store(token, entry):
+    ttl = getattr(settings, "PENDING_RESULTS_SECONDS", DEFAULT_RESULT_SECONDS)
+    _cache().set(f"pending-result:{token}", entry, ttl)
+
+
+def defer(tenant_id, fn):
+    """Run fn() -> (payload, status_code) in the background. Returns a poll token."""
+    token = secrets.token_urlsafe(16)
+    _store(token, {"tenant_id": tenant_id, "done": False})
+
+    def run():
+        close_old_connections()  # long-lived worker: drop stale DB connections
+        try:
+            try:
+                payload, status_code = fn()
+            except DeadlineExceeded as e:
+                payload, status_code = {"error": str(e)}, 504
+            except Exception as e:
+                logger.exception("[Pending] Deferred result crashed")
+                payload, status_code = {"error": str(e)}, 500
+            _store(token, {"tenant_id": tenant_id, "done": True, "payload": payload, "status_code": status_code})
+        finally:
+            close_old_connections()
+
+    _executor.submit(run)
+    return token
+
+
+def pending_payload(token):
+    return {"pending": True, "token": token}, 202
+
+
+def get_result(token, tenant_id):
+    """
+    (payload, status_code) of a deferred result: the result once it is
+    done, pending_payload() until then. None for unknown or expired
+    tokens, and for another tenant's.
+    """
+    entry = _cache().get(f"pending-result:{token}")
+    if entry is None or entry["tenant_id"] != tenant_id:
+        return None
+    if not entry["done"]:
+        return pending_payload(token)
+    return entry["payload"], entry["status_code"]
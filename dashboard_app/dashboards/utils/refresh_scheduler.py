@@ -0,0 +1,91 @@
+# dashboards/utils/refresh_scheduler.py
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import Dataset, DatasetRefreshRun
+from .dataset_runner import refresh_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def due_datasets(now=None):
+    """Materialized datasets whose refresh interval has elapsed."""
+    now = now or timezone.now()
+    return (
+        Dataset.objects
+        .filter(materialized=True, is_deleted=False, refresh_interval_seconds__gt=0)
+        .filter(Q(next_refresh_at__isnull=True) | Q(next_refresh_at__lte=now))
+    )
+
+
+def claim_due_datasets(limit, now=None):
+    """
+    Claim up to `limit` due datasets (due as of `now`, default: now) for
+    this worker.
+
+    The rows are locked with SELECT ... FOR UPDATE SKIP LOCKED and each
+    claimed dataset's next_refresh_at is moved one interval ahead before
+    the transaction commits. Other scheduler nodes skip the locked rows
+    instead of waiting on them, and no longer see them as due afterwards.
+    A worker that dies mid-refresh leaves the dataset to be retried at
+    its next interval.
+    """
+    with transaction.atomic():
+        claimed = list(
+            due_datasets(now)
+            .select_related("api_source")
+            .select_for_update(skip_locked=True, of=("self",))
+            .order_by(F("next_refresh_at").asc(nulls_first=True), "id")[:limit]
+        )
+        now = timezone.now()
+        for dataset in claimed:
+            dataset.next_refresh_at = now + timedelta(seconds=dataset.refresh_interval_seconds)
+            Dataset.objects.filter(pk=dataset.pk).update(next_refresh_at=dataset.next_refresh_at)
+    return claimed
+
+
+def execute_refresh(dataset, trigger="scheduler", mode="auto"):
+    """
+    Refresh a dataset's snapshot and record the run; the resolved mode is
+    stored as soon as it is known, so failed runs keep it too.
+    Returns (run, payload, status_code).
+    """
+    run = DatasetRefreshRun.objects.create(
+        dataset=dataset,
+        tenant_id=dataset.tenant_id,
+        trigger=trigger,
+        worker=WORKER_ID,
+    )
+    started = time.monotonic()
+
+    def record_mode(resolved):
+        run.mode = resolved
+        run.save(update_fields=["mode"])
+
+    try:
+        payload, status_code = refresh_snapshot(dataset, mode, on_mode=record_mode)
+    except Exception as e:
+        logger.exception(f"[Refresh] Dataset {dataset.id} refresh crashed")
+        payload, status_code = {"error": str(e)}, 500
+
+    run.finished_at = timezone.now()
+    run.duration_ms = int((time.monotonic() - started) * 1000)
+    if status_code < 400:
+        run.status = "success"
+        run.rows = payload["rows"]
+        run.fetched_rows = payload["fetched_rows"]
+    else:
+        run.status = "failed"
+        run.error = payload.get("error", "")
+    run.save(update_fields=["status", "mode", "rows", "fetched_rows", "error", "finished_at", "duration_ms"])
+    return run, payload, status_code
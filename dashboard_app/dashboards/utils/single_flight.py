@@ -0,0 +1,155 @@
+# dashboards/utils/single_flight.py
+"""
+Single-flight coalescing of identical dataset fetches.
+
+Within a process, the first caller for a key runs the fetch and
+concurrent callers for the same key wait for its result. Across
+processes, a lock in the Django cache (cache.add) elects one leader; the
+others poll the cache for the result it publishes. This only spans
+processes when the configured cache is shared (Redis / Memcached, ...);
+with a process-local cache (the default LocMemCache) that step is
+skipped, since the in-process coalescing already covers the process.
+
+Followers wait no longer than the current deadline (see deadlines) and
+raise DeadlineExceeded once it has passed.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from .deadlines import check_deadline, remaining_time
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_WAIT_SECONDS = 30  # how long followers wait before fetching themselves
+DEFAULT_LOCK_SECONDS = 60  # lock expiry, in case the leader dies
+DEFAULT_RESULT_SECONDS = 5  # how long a leader's result stays readable
+POLL_INTERVAL = 0.05
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """In-process: at most one running call per key, shared by every caller."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def running(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, fn, wait_seconds=None):
+        """
+        Run fn() unless a call for key is already running, in which case
+        wait for that call and return (or raise) its result. A follower
+        that waits longer than wait_seconds runs fn() itself, unless the
+        current deadline has passed (DeadlineExceeded).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(remaining_time(wait_seconds or get_wait_seconds())):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            check_deadline("single flight wait")
+            logger.warning(f"[SingleFlight] Gave up waiting on {key}, fetching directly")
+            return fn()
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+def get_wait_seconds():
+    return getattr(settings, "SINGLE_FLIGHT_WAIT_SECONDS", DEFAULT_WAIT_SECONDS)
+
+
+def cache_is_shared(cache):
+    """False for cache backends that live inside one process (local memory, dummy)."""
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+def _cache_keys(key):
+    digest = hashlib.sha1(json.dumps(key, default=str).encode("utf-8")).hexdigest()
+    return f"single-flight:lock:{digest}", f"single-flight:result:{digest}"
+
+
+def distributed_flight(key, fn, is_shareable=lambda result: True):
+    """
+    Cross-process single flight through the Django cache.
+
+    The process that wins cache.add() on the lock key runs fn() and
+    publishes the result (when is_shareable(result)) for a few seconds;
+    the others poll for it. When the leader finishes without a shareable
+    result, or the wait times out, followers run fn() themselves.
+
+    Without a shared cache no other process could read the result, so
+    fn() just runs.
+    """
+    cache = caches[getattr(settings, "SINGLE_FLIGHT_CACHE", "default")]
+    if not cache_is_shared(cache):
+        return fn()
+    lock_key, result_key = _cache_keys(key)
+
+    if cache.add(lock_key, WORKER_ID, getattr(settings, "SINGLE_FLIGHT_LOCK_SECONDS", DEFAULT_LOCK_SECONDS)):
+        try:
+            result = fn()
+            if is_shareable(result):
+                cache.set(result_key, result, getattr(settings, "SINGLE_FLIGHT_RESULT_SECONDS", DEFAULT_RESULT_SECONDS))
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    give_up_at = time.monotonic() + remaining_time(get_wait_seconds())
+    while time.monotonic() < give_up_at:
+        result = cache.get(result_key)
+        if result is not None:
+            return result
+        if cache.get(lock_key) is None:
+            # Leader is gone; pick up a result published in the meantime
+            result = cache.get(result_key)
+            if result is not None:
+                return result
+            break
+        time.sleep(POLL_INTERVAL)
+    check_deadline("single flight wait")
+    return fn()
+
+
+single_flight = SingleFlight()
+
+
+def coalesce(key, fn, is_shareable=lambda result: True):
+    """Run fn() once per key across concurrent threads and processes."""
+    return single_flight.do(key, lambda: distributed_flight(key, fn, is_shareable))
@@ -0,0 +1,332 @@
+# dashboards/utils/snapshots.py
+"""
+Columnar on-disk snapshots of materialized datasets.
+
+File layout (little endian):
+
+    MAGIC
+    row group 1: one zlib-compressed chunk per column
+    row group 2: ...
+    footer (JSON): row_count, created_at, meta, and per row group the
+                   row count and each column's name / type / offset / length
+    footer length (uint32)
+    MAGIC
+
+Each column chunk holds one presence byte per row (missing / null /
+value) followed by the non-null values, packed by column type:
+int -> int64, float -> float64, bool -> one byte, str -> uint32 lengths
+plus UTF-8 data, json -> a JSON list (nested or mixed values).
+
+Rows are written in groups of SNAPSHOT_ROW_GROUP_SIZE, so neither
+writing nor reading holds more than one group in memory, and a reader
+only decompresses the columns it is asked for.
+"""
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from array import array
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"DSNAP1"
+FORMAT_VERSION = 1
+SNAPSHOT_ROW_GROUP_SIZE = 65536
+COMPRESSION_LEVEL = 6
+
+_MISSING, _NULL, _VALUE = 0, 1, 2
+_INT64_MIN, _INT64_MAX = -(2 ** 63), 2 ** 63 - 1
+
+
+class _Absent:
+    def __repr__(self):
+        return "<absent>"
+
+
+_ABSENT = _Absent()  # key not present in the row (distinct from null)
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def get_snapshot_dir():
+    return str(getattr(settings, "DATASET_SNAPSHOT_DIR", settings.BASE_DIR / "snapshots"))
+
+
+def snapshot_path(dataset):
+    """Where the latest snapshot of a dataset lives (one file per dataset)."""
+    tenant_id = getattr(dataset, "tenant_id", None)
+    return os.path.join(get_snapshot_dir(), str(tenant_id or "shared"), f"dataset_{dataset.id}.dsnap")
+
+
+# ---------- Column encoding ----------
+def _column_type(values):
+    kinds = {type(v) for v in values if v is not None}
+    if not kinds:
+        return "json"
+    if kinds == {bool}:
+        return "bool"
+    if kinds == {int}:
+        if all(_INT64_MIN <= v <= _INT64_MAX for v in values if v is not None):
+            return "int"
+        return "json"
+    if kinds <= {int, float}:
+        return "float"
+    if kinds == {str}:
+        return "str"
+    return "json"
+
+
+def _encode_column(values, count):
+    """values: one entry per row (_ABSENT for a key the row does not have)."""
+    presence = bytearray(count)
+    present = []
+    for i, value in enumerate(values):
+        if value is _ABSENT:
+            presence[i] = _MISSING
+        elif value is None:
+            presence[i] = _NULL
+        else:
+            presence[i] = _VALUE
+            present.append(value)
+
+    col_type = _column_type(present)
+    if col_type == "int":
+        body = array("q", present).tobytes()
+    elif col_type == "float":
+        body = array("d", (float(v) for v in present)).tobytes()
+    elif col_type == "bool":
+        body = bytes(1 if v else 0 for v in present)
+    elif col_type == "str":
+        encoded = [v.encode("utf-8") for v in present]
+        body = array("I", (len(b) for b in encoded)).tobytes() + b"".join(encoded)
+    else:
+        body = json.dumps(present, default=str, separators=(",", ":")).encode("utf-8")
+
+    return col_type, zlib.compress(bytes(presence) + body, COMPRESSION_LEVEL)
+
+
+def _decode_column(col_type, chunk, count):
+    raw = zlib.decompress(chunk)
+    presence, body = raw[:count], raw[count:]
+    n_values = presence.count(_VALUE)
+
+    if col_type == "int":
+        present = array("q")
+        present.frombytes(body)
+    elif col_type == "float":
+        present = array("d")
+        present.frombytes(body)
+    elif col_type == "bool":
+        present = [b == 1 for b in body]
+    elif col_type == "str":
+        lengths = array("I")
+        lengths.frombytes(body[:4 * n_values])
+        data, pos, present = body[4 * n_values:], 0, []
+        for length in lengths:
+            present.append(data[pos:pos + length].decode("utf-8"))
+            pos += length
+    elif col_type == "json":
+        present = json.loads(body.decode("utf-8"))
+    else:
+        raise SnapshotError(f"Unknown column type: {col_type}")
+
+    values, it = [], iter(present)
+    for flag in presence:
+        if flag == _VALUE:
+            values.append(next(it))
+        elif flag == _NULL:
+            values.append(None)
+        else:
+            values.append(_ABSENT)
+    return values
+
+
+# ---------- Writing ----------
+def write_snapshot(path, rows, meta=None, row_group_size=None):
+    """
+    Write rows (any iterable of dicts) to a snapshot file.
+
+    The file is written next to its destination and moved into place
+    atomically, so readers always see either the old or the new snapshot.
+    meta is stored in the footer once every row is written, so it may be
+    filled in while rows stream (e.g. a running watermark). Returns the footer (row_count, size_bytes, columns, ...).
+    """
+    row_group_size = row_group_size or getattr(settings, "SNAPSHOT_ROW_GROUP_SIZE", SNAPSHOT_ROW_GROUP_SIZE)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            groups, total, batch = [], 0, []
+            for row in rows:
+                if not isinstance(row, dict):
+                    raise SnapshotError(f"Snapshot rows must be objects, got {type(row).__name__}")
+                batch.append(row)
+                if len(batch) >= row_group_size:
+                    groups.append(_write_group(f, batch))
+                    total += len(batch)
+                    batch = []
+            if batch:
+                groups.append(_write_group(f, batch))
+                total += len(batch)
+
+            footer = {
+                "version": FORMAT_VERSION,
+                "row_count": total,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "meta": meta or {},
+                "columns": _schema(groups),
+                "row_groups": groups,
+            }
+            encoded = json.dumps(footer, default=str).encode("utf-8")
+            f.write(encoded)
+            f.write(struct.pack("<I", len(encoded)))
+            f.write(MAGIC)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    footer["size_bytes"] = os.path.getsize(path)
+    return footer
+
+
+def _write_group(f, rows):
+    # Column order follows first appearance in the group
+    names = {}
+    for row in rows:
+        for name in row:
+            names.setdefault(name, None)
+
+    columns = []
+    for name in names:
+        col_type, chunk = _encode_column([row.get(name, _ABSENT) for row in rows], len(rows))
+        columns.append({"name": name, "type": col_type, "offset": f.tell(), "length": len(chunk)})
+        f.write(chunk)
+    return {"rows": len(rows), "columns": columns}
+
+
+def _schema(groups):
+    """Dataset-wide column list; a column typed differently across groups is 'mixed'."""
+    schema = {}
+    for group in groups:
+        for col in group["columns"]:
+            seen = schema.setdefault(col["name"], col["type"])
+            if seen != col["type"]:
+                schema[col["name"]] = "mixed"
+    return [{"name": name, "type": col_type} for name, col_type in schema.items()]
+
+
+# ---------- Reading ----------
+class SnapshotReader:
+    """
+    Read a snapshot's footer up front; decode row groups on demand.
+
+    The file stays open until close() (or the end of a with block), and
+    row groups are read through that same handle: a refresh that replaces
+    the snapshot meanwhile does not affect a reader opened before it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._lock = threading.Lock()
+        try:
+            f = self._file
+            if f.read(len(MAGIC)) != MAGIC:
+                raise SnapshotError(f"Not a dataset snapshot: {path}")
+            f.seek(-(len(MAGIC) + 4), os.SEEK_END)
+            (footer_length,) = struct.unpack("<I", f.read(4))
+            if f.read(len(MAGIC)) != MAGIC:
+                raise SnapshotError(f"Truncated dataset snapshot: {path}")
+            f.seek(-(len(MAGIC) + 4 + footer_length), os.SEEK_END)
+            self.footer = json.loads(f.read(footer_length).decode("utf-8"))
+        except BaseException:
+            self._file.close()
+            raise
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def row_count(self):
+        return self.footer["row_count"]
+
+    @property
+    def meta(self):
+        return self.footer.get("meta") or {}
+
+    @property
+    def columns(self):
+        return self.footer["columns"]
+
+    def rows(self, columns=None):
+        """
+        Yield the rows as dicts, one row group at a time.
+
+        columns: only decode these columns (None = all). Keys a row never
+        had stay absent, so rows round-trip as they were written.
+        """
+        wanted = set(columns) if columns is not None else None
+        for group in self.footer["row_groups"]:
+            count = group["rows"]
+            decoded = []
+            for col in group["columns"]:
+                if wanted is not None and col["name"] not in wanted:
+                    continue
+                decoded.append((col["name"], _decode_column(col["type"], self._read(col), count)))
+
+            for i in range(count):
+                row = {}
+                for name, values in decoded:
+                    value = values[i]
+                    if value is not _ABSENT:
+                        row[name] = value
+                yield row
+
+    def _read(self, col):
+        # Several rows() iterations may share the handle
+        with self._lock:
+            self._file.seek(col["offset"])
+            return self._file.read(col["length"])
+
+
+def open_snapshot(dataset):
+    """
+    SnapshotReader for a dataset's latest snapshot, or None when there is
+    none. The caller closes it (or uses it as a context manager).
+    """
+    path = snapshot_path(dataset)
+    if not os.path.exists(path):
+        return None
+    try:
+        return SnapshotReader(path)
+    except (OSError, ValueError, struct.error) as e:
+        logger.error(f"[Snapshot] Unreadable snapshot for dataset {dataset.id}: {e}")
+        return None
+
+
+def delete_snapshot(dataset):
+    path = snapshot_path(dataset)
+    if os.path.exists(path):
+        os.remove(path)
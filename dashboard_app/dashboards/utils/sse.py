@@ -0,0 +1,74 @@
+# dashboards/utils/sse.py
+"""
+Server-Sent Events responses.
+
+Under ASGI, Django only streams asynchronous iterators (a synchronous one
+is read in full before anything is sent), so event_stream_response()
+wraps the event generator in an async iterator that pulls each event
+from a worker thread. Under WSGI the generator is streamed as is.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def sse_event(data, event=None, event_id=None):
+    """One SSE message; data is sent as JSON."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, cls=JSONEncoder)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets DRF accept `Accept: text/event-stream` on streaming actions; it
+    only renders the non-streamed responses (errors) as a single event.
+    """
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_event(data, event="error").encode(self.charset)
+
+
+def _in_worker(func, *args):
+    """Run func(*args) on an asgiref worker thread, which may query the ORM."""
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def _async_events(events):
+    done = object()
+    step = sync_to_async(_in_worker, thread_sensitive=False)
+    try:
+        while True:
+            event = await step(next, events, done)
+            if event is done:
+                return
+            yield event
+    finally:
+        # Client went away (or the stream ended): stop the producer
+        await step(events.close)
+
+
+def event_stream_response(request, events):
+    """StreamingHttpResponse sending events (a generator of sse_event strings)."""
+    http_request = getattr(request, "_request", request)  # DRF Request -> HttpRequest
+    content = _async_events(events) if isinstance(http_request, ASGIRequest) else events
+    response = StreamingHttpResponse(content, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx: do not buffer the stream
+    return response
@@ -0,0 +1,205 @@
+# dashboards/utils/transfer.py
+"""
+Compressed upstream transfers.
+
+Response bodies are read raw from the socket (decode_content=False) and
+decompressed chunk by chunk on their way into the JSON parser, so a
+compressed body is never held in memory in full, and the bytes that
+actually crossed the network can be counted per source.
+
+gzip and deflate are always supported; br and zstd when the optional
+brotli (or brotlicffi) / zstandard packages are installed.
+"""
+import threading
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+
+CHUNK_SIZE = 64 * 1024
+
+_DECODE_ERRORS = tuple(
+    error
+    for error in (
+        zlib.error,
+        getattr(brotli, "error", None),
+        getattr(zstandard, "ZstdError", None),
+    )
+    if error is not None
+)
+
+SUPPORTED_ENCODINGS = tuple(
+    encoding
+    for encoding, available in (
+        ("gzip", True),
+        ("deflate", True),
+        ("br", brotli is not None),
+        ("zstd", zstandard is not None),
+    )
+    if available
+)
+
+
+# ---------- Streaming decoders ----------
+class _ZlibDecoder:
+    def __init__(self, wbits):
+        self._obj = zlib.decompressobj(wbits)
+
+    def decompress(self, data):
+        return self._obj.decompress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class _DeflateDecoder:
+    """'deflate' is zlib-wrapped per the RFC, but some servers send raw deflate."""
+
+    def __init__(self):
+        self._obj = zlib.decompressobj()
+        self._first = True
+        self._buffered = b""
+
+    def decompress(self, data):
+        if not self._first:
+            return self._obj.decompress(data)
+        self._buffered += data
+        try:
+            out = self._obj.decompress(self._buffered)
+            self._first = False
+            self._buffered = b""
+            return out
+        except zlib.error:
+            self._first = False
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            data, self._buffered = self._buffered, b""
+            return self._obj.decompress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class _BrotliDecoder:
+    def __init__(self):
+        self._obj = brotli.Decompressor()
+
+    def decompress(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return b""
+
+
+class _ZstdDecoder:
+    def __init__(self):
+        self._obj = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data):
+        return self._obj.decompress(data)
+
+    def flush(self):
+        return b""
+
+
+def make_decoder(encoding):
+    if encoding in ("gzip", "x-gzip"):
+        return _ZlibDecoder(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return _DeflateDecoder()
+    if encoding == "br" and brotli is not None:
+        return _BrotliDecoder()
+    if encoding == "zstd" and zstandard is not None:
+        return _ZstdDecoder()
+    raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+
+
+def content_encodings(resp):
+    """Encodings of a response, in the order they were applied."""
+    header = resp.headers.get("Content-Encoding", "")
+    return [e.strip().lower() for e in header.split(",") if e.strip() and e.strip().lower() != "identity"]
+
+
+def iter_decoded(resp, chunk_size=CHUNK_SIZE, source_id=None):
+    """
+    Yield a (stream=True) response's body decompressed, chunk by chunk.
+    Wire and decoded byte counts are recorded in transfer_stats once the
+    body has been read (or the generator is closed).
+    """
+    encodings = content_encodings(resp)
+    decoders = [make_decoder(e) for e in reversed(encodings)]
+    wire_bytes = body_bytes = 0
+    try:
+        for chunk in resp.raw.stream(chunk_size, decode_content=False):
+            wire_bytes += len(chunk)
+            for decoder in decoders:
+                chunk = decoder.decompress(chunk)
+            if chunk:
+                body_bytes += len(chunk)
+                yield chunk
+
+        tail = b""
+        for decoder in decoders:
+            tail = decoder.decompress(tail) + decoder.flush()
+        if tail:
+            body_bytes += len(tail)
+            yield tail
+    except _DECODE_ERRORS as e:
+        raise ValueError(f"Could not decompress upstream response: {e}") from e
+    finally:
+        transfer_stats.record(source_id, "+".join(encodings) or "identity", wire_bytes, body_bytes)
+
+
+def read_body(resp, source_id=None):
+    """Whole decompressed body of a (stream=True) response."""
+    return b"".join(iter_decoded(resp, source_id=source_id))
+
+
+# ---------- Stats ----------
+class TransferStats:
+    """
+    Per-source byte counters: bytes on the wire (compressed) vs decoded
+    body bytes, by Content-Encoding.
+    """
+
+    def __init__(self):
+        self._stats = {}  # source_id -> {encoding: [responses, wire_bytes, body_bytes]}
+        self._lock = threading.Lock()
+
+    def record(self, source_id, encoding, wire_bytes, body_bytes):
+        if source_id is None:
+            return
+        with self._lock:
+            counters = self._stats.setdefault(source_id, {}).setdefault(encoding, [0, 0, 0])
+            counters[0] += 1
+            counters[1] += wire_bytes
+            counters[2] += body_bytes
+
+    def stats(self, source_id):
+        with self._lock:
+            by_encoding = {k: list(v) for k, v in self._stats.get(source_id, {}).items()}
+        wire = sum(v[1] for v in by_encoding.values())
+        body = sum(v[2] for v in by_encoding.values())
+        return {
+            "responses": sum(v[0] for v in by_encoding.values()),
+            "wire_bytes": wire,
+            "body_bytes": body,
+            "compression_ratio": round(body / wire, 2) if wire else None,
+            "by_encoding": {
+                encoding: {"responses": n, "wire_bytes": w, "body_bytes": b}
+                for encoding, (n, w, b) in by_encoding.items()
+            },
+        }
+
+
+transfer_stats = TransferStats()
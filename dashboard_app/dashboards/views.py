@@ -1,5 +1,6 @@
 import time
 import logging
+from collections.abc import Iterator
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.contrib.auth.tokens import default_token_generator
@@ -7,6 +8,7 @@ from django.core.mail import send_mail
 from django.conf import settings
 from rest_framework import viewsets, status
 from rest_framework.permissions import IsAdminUser, AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes
 from .models import (
@@ -25,6 +27,7 @@ from .serializers import (
     GroupSerializer, 
     ApiDataSourceSerializer,
     DatasetSerializer,
+    DatasetRefreshRunSerializer,
     ChartSerializer,
     DashboardSerializer,
     DashboardChartSerializer,
@@ -43,8 +46,29 @@ from .serializers import UserSerializer, GroupNestedSerializer, TenantSignupSeri
 from tenants.middleware import get_current_tenant
 from tenants.models import TenantUser
 from subscriptions.utils.subscription_limits import enforce_subscription_limit
+from subscriptions.utils.api_row_meter import ApiRowQuotaExceeded, api_row_meter
 from django.db.models import Q
 from .permissions import IsSuperAdmin
+from .utils.circuit_breaker import CircuitOpenError, breaker_registry, get_breaker, guarded_get
+from .utils.dataset_cache import dataset_cache, make_cache_key
+from .utils.negative_cache import failure_cache
+from .utils.chart_runner import (
+    CHART_PREFETCH_RELATED,
+    CHART_SELECT_RELATED,
+    DEFAULT_DASHBOARD_DEADLINE_SECONDS,
+    run_chart,
+    run_charts,
+    stream_charts,
+)
+from .utils.sse import EventStreamRenderer, event_stream_response, sse_event
+from .utils.pending_results import get_result
+from .utils.dataset_runner import REFRESH_MODES, read_payload, run_dataset
+from .utils.refresh_scheduler import execute_refresh
+from .utils.snapshots import delete_snapshot
+from .utils.http_sessions import get_session, session_registry
+from .utils.transfer import transfer_stats
+from .utils.hedging import hedge_budget
+from .utils.jwt_tokens import get_jwt_token, jwt_token_cache
 from rest_framework.exceptions import PermissionDenied
 from rest_framework_simplejwt.tokens import AccessToken
 from datetime import timedelta
@@ -348,11 +372,22 @@ class ApiDataSourceViewSet(viewsets.ModelViewSet):
             created_by=self.request.user
         )
 
+    def perform_update(self, serializer):
+        source = serializer.save()
+        # URL / credentials may have changed -> cached results are stale
+        dataset_cache.invalidate_source(source.id)
+        session_registry.invalidate(source.id)
+        jwt_token_cache.invalidate(source.id)
+        breaker_registry.reset(source.id)
+        failure_cache.invalidate_source(source.id)
+
     # ♻️ Soft delete
     def destroy(self, request, *args, **kwargs):
         obj = self.get_object()
         obj.is_deleted = True
         obj.save(update_fields=["is_deleted"])
+        session_registry.invalidate(obj.id)
+        jwt_token_cache.invalidate(obj.id)
 
         return Response(
             {"success": True, "message": "API source moved to recycle bin"},
@@ -374,6 +409,17 @@ class ApiDataSourceViewSet(viewsets.ModelViewSet):
             {"success": True, "message": "API source restored"}
         )
 
+    # 🩺 Upstream health (circuit breaker, latency, adaptive timeout, compression)
+    @action(detail=True, methods=["get"])
+    def health(self, request, pk=None):
+        source = self.get_object()
+        return Response({
+            "api_source": source.id,
+            **get_breaker(source).stats(),
+            "transfer": transfer_stats.stats(source.id),
+            "hedging": hedge_budget.stats(source.id),
+        })
+
 
 
 # ---------- Datasets ----------
@@ -407,6 +453,15 @@ class DatasetViewSet(viewsets.ModelViewSet):
             tenant=tenant
         )
 
+    def perform_update(self, serializer):
+        # Endpoint / params / pagination may have changed -> drop the old result
+        tenant = get_current_tenant()
+        old_key = make_cache_key(tenant, serializer.instance)
+        dataset = serializer.save()
+        for key in {old_key, make_cache_key(tenant, dataset)}:
+            dataset_cache.invalidate(key)
+            failure_cache.record_success(key)
+
     def get_object(self):
         tenant = get_current_tenant()
         return get_object_or_404(
@@ -447,45 +502,39 @@ class DatasetViewSet(viewsets.ModelViewSet):
         )
         return self._run_dataset(dataset)
 
-    # ---------- Internal Dataset Runner ----------
-    def _run_dataset(self, dataset):
-        source = dataset.api_source
-        endpoint = dataset.endpoint or ""
-        url = urljoin(source.base_url.rstrip("/") + "/", endpoint.lstrip("/"))
+    # ---------- Materialized Snapshot Refresh ----------
+    @action(detail=True, methods=["post"])
+    def refresh(self, request, pk=None):
+        dataset = self.get_object()
+        if not dataset.materialized:
+            return Response(
+                {"error": "Dataset is not materialized."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        mode = request.data.get("mode", "auto")
+        if mode not in REFRESH_MODES:
+            return Response(
+                {"error": f"mode must be one of {', '.join(REFRESH_MODES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        _, payload, status_code = execute_refresh(dataset, trigger="manual", mode=mode)
+        return Response(payload, status=status_code)
 
-        params = dataset.query_params or {}
-        headers = {}
+    @action(detail=True, methods=["get"], url_path="refresh-runs")
+    def refresh_runs(self, request, pk=None):
+        dataset = self.get_object()
+        runs = dataset.refresh_runs.all()[:50]
+        return Response(DatasetRefreshRunSerializer(runs, many=True).data)
 
-        # Handle API auth types
-        if source.auth_type == "API_KEY_HEADER" and source.api_key:
-            headers[source.api_key_header] = source.api_key
-        elif source.auth_type == "BEARER" and source.api_key:
-            headers["Authorization"] = f"Bearer {source.api_key}"
-        elif source.auth_type == "API_KEY_QUERY" and source.api_key:
-            params.update({source.api_key_header: source.api_key})
+    # ---------- Result Cache Stats ----------
+    @action(detail=False, methods=["get"], url_path="cache-stats")
+    def cache_stats(self, request):
+        return Response(dataset_cache.stats(get_current_tenant()))
 
-        try:
-            resp = requests.get(url, headers=headers, params=params, timeout=15)
-            resp.raise_for_status()
-            data = resp.json()
-
-            # Normalize response to list of dicts
-            if isinstance(data, dict):
-                for k in ("results", "data", "rows"):
-                    if k in data and isinstance(data[k], list):
-                        data = data[k]
-                        break
-                else:
-                    if all(isinstance(v, dict) for v in data.values()):
-                        data = list(data.values())
-                    else:
-                        return Response({"result": data})
-
-            return Response({"data": data})
-
-        except requests.RequestException as e:
-            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
-        
+    # ---------- Internal Dataset Runner ----------
+    def _run_dataset(self, dataset):
+        payload, status_code = run_dataset(dataset, get_current_tenant())
+        return Response(payload, status=status_code, headers=stale_headers(payload))
 
     def destroy(self, request, *args, **kwargs):
         dataset = self.get_object()
@@ -520,6 +569,7 @@ class DatasetViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=["delete"])
     def hard_delete(self, request, pk=None):
         dataset = self.get_object()
+        delete_snapshot(dataset)
         dataset.delete()
 
         return Response(
@@ -585,18 +635,10 @@ def run_dataset_wicket(dataset):
             logger.info("[Auth] API Key added to query params")
 
         elif source.auth_type == "JWT_HS256":
-            # Wicket JWT requirements
-            payload = {
-                "exp": int(time.time()) + (source.jwt_ttl_seconds or 300),  # short expiry
-                "sub": source.jwt_subject,  # API admin UUID
-                "aud": source.jwt_audience,  # tenant API URL
-            }
-            if source.jwt_issuer:
-                payload["iss"] = source.jwt_issuer
-
-            token = jwt.encode(payload, source.jwt_secret, algorithm="HS256")
+            # Wicket JWT (sub = API admin UUID, aud = tenant API URL), reused until near exp
+            token = get_jwt_token(source)
             headers["Authorization"] = f"Bearer {token}"
-            logger.info(f"[Auth] JWT token generated (truncated)={token[:20]}...")
+            logger.info(f"[Auth] JWT token ready (truncated)={token[:20]}...")
 
         else:
             logger.warning(f"[Auth] No auth applied for auth_type={source.auth_type}")
@@ -608,27 +650,30 @@ def run_dataset_wicket(dataset):
     # --- MAKE REQUEST ---
     try:
         logger.info(f"[Request] GET {url} Headers={headers} Params={params}")
-        resp = requests.get(url, headers=headers, params=params, timeout=15)
-        logger.info(f"[Response] Status={resp.status_code} Body={resp.text[:200]}")
+        resp = guarded_get(get_session(source), source, url, headers=headers, params=params, stream=True)
+        logger.info(f"[Response] Status={resp.status_code} Length={resp.headers.get('Content-Length')}")
 
         resp.raise_for_status()
-        data = resp.json()
-
-        # normalize list of dicts
-        if isinstance(data, dict):
-            for k in ("results", "data", "rows"):
-                if k in data and isinstance(data[k], list):
-                    data = data[k]
-                    break
-            else:
-                if all(isinstance(v, dict) for v in data.values()):
-                    data = list(data.values())
-                else:
-                    return Response({"result": data})
 
+        # normalize list of dicts (large bodies are parsed incrementally)
+        payload, _ = read_payload(resp, source_id=source.id)
+        if "data" not in payload:
+            return Response(payload)
+
+        data = payload["data"]
+        if isinstance(data, (list, Iterator)):
+            tenant = get_current_tenant()
+            data = list(api_row_meter.meter_rows(getattr(tenant, "id", None), data))
         return Response(data)
 
-    except requests.RequestException as e:
+    except ApiRowQuotaExceeded as e:
+        return Response({"error": str(e)}, status=429)
+
+    except CircuitOpenError as e:
+        logger.warning(f"[Request] Skipped, {e}")
+        return Response({"error": str(e), "retry_after": e.retry_after}, status=503)
+
+    except (requests.RequestException, ValueError) as e:
         logger.exception("Request to Wicket failed")
         return Response({"error": str(e)}, status=502)
 
@@ -641,9 +686,13 @@ class ChartViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         tenant = get_current_tenant()
-        if tenant:
-            return Chart.objects.filter(tenant=tenant)
-        return Chart.objects.none()
+        if not tenant:
+            return Chart.objects.none()
+
+        qs = Chart.objects.filter(tenant=tenant)
+        if self.action == "run":
+            qs = qs.select_related(*CHART_SELECT_RELATED).prefetch_related(*CHART_PREFETCH_RELATED)
+        return qs
 
     def create(self, request, *args, **kwargs):
         try:
@@ -670,71 +719,15 @@ class ChartViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=["post"])
     def run(self, request, pk=None):
         chart = self.get_object()
+        payload, status_code = run_chart(chart, get_current_tenant())
+        return Response(payload, status=status_code, headers=stale_headers(payload))
 
-        # Excel chart
-        if chart.excel_data:
-            return Response({"data": chart.excel_data})
 
-        # Multi-dataset joins
-        if chart.joins.exists():
-            return self._run_chart_with_joins(chart)
-
-        # Single dataset
-        if chart.dataset:
-            return self._run_dataset(chart.dataset)
-
-        return Response(
-            {"error": "Chart has no dataset, joins, or Excel data."},
-            status=status.HTTP_400_BAD_REQUEST,
-        )
-
-    # ------------------------
-    # Internal helpers
-    # ------------------------
-    def _run_dataset(self, dataset):
-        dv = DatasetViewSet()
-        dv.request = self.request
-        dv.format_kwarg = None
-        return dv._run_dataset(dataset)
-
-    def _run_chart_with_joins(self, chart):
-        joins = chart.joins.all()
-        if not joins:
-            return Response({"error": "No joins found"}, status=400)
-
-        tenant = get_current_tenant()
-        datasets = {}
-
-        # Fetch datasets, filtered by tenant
-        for join in joins:
-            for ds in [join.left_dataset, join.right_dataset]:
-                if ds.id not in datasets:
-                    if ds.tenant != tenant:
-                        continue  # skip datasets outside tenant
-                    resp = self._run_dataset(ds)
-                    if isinstance(resp.data, dict) and "data" in resp.data:
-                        datasets[ds.id] = resp.data["data"]
-                    else:
-                        datasets[ds.id] = resp.data
-
-        # Simple inner join for first join only
-        join = joins[0]
-        left_rows = datasets.get(join.left_dataset.id, [])
-        right_rows = datasets.get(join.right_dataset.id, [])
-
-        left_key = join.left_field
-        right_key = join.right_field
-
-        joined_data = []
-        right_index = {r[right_key]: r for r in right_rows if right_key in r}
-
-        for l in left_rows:
-            key = l.get(left_key)
-            if key in right_index:
-                merged = {**l, **right_index[key]}
-                joined_data.append(merged)
-
-        return Response({"data": joined_data})
+def stale_headers(payload):
+    """Age header (seconds) for a result served stale from the cache."""
+    if isinstance(payload, dict) and payload.get("stale") and payload.get("age") is not None:
+        return {"Age": str(payload["age"])}
+    return None
 
 # ---------- Dashboards ----------
 class DashboardViewSet(viewsets.ModelViewSet):
@@ -797,6 +790,92 @@ class DashboardViewSet(viewsets.ModelViewSet):
 
         return Response(DashboardChartSerializer(dc).data)
 
+    # ---------- Run every chart on the dashboard ----------
+    @action(detail=True, methods=["post"])
+    def run(self, request, pk=None):
+        dashboard = self.get_object()
+        tenant = get_current_tenant()
+
+        # Charts not ready by the deadline come back pending, with a token to poll
+        deadline_ms = request.data.get("deadline_ms")
+        if deadline_ms is None:
+            deadline = getattr(settings, "DASHBOARD_DEADLINE_SECONDS", DEFAULT_DASHBOARD_DEADLINE_SECONDS)
+        else:
+            try:
+                deadline = float(deadline_ms) / 1000
+            except (TypeError, ValueError):
+                deadline = 0
+            if deadline <= 0:
+                return Response(
+                    {"error": "deadline_ms must be a positive number."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        dashboard_charts = self._dashboard_charts(dashboard)
+        results, distinct_fetches = run_charts([dc.chart for dc in dashboard_charts], tenant, deadline)
+
+        charts = [
+            self._chart_entry(dc, *results[dc.chart.id])
+            for dc in dashboard_charts
+        ]
+
+        return Response({
+            "dashboard": dashboard.id,
+            "charts": charts,
+            "distinct_fetches": distinct_fetches,
+        })
+
+    # ---------- Stream every chart on the dashboard (SSE) ----------
+    @action(detail=True, methods=["get"], renderer_classes=[JSONRenderer, EventStreamRenderer])
+    def stream(self, request, pk=None):
+        """
+        Server-Sent Events: one "chart" event per dashboard chart as soon
+        as it is computed (same shape as the entries of run), then "done".
+        """
+        dashboard = self.get_object()
+        tenant = get_current_tenant()
+        dashboard_charts = self._dashboard_charts(dashboard)
+
+        by_chart = {}
+        for dc in dashboard_charts:
+            by_chart.setdefault(dc.chart.id, []).append(dc)
+        charts = [dcs[0].chart for dcs in by_chart.values()]
+
+        def events():
+            # Runs outside the request thread under ASGI: no thread-local tenant here
+            for chart, (payload, status_code) in stream_charts(charts, tenant):
+                for dc in by_chart[chart.id]:
+                    yield sse_event(self._chart_entry(dc, payload, status_code), event="chart", event_id=dc.id)
+            yield sse_event({"dashboard": dashboard.id}, event="done")
+
+        return event_stream_response(request, events())
+
+    def _dashboard_charts(self, dashboard):
+        return list(
+            dashboard.dashboard_charts
+            .select_related(*(f"chart__{f}" for f in CHART_SELECT_RELATED))
+            .prefetch_related(*(f"chart__{f}" for f in CHART_PREFETCH_RELATED))
+            .order_by("order")
+        )
+
+    @staticmethod
+    def _chart_entry(dc, payload, status_code):
+        return {
+            "dashboard_chart_id": dc.id,
+            "chart_id": dc.chart.id,
+            "status": status_code,
+            **payload,
+        }
+
+    # ---------- Poll a chart that missed the run deadline ----------
+    @action(detail=False, methods=["get"], url_path=r"pending/(?P<token>[^/.]+)")
+    def pending(self, request, token=None):
+        result = get_result(token, getattr(get_current_tenant(), "id", None))
+        if result is None:
+            return Response({"error": "Unknown or expired token."}, status=status.HTTP_404_NOT_FOUND)
+        payload, status_code = result
+        return Response(payload, status=status_code)
+
     # ---------- Delete dashboard ----------
     def destroy(self, request, *args, **kwargs):
         self.get_object()  # ensures tenant filtering
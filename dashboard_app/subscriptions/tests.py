@@ -1,3 +1,39 @@
 from django.test import TestCase
 
-# Create your tests here.
+from tenants.models import Tenant
+
+from .models import TenantSubscription
+from .utils.api_row_meter import ApiRowMeter, ApiRowQuotaExceeded
+
+
+class ApiRowMeterTests(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="tenant", subdomain="tenant")
+        self.subscription = TenantSubscription.objects.create(
+            tenant=self.tenant, active=True, max_api_rows=10, api_rows_used=4
+        )
+        self.meter = ApiRowMeter()
+
+    def test_rows_over_the_quota_are_not_handed_out(self):
+        rows = []
+        with self.assertRaises(ApiRowQuotaExceeded):
+            for row in self.meter.meter_rows(self.tenant.id, range(20)):
+                rows.append(row)
+        self.assertEqual(rows, list(range(6)))
+        self.assertEqual(self.meter.remaining(self.tenant.id), 0)
+
+    def test_pending_usage_is_flushed_in_one_update(self):
+        list(self.meter.meter_rows(self.tenant.id, range(3)))
+        list(self.meter.meter_rows(self.tenant.id, range(2)))
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.api_rows_used, 4)
+
+        self.meter.flush()
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.api_rows_used, 9)
+        self.assertEqual(self.meter.remaining(self.tenant.id), 1)
+
+    def test_tenants_without_a_subscription_are_not_metered(self):
+        self.assertIsNone(self.meter.remaining(None))
+        other = Tenant.objects.create(name="other", subdomain="other")
+        self.assertEqual(len(list(self.meter.meter_rows(other.id, range(20)))), 20)
@@ -0,0 +1,141 @@
+# subscriptions/utils/api_row_meter.py
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from subscriptions.models import TenantSubscription
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_FLUSH_SECONDS = 10     # flush pending usage at most this often
+DEFAULT_FLUSH_ROWS = 50000     # ... or once this many rows are pending
+DEFAULT_LIMIT_CACHE_SECONDS = 30
+
+
+class ApiRowQuotaExceeded(Exception):
+    def __init__(self, limit):
+        self.limit = limit
+        super().__init__(f"API rows limit reached ({limit}). Please upgrade your plan.")
+
+
+class ApiRowMeter:
+    """
+    Process-wide meter of rows pulled from upstream APIs, per tenant.
+
+    Usage is counted in memory and written to TenantSubscription.api_rows_used
+    in batches (one F() update per tenant per flush), so the request path
+    never waits on a write. Limits are read from the active subscription
+    and cached for a few seconds; between reloads each process adds its
+    own unflushed usage, so several processes can overshoot a limit by at
+    most what they pull within one cache period.
+    """
+
+    def __init__(self):
+        self._pending = {}  # tenant_id -> rows not yet flushed
+        self._quotas = {}   # tenant_id -> {"limit", "used", "local", "loaded_at"}
+        self._pending_rows = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    # ---------- Quota ----------
+    def remaining(self, tenant_id):
+        """Rows the tenant may still pull, or None when it is not metered."""
+        if tenant_id is None:
+            return None
+        quota = self._quota(tenant_id)
+        if quota["limit"] is None:
+            return None
+        return max(0, quota["limit"] - quota["used"] - quota["local"])
+
+    def _quota(self, tenant_id):
+        ttl = getattr(settings, "API_ROWS_LIMIT_CACHE_SECONDS", DEFAULT_LIMIT_CACHE_SECONDS)
+        with self._lock:
+            quota = self._quotas.get(tenant_id)
+            if quota and time.monotonic() - quota["loaded_at"] < ttl:
+                return quota
+
+        sub = (
+            TenantSubscription.objects
+            .filter(tenant_id=tenant_id, active=True)
+            .values("max_api_rows", "api_rows_used")
+            .first()
+        )
+        with self._lock:
+            quota = {
+                # No active subscription: nothing to meter against
+                "limit": sub["max_api_rows"] if sub else None,
+                "used": sub["api_rows_used"] if sub else 0,
+                # The DB value does not include what is still pending here
+                "local": self._pending.get(tenant_id, 0),
+                "loaded_at": time.monotonic(),
+            }
+            self._quotas[tenant_id] = quota
+            return quota
+
+    # ---------- Usage ----------
+    def add(self, tenant_id, rows):
+        if tenant_id is None or rows <= 0:
+            return
+        with self._lock:
+            self._pending[tenant_id] = self._pending.get(tenant_id, 0) + rows
+            self._pending_rows += rows
+            if tenant_id in self._quotas:
+                self._quotas[tenant_id]["local"] += rows
+            due = (
+                self._pending_rows >= getattr(settings, "API_ROWS_FLUSH_ROWS", DEFAULT_FLUSH_ROWS)
+                or time.monotonic() - self._last_flush >= getattr(settings, "API_ROWS_FLUSH_SECONDS", DEFAULT_FLUSH_SECONDS)
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write pending usage with one atomic F() increment per tenant."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_rows = 0
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+
+        try:
+            with transaction.atomic():
+                for tenant_id, rows in pending.items():
+                    TenantSubscription.objects.filter(tenant_id=tenant_id).update(
+                        api_rows_used=F("api_rows_used") + rows
+                    )
+        except Exception:
+            logger.exception("[ApiRows] Usage flush failed, keeping it for the next flush")
+            with self._lock:
+                for tenant_id, rows in pending.items():
+                    self._pending[tenant_id] = self._pending.get(tenant_id, 0) + rows
+                    self._pending_rows += rows
+
+    def meter_rows(self, tenant_id, rows):
+        """
+        Pass rows through while counting them against the tenant's quota.
+
+        Raises ApiRowQuotaExceeded (from the iteration) once the quota is
+        used up, before the first row over the limit is handed out, so a
+        runaway pull stops early. Counted rows are added to the usage
+        even when the consumer stops half way.
+        """
+        remaining = self.remaining(tenant_id)
+        count = 0
+        try:
+            for row in rows:
+                if remaining is not None and count >= remaining:
+                    raise ApiRowQuotaExceeded(self._quotas[tenant_id]["limit"])
+                count += 1
+                yield row
+        finally:
+            self.add(tenant_id, count)
+
+
+api_row_meter = ApiRowMeter()
+atexit.register(api_row_meter.flush)